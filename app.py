@@ -1,18 +1,20 @@
 from flask import Flask, render_template, jsonify
-import requests
 from datetime import datetime
 from requests.exceptions import JSONDecodeError
-from flask_caching import Cache
 import time
 import os
 from flask import current_app
 from collections import defaultdict
 import json
+import db
+import footapi
 from match_detail import (
     match_detail,
 )  # match_detail.py should define a function match_detail
+from player_images import player_image, player_sprite
 from team_detail import (
     team_detail,
+    team_stats,
 )  # team_detail.py should define a function team_detail
 
 
@@ -20,16 +22,7 @@ app = Flask(__name__)
 app.jinja_env.globals.update(zip=zip)
 
 
-# Configuring cache
-app.config[
-    "CACHE_TYPE"
-] = "simple"  # In-memory cache for development. For production, consider using "redis" or "memcached".
-cache = Cache(app)
-
-HEADERS = {
-    "X-RapidAPI-Key": "38160290a2msh11355be25f16cf3p1a5fadjsn9d11a902417b",
-    "X-RapidAPI-Host": "footapi7.p.rapidapi.com",
-}
+# Upstream responses are cached persistently by the footapi client (response_cache.py)
 
 
 @app.template_filter("datetimeformat")
@@ -57,7 +50,7 @@ def fixtures():
     today = datetime.now().strftime("%d/%m/%Y")
     day, month, year = today.split("/")
     url = f"https://footapi7.p.rapidapi.com/api/matches/top/{day}/{month}/{year}"
-    response = requests.get(url, headers=HEADERS)
+    response = footapi.get(url)
     data = response.json()
     events = data.get("events", [])
 
@@ -106,5 +99,32 @@ def showTeamDetail(team_id):
     return team_detail(team_id)
 
 
+# Player photos, downloaded on first request and then served from static/images;
+# with a size, the thumbnail of that size (thumbnails.py)
+@app.route("/player-image/<int:player_id>", endpoint="player_image")
+@app.route("/player-image/<int:player_id>/<int:size>", endpoint="player_image")
+def showPlayerImage(player_id, size=None):
+    return player_image(player_id, size)
+
+
+# One sprite sheet of the player photos a page shows (player_images.sprite_for)
+@app.route("/player-sprite/<int:size>/<key>", endpoint="player_sprite")
+def showPlayerSprite(size, key):
+    return player_sprite(size, key)
+
+
+# Polled by the team page while missing stats are ingested in the background
+@app.route("/team/<int:team_id>/stats", endpoint="team_stats")
+def showTeamStats(team_id):
+    return team_stats(team_id)
+
+
+# Queue state of the kickoff-aware scheduler (scheduler.py) for today's fixtures
+@app.route("/scheduler", endpoint="scheduler_status")
+def showSchedulerStatus():
+    since = datetime.combine(datetime.now().date(), datetime.min.time()).timestamp()
+    return jsonify({"tasks": db.scheduler_tasks(since_kickoff=since)})
+
+
 if __name__ == "__main__":
     app.run(debug=True)
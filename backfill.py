@@ -0,0 +1,261 @@
+"""Backfill player match statistics over a date range or whole tournament seasons.
+
+    python backfill.py --from 2024-08-01 --to 2024-08-31
+    python backfill.py --tournament 17:52186 [--from 2024-08-01]
+    python backfill.py --resume [RUN_ID]
+
+Finished matches are collected from each day's /matches/top list, or by paging
+through a tournament season's matches/last/{page} until the pages are older
+than --from. Matches that already have rows in SQLite are skipped; the rest
+are stored as a checkpointed warm run (see db.py, so ``python run.py --status``
+works for backfills too) and split into chunks of BACKFILL_CHUNK_SIZE matches.
+
+BACKFILL_WORKERS worker processes fetch the chunks. Each worker builds its
+matches' rows with run.fetch_match_rows (the players come from the lineups)
+and draws from the shared SQLite rate limiter, so together they never exceed
+the plan limit. Workers never write statistics: the parent process is the only
+DB writer and commits each match's rows with its checkpoint as results arrive.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+from tqdm import tqdm
+
+import db
+import footapi
+import run
+from config import BACKFILL_CHUNK_SIZE, BACKFILL_WORKERS, LINEUP_STATS_INGESTION
+
+# Stop paging a tournament after this many pages even if it has more
+MAX_TOURNAMENT_PAGES = 100
+
+
+def _is_finished(event):
+    return event.get("status", {}).get("type") == "finished"
+
+
+def matches_by_date(start, end):
+    """Finished top matches kicking off between start and end (inclusive), keyed by match id."""
+    matches = {}
+    day = start
+    while day <= end:
+        try:
+            events = run.events_on(day)
+        except Exception as e:
+            print(f"{day}: could not fetch matches ({e}), skipping")
+            events = []
+        finished = [event for event in events if _is_finished(event)]
+        print(f"{day}: {len(finished)} finished matches")
+        matches.update((event["id"], event) for event in finished)
+        day += timedelta(days=1)
+    return matches
+
+
+def tournament_matches(tournament_id, season_id, start=None, end=None):
+    """Finished matches of a tournament season, newest pages first, keyed by match id.
+
+    Paging stops at the last page or once a whole page kicked off before start.
+    """
+    start_ts = datetime.combine(start, datetime.min.time()).timestamp() if start else None
+    end_ts = (
+        datetime.combine(end + timedelta(days=1), datetime.min.time()).timestamp() if end else None
+    )
+    matches = {}
+    for page in range(MAX_TOURNAMENT_PAGES):
+        url = (
+            f"https://footapi7.p.rapidapi.com/api/tournament/{tournament_id}"
+            f"/season/{season_id}/matches/last/{page}"
+        )
+        response = footapi.get(url)
+        if response.status_code != 200:
+            print(
+                f"Tournament {tournament_id}/{season_id} page {page}: "
+                f"status {response.status_code}, stopping"
+            )
+            break
+        data = response.json()
+        events = data.get("events", [])
+        for event in events:
+            kickoff = event.get("startTimestamp") or 0
+            if not _is_finished(event):
+                continue
+            if (start_ts is not None and kickoff < start_ts) or (end_ts is not None and kickoff >= end_ts):
+                continue
+            matches[event["id"]] = event
+        if not data.get("hasNextPage"):
+            break
+        if start_ts is not None and events and max(e.get("startTimestamp") or 0 for e in events) < start_ts:
+            break
+    print(f"Tournament {tournament_id}/{season_id}: {len(matches)} finished matches")
+    return matches
+
+
+def plan_backfill(start=None, end=None, tournaments=()):
+    """Collect the matches to backfill, drop those already stored and record them as a run.
+
+    Returns the new run_id, or None if there is nothing to fetch.
+    """
+    matches = {}
+    if start and not tournaments:
+        matches.update(matches_by_date(start, end or start))
+    for tournament_id, season_id in tournaments:
+        matches.update(tournament_matches(tournament_id, season_id, start, end))
+
+    with db.transaction() as conn:
+        db.upsert_matches(conn, matches.values())
+    stored = db.stored_match_ids(list(matches))
+    # No player ids: every player in each match's lineups gets a row
+    work = {match_id: set() for match_id in matches if match_id not in stored}
+    print(f"Backfill: {len(matches)} finished matches, {len(stored)} already stored, {len(work)} to fetch")
+    if not work:
+        return None
+    return db.create_warm_run(work, {}, kind="backfill")
+
+
+async def _fetch_matches(chunk):
+    results = await asyncio.gather(
+        *(run.fetch_match_rows(match_id, player_ids) for match_id, player_ids in chunk),
+        return_exceptions=True,
+    )
+    fetched = []
+    for (match_id, player_ids), result in zip(chunk, results):
+        if isinstance(result, Exception):
+            result = ([], (set(player_ids), None, str(result)))
+        fetched.append((match_id,) + tuple(result))
+    return fetched
+
+
+def fetch_chunk(chunk):
+    """Worker process entry point: [(match_id, player_ids)] -> [(match_id, rows, result)]."""
+    return footapi.run(_fetch_matches(chunk))
+
+
+def execute_backfill(run_id, workers=BACKFILL_WORKERS, chunk_size=BACKFILL_CHUNK_SIZE):
+    """Fetch a backfill run's unfinished matches in worker processes and store them here.
+
+    Once a match fails with a quota status (420/429) chunks that have not
+    started are cancelled; they stay pending for --resume.
+    Returns the run's final status ("done" or "incomplete").
+    """
+    start_time = time.time()
+    items = sorted(db.unfinished_warm_items(run_id).items())
+    chunks = [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+    print(f"Backfill run {run_id}: {len(items)} matches in {len(chunks)} chunks, {workers} workers")
+    db.set_warm_run_status(run_id, "running")
+
+    progress = tqdm(total=len(items), desc="Backfilling matches")
+    # Spawned workers start clean instead of inheriting this process's client loop and connections
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [executor.submit(fetch_chunk, chunk) for chunk in chunks]
+        quota_exhausted = False
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            try:
+                fetched = future.result()
+            except Exception as e:
+                print(f"Backfill worker failed: {e}")
+                continue
+            for match_id, rows, result in fetched:
+                run.store_match(run_id, match_id, rows, result)
+                if result[1] in run.QUOTA_STATUSES and not quota_exhausted:
+                    print(f"Upstream quota exhausted ({result[1]}); stopping, resume later with --resume")
+                    quota_exhausted = True
+                    for pending in futures:
+                        pending.cancel()
+            progress.update(len(fetched))
+    progress.close()
+
+    unfinished = db.unfinished_warm_items(run_id)
+    status = "incomplete" if unfinished else "done"
+    db.set_warm_run_status(run_id, status)
+    print(
+        f"Backfill run {run_id} {status}: {len(items) - len(unfinished)} matches ingested, "
+        f"{len(unfinished)} left in {time.time() - start_time:.2f}s"
+    )
+    return status
+
+
+def _parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _parse_tournament(value):
+    tournament_id, _, season_id = value.partition(":")
+    if not season_id:
+        raise argparse.ArgumentTypeError("expected TOURNAMENT_ID:SEASON_ID")
+    return int(tournament_id), int(season_id)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Backfill player match statistics for a date range or tournament seasons."
+    )
+    parser.add_argument(
+        "--from",
+        dest="start",
+        type=_parse_date,
+        metavar="YYYY-MM-DD",
+        help="first day to backfill",
+    )
+    parser.add_argument(
+        "--to",
+        dest="end",
+        type=_parse_date,
+        metavar="YYYY-MM-DD",
+        help="last day to backfill (default: --from, or today with --tournament)",
+    )
+    parser.add_argument(
+        "--tournament",
+        action="append",
+        default=[],
+        type=_parse_tournament,
+        metavar="TOURNAMENT_ID:SEASON_ID",
+        help="backfill a tournament season (repeatable); --from/--to narrow it",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=BACKFILL_WORKERS,
+        help=f"worker processes (default {BACKFILL_WORKERS})",
+    )
+    parser.add_argument(
+        "--resume",
+        nargs="?",
+        const="latest",
+        metavar="RUN_ID",
+        help="continue a previous run (default: the latest unfinished one)",
+    )
+    args = parser.parse_args(argv)
+
+    if not LINEUP_STATS_INGESTION:
+        parser.error("backfill takes each match's players from its lineups; enable LINEUP_STATS_INGESTION")
+
+    if args.resume:
+        run_id = (
+            db.latest_warm_run_id(unfinished_only=True, kind="backfill")
+            if args.resume == "latest"
+            else int(args.resume)
+        )
+        if run_id is None:
+            print("Nothing to resume")
+            return
+        if db.warm_run_kind(run_id) not in (None, "backfill"):
+            parser.error(f"run {run_id} is a warm run; resume it with run.py --resume {run_id}")
+    else:
+        if not args.start and not args.tournament:
+            parser.error("give --from/--to or --tournament")
+        end = args.end or (date.today() if args.tournament else args.start)
+        run_id = plan_backfill(args.start, end, args.tournament)
+        if run_id is None:
+            return
+    execute_backfill(run_id, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Per-process background jobs for stats ingestion taken off the request path.
+
+A job is identified by a key (e.g. ("team", team_id)) and runs fn(item) for
+each of its items on a small worker pool. Submitting a key that is already
+queued or running returns the existing job instead of starting another, so
+repeated page views and polls never duplicate work. Job progress is kept in
+memory for status polling; the results themselves land in SQLite.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+from config import BACKGROUND_WORKERS, FOOTAPI_CONCURRENCY
+
+ACTIVE_STATUSES = ("queued", "running")
+_JOBS_MAX = 500
+_NO_ITEM = object()
+
+_guard = threading.Lock()
+_executor = None
+_executor_pid = None
+# key -> job dict (see submit())
+_jobs = {}
+
+
+def _get_executor():
+    # Worker threads do not survive a fork; each process gets its own pool
+    global _executor, _executor_pid, _jobs
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(
+            max_workers=BACKGROUND_WORKERS, thread_name_prefix="background"
+        )
+        _executor_pid = os.getpid()
+        _jobs = {}
+    return _executor
+
+
+def _snapshot(job):
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+
+def _evict_finished():
+    # Called with _guard held; drop the oldest finished jobs first
+    if len(_jobs) < _JOBS_MAX:
+        return
+    for key in [k for k, j in _jobs.items() if j["status"] not in ACTIVE_STATUSES]:
+        _jobs.pop(key)
+        if len(_jobs) < _JOBS_MAX:
+            return
+
+
+def _run(job, fn, items, item_workers):
+    with _guard:
+        job["status"] = "running"
+        job["started_at"] = time.time()
+
+    def run_item(item):
+        try:
+            fn(item)
+            ok = True
+        except Exception as e:
+            print(f"Background job {job['key']} failed for {item}: {e}")
+            ok = False
+        with _guard:
+            job["done"] += 1
+            if not ok:
+                job["failed"] += 1
+
+    pending = iter(items)
+    pending_lock = threading.Lock()
+
+    def worker():
+        try:
+            while True:
+                with pending_lock:
+                    item = next(pending, _NO_ITEM)
+                if item is _NO_ITEM:
+                    return
+                run_item(item)
+        finally:
+            # Item threads only live as long as the job; release their SQLite connections
+            db.close_connection()
+
+    workers = [
+        threading.Thread(target=worker, name=f"background-item-{n}", daemon=True)
+        for n in range(max(1, min(item_workers, len(items))))
+    ]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    with _guard:
+        job["status"] = "done"
+        job["finished_at"] = time.time()
+    print(
+        f"Background job {job['key']}: {job['done']} items "
+        f"({job['failed']} failed) in {job['finished_at'] - job['started_at']:.2f}s"
+    )
+
+
+def submit(key, fn, items, item_workers=FOOTAPI_CONCURRENCY):
+    """Run fn(item) for every item in the background and return the job status.
+
+    If a job with the same key is already queued or running it is returned
+    unchanged. item_workers bounds how many items of this job run at once.
+    """
+    items = list(items)
+    with _guard:
+        executor = _get_executor()
+        job = _jobs.get(key)
+        if job is not None and job["status"] in ACTIVE_STATUSES:
+            return _snapshot(job)
+        _evict_finished()
+        job = {
+            "key": key,
+            "status": "queued",
+            "total": len(items),
+            "done": 0,
+            "failed": 0,
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        _jobs[key] = job
+        executor.submit(_run, job, fn, items, item_workers)
+        return _snapshot(job)
+
+
+def status(key):
+    """Return a copy of the job's progress, or None if this process has not seen it."""
+    with _guard:
+        if _executor_pid != os.getpid():
+            return None
+        job = _jobs.get(key)
+        return _snapshot(job) if job is not None else None
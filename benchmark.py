@@ -0,0 +1,124 @@
+"""Compare the ingest engines on the same teams: python benchmark.py TEAM_ID [TEAM_ID ...]
+
+Each engine runs in its own subprocess against a fresh temporary SQLite
+database with the response cache disabled, so every engine starts cold and
+makes its own upstream calls:
+
+- queue:    run.py's default engine (plan every team, then one match queue)
+- pipeline: update.py's streaming asyncio engine
+- threads:  the ThreadPoolExecutor path team pages use without background
+            ingestion (team_detail.collect_team_stats, player by player)
+
+Every engine re-fetches everything, so mind the request quota: benchmark a
+couple of teams, not a whole matchday.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ENGINES = ("queue", "pipeline", "threads")
+RESULT_PREFIX = "BENCHMARK "
+
+
+def _run_threads(team_ids):
+    import footapi
+    import team_detail
+    import team_form
+
+    for team_id in team_ids:
+        players = footapi.get_json(
+            f"https://footapi7.p.rapidapi.com/api/team/{team_id}/players", {}
+        ).get("players", [])
+        previous = footapi.get_json(
+            f"https://footapi7.p.rapidapi.com/api/team/{team_id}/matches/previous/0", {}
+        ).get("events", [])
+        team_detail.collect_team_stats(
+            [player_data["player"]["id"] for player_data in players],
+            team_form.last_finished_matches(previous),
+            {},
+        )
+
+
+def run_child(engine, team_ids):
+    """Run one engine in this process and print its result line for the parent."""
+    import db
+    import footapi
+    import run
+
+    start_time = time.time()
+    if engine == "threads":
+        _run_threads(team_ids)
+    else:
+        run.get_fixtures(engine=engine, team_ids=team_ids)
+    elapsed = time.time() - start_time
+    rows = db.get_connection().execute("SELECT COUNT(*) FROM player_match_stats").fetchone()[0]
+    print(
+        RESULT_PREFIX
+        + json.dumps(
+            {"seconds": elapsed, "rows": rows, "upstream": footapi.stats().get("upstream", 0)}
+        )
+    )
+
+
+def run_engine(engine, team_ids, workdir):
+    env = dict(
+        os.environ,
+        DATABASE_PATH=os.path.join(workdir, f"{engine}.sqlite"),
+        RESPONSE_CACHE_PATH="",
+    )
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", engine]
+        + [str(team_id) for team_id in team_ids],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX) :])
+    print(f"{engine} failed (exit {completed.returncode}):")
+    print(completed.stdout[-2000:] + completed.stderr[-2000:])
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ingest engines on the same teams from a cold start."
+    )
+    parser.add_argument("team_ids", nargs="+", type=int, metavar="TEAM_ID")
+    parser.add_argument(
+        "--engines",
+        default=",".join(ENGINES),
+        help=f"comma-separated engines to run (default {','.join(ENGINES)})",
+    )
+    parser.add_argument("--child", choices=ENGINES, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child, args.team_ids)
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for engine in args.engines.split(","):
+            print(f"Running {engine}...")
+            results[engine] = run_engine(engine, args.team_ids, workdir)
+
+    print(f"{'engine':<10} {'seconds':>8} {'upstream':>9} {'rows':>7} {'rows/s':>8}")
+    for engine, result in results.items():
+        if result is None:
+            print(f"{engine:<10} {'failed':>8}")
+            continue
+        rate = result["rows"] / result["seconds"] if result["seconds"] else 0.0
+        print(
+            f"{engine:<10} {result['seconds']:>8.2f} {result['upstream']:>9} "
+            f"{result['rows']:>7} {rate:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,4 +5,69 @@ HEADERS = {
     "X-RapidAPI-Host": "footapi7.p.rapidapi.com",
 }
 
+# Player photos are downloaded with their own RapidAPI key, so they do not
+# use up the stats key's quota
+IMAGE_HEADERS = {
+    "X-RapidAPI-Key": "b42bc11359msh98e3d09a1e9557dp173da4jsn260d881d9ab9",
+    "X-RapidAPI-Host": "footapi7.p.rapidapi.com",
+}
+
+# Pull per-player statistics from each match's lineups payload (one call per
+# match) and only fall back to /match/{id}/player/{id}/statistics for players
+# missing from the lineup. Set LINEUP_STATS_INGESTION=0 to use the old path.
+LINEUP_STATS_INGESTION = os.environ.get("LINEUP_STATS_INGESTION", "1") != "0"
+
+# footapi client: max upstream requests in flight per process, default timeout (s)
+FOOTAPI_CONCURRENCY = int(os.environ.get("FOOTAPI_CONCURRENCY", "8"))
+FOOTAPI_TIMEOUT = float(os.environ.get("FOOTAPI_TIMEOUT", "10"))
+
+# Proactive rate limiting shared across threads and processes (see ratelimit.py).
+# RATE_LIMIT_PER_SECOND is the plan limit; 0 disables the limiter.
+RATE_LIMIT_PER_SECOND = float(os.environ.get("RATE_LIMIT_PER_SECOND", "5"))
+RATE_LIMIT_HEADROOM = float(os.environ.get("RATE_LIMIT_HEADROOM", "0.9"))
+RATE_LIMIT_DB_PATH = os.environ.get("RATE_LIMIT_DB_PATH", "ratelimit.sqlite")
+# Longest pause (s) an exhausted window or 420/429 imposes before requests
+# probe the upstream again; a longer x-ratelimit-reset / Retry-After is capped.
+RATE_LIMIT_MAX_PAUSE = float(os.environ.get("RATE_LIMIT_MAX_PAUSE", "60"))
+
+# Persistent footapi response cache shared by the web app and batch jobs
+# (see response_cache.py); set to an empty string to disable.
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", "response_cache.sqlite")
+
+# Raw, never-expiring snapshots of upstream match data (see snapshots.py) used
+# to derive new metrics without re-requesting history; empty string disables.
+SNAPSHOTS_PATH = os.environ.get("SNAPSHOTS_PATH", "snapshots.sqlite")
+
+# SQLite database shared by the web app and batch jobs (see db.py)
+DATABASE_PATH = os.environ.get("DATABASE_PATH", "database.sqlite")
+
+# Team pages render from SQLite straight away and fetch missing player stats
+# in a background worker (see background.py) that the page polls; set
+# TEAM_PAGE_BACKGROUND_INGESTION=0 to fetch everything in the request instead.
+# BACKGROUND_WORKERS is how many teams are ingested at once per process.
+TEAM_PAGE_BACKGROUND_INGESTION = (
+    os.environ.get("TEAM_PAGE_BACKGROUND_INGESTION", "1") != "0"
+)
+BACKGROUND_WORKERS = int(os.environ.get("BACKGROUND_WORKERS", "2"))
+
+# Kickoff-aware scheduler (scheduler.py): warm teams this long before kickoff,
+# poll lineups from this long before kickoff until they are confirmed, and
+# re-read the fixture list this often. SCHEDULER_DAILY_BUDGET caps upstream
+# requests per day and paces them across it (0 = unlimited).
+SCHEDULER_WARM_LEAD_MINUTES = int(os.environ.get("SCHEDULER_WARM_LEAD_MINUTES", "120"))
+SCHEDULER_LINEUP_WINDOW_MINUTES = int(os.environ.get("SCHEDULER_LINEUP_WINDOW_MINUTES", "60"))
+SCHEDULER_LINEUP_POLL_MINUTES = int(os.environ.get("SCHEDULER_LINEUP_POLL_MINUTES", "5"))
+SCHEDULER_FIXTURES_REFRESH_MINUTES = int(os.environ.get("SCHEDULER_FIXTURES_REFRESH_MINUTES", "30"))
+SCHEDULER_DAILY_BUDGET = int(os.environ.get("SCHEDULER_DAILY_BUDGET", "0"))
+
+# Backfill (backfill.py): worker processes fetching matches in parallel, and how
+# many matches each worker takes at a time. Workers share the rate limiter.
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", "4"))
+BACKFILL_CHUNK_SIZE = int(os.environ.get("BACKFILL_CHUNK_SIZE", "20"))
+
+# Pack the player photos a page shows into one sprite sheet request (see
+# player_images.sprite_for; needs Pillow). Set PLAYER_PHOTO_SPRITES=0 for one
+# request per photo.
+PLAYER_PHOTO_SPRITES = os.environ.get("PLAYER_PHOTO_SPRITES", "1") != "0"
+
 # You can add other configuration settings here as needed
@@ -0,0 +1,758 @@
+"""SQLite access shared by the Flask app and the batch jobs.
+
+Every thread gets one pooled connection to DATABASE_PATH, opened once and
+tuned with the same PRAGMAs everywhere (thread_connection() does the same for
+the rate limiter, response cache and snapshot files):
+
+- WAL journal, so web reads are never blocked by the batch writer
+- synchronous=NORMAL and temp_store=MEMORY for cheaper commits/temp tables
+- mmap_size and cache_size for read-heavy page builds
+- busy_timeout, so concurrent writers wait instead of raising "database is locked"
+
+Queries use module-level SQL constants on long-lived connections, so
+sqlite3's per-connection statement cache hands back already-prepared
+statements instead of re-compiling them on every call.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from config import DATABASE_PATH
+
+BUSY_TIMEOUT_MS = 10_000
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 64 * 1024
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA temp_store=MEMORY;",
+    f"PRAGMA mmap_size={MMAP_SIZE};",
+    f"PRAGMA cache_size=-{CACHE_SIZE_KIB};",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS};",
+)
+
+# Normalised schema: teams, players and matches hold what the upstream says
+# about them; player_match_stats holds one row per player per match. Match and
+# player rows may only carry an id until ingestion has seen their details.
+CREATE_TEAMS_SQL = """
+    CREATE TABLE IF NOT EXISTS teams (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        updated_at REAL
+    );
+"""
+
+CREATE_PLAYERS_SQL = """
+    CREATE TABLE IF NOT EXISTS players (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        position TEXT,
+        team_id INT,
+        updated_at REAL
+    );
+"""
+
+CREATE_MATCHES_SQL = """
+    CREATE TABLE IF NOT EXISTS matches (
+        id INTEGER PRIMARY KEY,
+        start_timestamp INT,
+        status TEXT,
+        tournament_id INT,
+        tournament_name TEXT,
+        home_team_id INT,
+        away_team_id INT,
+        home_score INT,
+        away_score INT,
+        updated_at REAL
+    );
+"""
+
+CREATE_PLAYER_MATCH_STATS_SQL = """
+    CREATE TABLE IF NOT EXISTS player_match_stats (
+        match_id INT NOT NULL,
+        player_id INT NOT NULL,
+        was_fouled INT,
+        fouls INT,
+        shots_off_target INT,
+        shots_on_target INT,
+        yellow_cards INT,
+        red_card BOOLEAN,
+        minutes_played FLOAT,
+        PRIMARY KEY (match_id, player_id)
+    ) WITHOUT ROWID;
+"""
+
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS players_team_id ON players(team_id);",
+    "CREATE INDEX IF NOT EXISTS matches_start_timestamp ON matches(start_timestamp);",
+    "CREATE INDEX IF NOT EXISTS matches_home_team ON matches(home_team_id, start_timestamp);",
+    "CREATE INDEX IF NOT EXISTS matches_away_team ON matches(away_team_id, start_timestamp);",
+    "CREATE INDEX IF NOT EXISTS player_match_stats_player ON player_match_stats(player_id, match_id);",
+)
+
+# The pre-normalisation table, kept under its old name as a read-only view
+# (created after migrate_legacy_statistics() has moved its rows)
+CREATE_LEGACY_STATISTICS_VIEW_SQL = """
+    CREATE VIEW IF NOT EXISTS player_match_statistics AS
+    SELECT
+        match_id, player_id,
+        was_fouled AS wasFouled, fouls,
+        shots_off_target AS shotOffTarget, shots_on_target AS shotOnTarget,
+        yellow_cards AS yellowCardsCount, red_card AS redCard,
+        minutes_played AS avg_minutes_played
+    FROM player_match_stats;
+"""
+
+CREATE_TEAM_INGEST_STATE_SQL = """
+    CREATE TABLE IF NOT EXISTS team_ingest_state (
+        team_id INT PRIMARY KEY,
+        last_match_id INT,
+        last_start_timestamp INT,
+        updated_at REAL
+    );
+"""
+
+# Checkpointed batch runs (run.py, backfill.py): one row per run, per planned match and per team.
+# kind is "warm" (run.py) or "backfill" (backfill.py); each tool only resumes its own runs.
+CREATE_WARM_RUNS_SQL = """
+    CREATE TABLE IF NOT EXISTS warm_runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at REAL,
+        finished_at REAL,
+        incremental BOOLEAN,
+        status TEXT,
+        kind TEXT NOT NULL DEFAULT 'warm'
+    );
+"""
+
+CREATE_WARM_RUN_ITEMS_SQL = """
+    CREATE TABLE IF NOT EXISTS warm_run_items (
+        run_id INT,
+        match_id INT,
+        player_ids TEXT,
+        status TEXT,
+        http_status INT,
+        error TEXT,
+        attempts INT DEFAULT 0,
+        updated_at REAL,
+        PRIMARY KEY (run_id, match_id)
+    );
+"""
+
+CREATE_WARM_RUN_TEAMS_SQL = """
+    CREATE TABLE IF NOT EXISTS warm_run_teams (
+        run_id INT,
+        team_id INT,
+        match_ids TEXT,
+        newest_match_id INT,
+        newest_start_timestamp INT,
+        PRIMARY KEY (run_id, team_id)
+    );
+"""
+
+# Persistent task queue of the kickoff-aware scheduler (scheduler.py)
+CREATE_SCHEDULER_TASKS_SQL = """
+    CREATE TABLE IF NOT EXISTS scheduler_tasks (
+        task_key TEXT PRIMARY KEY,
+        kind TEXT,
+        target_id INT,
+        kickoff INT,
+        due_at REAL,
+        status TEXT,
+        runs INT DEFAULT 0,
+        last_run_at REAL,
+        last_result TEXT,
+        updated_at REAL,
+        run_id INT
+    );
+"""
+
+SCHEMA = (
+    CREATE_TEAMS_SQL,
+    CREATE_PLAYERS_SQL,
+    CREATE_MATCHES_SQL,
+    CREATE_PLAYER_MATCH_STATS_SQL,
+    CREATE_TEAM_INGEST_STATE_SQL,
+    CREATE_WARM_RUNS_SQL,
+    CREATE_WARM_RUN_ITEMS_SQL,
+    CREATE_WARM_RUN_TEAMS_SQL,
+    CREATE_SCHEDULER_TASKS_SQL,
+) + INDEXES
+
+SELECT_STATISTICS_SQL = """
+    SELECT
+        was_fouled, fouls, shots_off_target, shots_on_target,
+        yellow_cards, red_card, minutes_played
+    FROM player_match_stats
+    WHERE match_id = ? AND player_id = ? LIMIT 1
+"""
+
+SELECT_STATISTICS_BULK_SQL = """
+    SELECT
+        s.match_id, s.player_id,
+        s.was_fouled, s.fouls, s.shots_off_target, s.shots_on_target,
+        s.yellow_cards, s.red_card, s.minutes_played
+    FROM player_match_stats s
+    JOIN wanted_matches wm ON wm.match_id = s.match_id
+    JOIN wanted_players wp ON wp.player_id = s.player_id
+"""
+
+SELECT_PLAYER_HISTORY_SQL = """
+    SELECT
+        m.id, m.start_timestamp, m.tournament_name, m.home_team_id, m.away_team_id,
+        s.was_fouled, s.fouls, s.shots_off_target, s.shots_on_target,
+        s.yellow_cards, s.red_card, s.minutes_played
+    FROM player_match_stats s
+    JOIN matches m ON m.id = s.match_id
+    WHERE s.player_id = ?
+    ORDER BY m.start_timestamp DESC
+    LIMIT ?
+"""
+
+UPSERT_STATISTICS_SQL = (
+    "INSERT INTO player_match_stats(\n"
+    "  match_id, player_id, was_fouled, fouls, shots_off_target, shots_on_target, yellow_cards, red_card, minutes_played\n"
+    ") VALUES(?,?,?,?,?,?,?,?,?)\n"
+    "ON CONFLICT(match_id, player_id) DO UPDATE SET\n"
+    "  was_fouled=excluded.was_fouled,\n"
+    "  fouls=excluded.fouls,\n"
+    "  shots_off_target=excluded.shots_off_target,\n"
+    "  shots_on_target=excluded.shots_on_target,\n"
+    "  yellow_cards=excluded.yellow_cards,\n"
+    "  red_card=excluded.red_card,\n"
+    "  minutes_played=excluded.minutes_played;"
+)
+
+# Details are only ever filled in, never blanked by a sparser payload
+UPSERT_TEAM_SQL = (
+    "INSERT INTO teams(id, name, updated_at) VALUES(?,?,?)\n"
+    "ON CONFLICT(id) DO UPDATE SET\n"
+    "  name=COALESCE(excluded.name, name),\n"
+    "  updated_at=excluded.updated_at;"
+)
+
+UPSERT_PLAYER_SQL = (
+    "INSERT INTO players(id, name, position, team_id, updated_at) VALUES(?,?,?,?,?)\n"
+    "ON CONFLICT(id) DO UPDATE SET\n"
+    "  name=COALESCE(excluded.name, name),\n"
+    "  position=COALESCE(excluded.position, position),\n"
+    "  team_id=COALESCE(excluded.team_id, team_id),\n"
+    "  updated_at=excluded.updated_at;"
+)
+
+UPSERT_MATCH_SQL = (
+    "INSERT INTO matches(\n"
+    "  id, start_timestamp, status, tournament_id, tournament_name,\n"
+    "  home_team_id, away_team_id, home_score, away_score, updated_at\n"
+    ") VALUES(?,?,?,?,?,?,?,?,?,?)\n"
+    "ON CONFLICT(id) DO UPDATE SET\n"
+    "  start_timestamp=COALESCE(excluded.start_timestamp, start_timestamp),\n"
+    "  status=COALESCE(excluded.status, status),\n"
+    "  tournament_id=COALESCE(excluded.tournament_id, tournament_id),\n"
+    "  tournament_name=COALESCE(excluded.tournament_name, tournament_name),\n"
+    "  home_team_id=COALESCE(excluded.home_team_id, home_team_id),\n"
+    "  away_team_id=COALESCE(excluded.away_team_id, away_team_id),\n"
+    "  home_score=COALESCE(excluded.home_score, home_score),\n"
+    "  away_score=COALESCE(excluded.away_score, away_score),\n"
+    "  updated_at=excluded.updated_at;"
+)
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _connect(path, isolation_level):
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=256,
+        isolation_level=isolation_level,
+    )
+    for pragma in PRAGMAS:
+        try:
+            conn.execute(pragma)
+        except sqlite3.Error:
+            # Pragmas are best-effort; continue if unsupported
+            pass
+    return conn
+
+
+def thread_connection(path, schema=(), isolation_level=""):
+    """Return this thread's pooled connection to the SQLite file at path.
+
+    It is opened on first use (and again in a forked child) with PRAGMAS
+    applied, then the schema statements are run once. isolation_level is
+    passed to sqlite3.connect (None for manual BEGIN/COMMIT).
+    """
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    entry = conns.get(path)
+    # A forked worker must not reuse its parent's connection
+    if entry is None or entry[1] != os.getpid():
+        conn = _connect(path, isolation_level)
+        for create_sql in schema:
+            conn.execute(create_sql)
+        conn.commit()
+        entry = conns[path] = (conn, os.getpid())
+    return entry[0]
+
+
+def get_connection():
+    """Return this thread's pooled connection, opening and tuning it on first use."""
+    conn = thread_connection(DATABASE_PATH)
+    create_tables()
+    return conn
+
+
+def close_connection():
+    """Close this thread's pooled connections (e.g. when a worker thread exits)."""
+    conns = getattr(_local, "conns", None) or {}
+    for conn, pid in conns.values():
+        if pid == os.getpid():
+            conn.close()
+    _local.conns = {}
+
+
+@contextmanager
+def transaction():
+    """Run a block in one write transaction on the pooled connection."""
+    conn = get_connection()
+    conn.execute("BEGIN")
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def create_tables():
+    """Create the schema (migrating a pre-normalisation database) once per process."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        conn = thread_connection(DATABASE_PATH)
+        for create_sql in SCHEMA:
+            conn.execute(create_sql)
+        conn.commit()
+        migrate_legacy_statistics(conn)
+        migrate_added_columns(conn)
+        conn.execute(CREATE_LEGACY_STATISTICS_VIEW_SQL)
+        conn.commit()
+        _schema_ready = True
+
+
+def migrate_legacy_statistics(conn):
+    """Move rows from the old player_match_statistics table into player_match_stats.
+
+    Its avg_minutes_played column always held per-match minutes and becomes
+    minutes_played. Every match and player id gets a (details-less) matches /
+    players row that later ingestion fills in. The old table is then dropped;
+    a view of the same name takes its place. A no-op once migrated.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        legacy = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'player_match_statistics'"
+        ).fetchone()
+        if legacy:
+            copied = conn.execute(
+                "INSERT OR IGNORE INTO player_match_stats("
+                "match_id, player_id, was_fouled, fouls, shots_off_target, shots_on_target, "
+                "yellow_cards, red_card, minutes_played) "
+                "SELECT match_id, player_id, wasFouled, fouls, shotOffTarget, shotOnTarget, "
+                "yellowCardsCount, redCard, avg_minutes_played FROM player_match_statistics "
+                "WHERE match_id IS NOT NULL AND player_id IS NOT NULL"
+            ).rowcount
+            conn.execute("INSERT OR IGNORE INTO matches(id) SELECT DISTINCT match_id FROM player_match_stats")
+            conn.execute("INSERT OR IGNORE INTO players(id) SELECT DISTINCT player_id FROM player_match_stats")
+            conn.execute("DROP TABLE player_match_statistics")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if legacy:
+        print(f"Migrated {copied} rows from player_match_statistics to player_match_stats")
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def migrate_added_columns(conn):
+    """Add columns introduced after a table was first created. A no-op once migrated.
+
+    warm_runs.kind: earlier backfill runs are recognised by having no planned
+    teams. scheduler_tasks.run_id starts empty.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if "kind" not in _columns(conn, "warm_runs"):
+            conn.execute("ALTER TABLE warm_runs ADD COLUMN kind TEXT NOT NULL DEFAULT 'warm'")
+            conn.execute(
+                "UPDATE warm_runs SET kind = 'backfill' "
+                "WHERE run_id NOT IN (SELECT run_id FROM warm_run_teams)"
+            )
+        if "run_id" not in _columns(conn, "scheduler_tasks"):
+            conn.execute("ALTER TABLE scheduler_tasks ADD COLUMN run_id INT")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def fetch_statistics_if_exists(match_id, player_id):
+    """Fetch player statistics if they exist for a given match_id and player_id."""
+    result = get_connection().execute(
+        SELECT_STATISTICS_SQL, (match_id, player_id)
+    ).fetchone()
+    if result:
+        return True, result  # Record exists, return True and the fetched values
+    return False, None  # Record does not exist, return False and None
+
+
+def fetch_statistics_bulk(match_ids, player_ids):
+    """Load every cached row for player_ids x match_ids with one query.
+
+    Returns {(match_id, player_id): (wasFouled, fouls, shotOffTarget, shotOnTarget,
+    yellowCardsCount, redCard, avg_minutes_played)} for the pairs that exist.
+    """
+    match_ids = list(dict.fromkeys(match_ids))
+    player_ids = list(dict.fromkeys(player_ids))
+    if not match_ids or not player_ids:
+        return {}
+
+    conn = get_connection()
+    # Temp tables keep this to one query regardless of squad size (no bound-variable
+    # limit); they live as long as the pooled connection, so clear them first.
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted_matches (match_id INT PRIMARY KEY)")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted_players (player_id INT PRIMARY KEY)")
+    conn.execute("DELETE FROM wanted_matches")
+    conn.execute("DELETE FROM wanted_players")
+    conn.executemany("INSERT OR IGNORE INTO wanted_matches VALUES (?)", [(m,) for m in match_ids])
+    conn.executemany("INSERT OR IGNORE INTO wanted_players VALUES (?)", [(p,) for p in player_ids])
+    rows = conn.execute(SELECT_STATISTICS_BULK_SQL).fetchall()
+    conn.commit()
+    return {(row[0], row[1]): row[2:] for row in rows}
+
+
+def row_is_valid(stats):
+    """False for a stored row that should be refetched: 0 minutes and no events.
+
+    stats is a fetch_statistics_bulk() value. A failed fetch is stored that
+    way (team_detail.stats_row) so it is retried; NULL minutes mark a player
+    who did not play, and those rows are complete.
+    """
+    try:
+        was_fouled, fouls, shot_off_target, shot_on_target, yellow_cards_count, red_card, avg_minutes = stats
+        return (
+            avg_minutes is None
+            or (isinstance(avg_minutes, (int, float)) and avg_minutes > 0)
+            or any([
+                was_fouled, fouls, shot_off_target, shot_on_target,
+                yellow_cards_count, 1 if red_card else 0
+            ])
+        )
+    except Exception:
+        return False
+
+
+def stored_match_ids(match_ids):
+    """Return the subset of match_ids that already have at least one statistics row."""
+    match_ids = list(dict.fromkeys(match_ids))
+    if not match_ids:
+        return set()
+
+    conn = get_connection()
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted_matches (match_id INT PRIMARY KEY)")
+    conn.execute("DELETE FROM wanted_matches")
+    conn.executemany("INSERT OR IGNORE INTO wanted_matches VALUES (?)", [(m,) for m in match_ids])
+    rows = conn.execute(
+        "SELECT DISTINCT s.match_id FROM player_match_stats s "
+        "JOIN wanted_matches wm ON wm.match_id = s.match_id"
+    ).fetchall()
+    conn.commit()
+    return {row[0] for row in rows}
+
+
+def finished_match_ids():
+    """Return the ids of every recorded match whose status is finished."""
+    rows = get_connection().execute("SELECT id FROM matches WHERE status = 'finished'").fetchall()
+    return {row[0] for row in rows}
+
+
+def upsert_rows(conn, rows):
+    """Bulk upsert rows into player_match_stats.
+
+    rows: iterable of tuples (match_id, player_id, was_fouled, fouls, shots_off_target, shots_on_target, yellow_cards, red_card, minutes_played)
+    """
+    conn.executemany(UPSERT_STATISTICS_SQL, rows)
+
+
+def _match_row(event, now):
+    tournament = event.get("tournament") or {}
+    return (
+        event["id"],
+        event.get("startTimestamp"),
+        (event.get("status") or {}).get("type"),
+        (tournament.get("uniqueTournament") or {}).get("id") or tournament.get("id"),
+        tournament.get("name"),
+        (event.get("homeTeam") or {}).get("id"),
+        (event.get("awayTeam") or {}).get("id"),
+        (event.get("homeScore") or {}).get("current"),
+        (event.get("awayScore") or {}).get("current"),
+        now,
+    )
+
+
+def upsert_matches(conn, events):
+    """Record upstream match events (and their two teams) in matches and teams."""
+    now = time.time()
+    events = [event for event in events if event and event.get("id") is not None]
+    conn.executemany(UPSERT_MATCH_SQL, [_match_row(event, now) for event in events])
+    teams = {}
+    for event in events:
+        for side in ("homeTeam", "awayTeam"):
+            team = event.get(side) or {}
+            if team.get("id") is not None:
+                teams[team["id"]] = team.get("name")
+    conn.executemany(UPSERT_TEAM_SQL, [(team_id, name, now) for team_id, name in teams.items()])
+
+
+def upsert_players(conn, team_id, players):
+    """Record a team's squad (entries of a team/{id}/players response) in players."""
+    now = time.time()
+    rows = []
+    for player_data in players:
+        player = player_data.get("player") or {}
+        if player.get("id") is not None:
+            rows.append((player["id"], player.get("name"), player.get("position"), team_id, now))
+    conn.executemany(UPSERT_PLAYER_SQL, rows)
+
+
+def record_team(team_id, matches, players):
+    """Record a team's matches and squad in one transaction (see upsert_matches/upsert_players)."""
+    with transaction() as conn:
+        upsert_matches(conn, matches)
+        upsert_players(conn, team_id, players)
+
+
+def player_history(player_id, limit=10):
+    """A player's most recent stored matches, newest first, with the match details.
+
+    Returns rows of (match_id, start_timestamp, tournament_name, home_team_id,
+    away_team_id, was_fouled, fouls, shots_off_target, shots_on_target,
+    yellow_cards, red_card, minutes_played); matches whose details have not
+    been recorded yet sort last.
+    """
+    return get_connection().execute(SELECT_PLAYER_HISTORY_SQL, (player_id, limit)).fetchall()
+
+
+def get_team_high_water(team_id):
+    """Return (last_match_id, last_start_timestamp) of the newest finished match ingested for a team, or None."""
+    return get_connection().execute(
+        "SELECT last_match_id, last_start_timestamp FROM team_ingest_state WHERE team_id = ?",
+        (team_id,),
+    ).fetchone()
+
+
+def set_team_high_water(conn, team_id, match_id, start_timestamp):
+    """Record a team's newest ingested finished match (call inside the rows' transaction)."""
+    conn.execute(
+        "INSERT INTO team_ingest_state(team_id, last_match_id, last_start_timestamp, updated_at) "
+        "VALUES(?,?,?,?) ON CONFLICT(team_id) DO UPDATE SET "
+        "last_match_id=excluded.last_match_id, "
+        "last_start_timestamp=excluded.last_start_timestamp, "
+        "updated_at=excluded.updated_at",
+        (team_id, match_id, start_timestamp, time.time()),
+    )
+
+
+def create_warm_run(work, team_matches, incremental=False, kind="warm"):
+    """Persist a planned batch run and return its run_id.
+
+    work: {match_id: player_ids}; team_matches: {team_id: [finished match dicts]}.
+    kind is "warm" or "backfill". Every match starts as a pending item.
+    """
+    now = time.time()
+    with transaction() as conn:
+        run_id = conn.execute(
+            "INSERT INTO warm_runs(created_at, incremental, status, kind) VALUES(?,?,?,?)",
+            (now, bool(incremental), "pending", kind),
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO warm_run_items(run_id, match_id, player_ids, status, updated_at) VALUES(?,?,?,?,?)",
+            [
+                (run_id, match_id, json.dumps(sorted(player_ids)), "pending", now)
+                for match_id, player_ids in work.items()
+            ],
+        )
+        team_rows = []
+        for team_id, matches in team_matches.items():
+            newest = max(matches, key=lambda match: match.get("startTimestamp") or 0)
+            team_rows.append(
+                (
+                    run_id,
+                    team_id,
+                    json.dumps([match["id"] for match in matches]),
+                    newest["id"],
+                    newest.get("startTimestamp") or 0,
+                )
+            )
+        conn.executemany(
+            "INSERT INTO warm_run_teams(run_id, team_id, match_ids, newest_match_id, newest_start_timestamp) "
+            "VALUES(?,?,?,?,?)",
+            team_rows,
+        )
+    return run_id
+
+
+def latest_warm_run_id(unfinished_only=False, kind="warm"):
+    sql = "SELECT MAX(run_id) FROM warm_runs WHERE kind = ?"
+    if unfinished_only:
+        sql += " AND status != 'done'"
+    return get_connection().execute(sql, (kind,)).fetchone()[0]
+
+
+def warm_run_kind(run_id):
+    """Return a run's kind ("warm" or "backfill"), or None if there is no such run."""
+    row = get_connection().execute("SELECT kind FROM warm_runs WHERE run_id = ?", (run_id,)).fetchone()
+    return row[0] if row else None
+
+
+def set_warm_run_status(run_id, status):
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE warm_runs SET status = ?, finished_at = ? WHERE run_id = ?",
+            (status, time.time() if status == "done" else None, run_id),
+        )
+
+
+def unfinished_warm_items(run_id):
+    """Return {match_id: player_ids} for a run's pending and failed items."""
+    rows = get_connection().execute(
+        "SELECT match_id, player_ids FROM warm_run_items WHERE run_id = ? AND status != 'done'",
+        (run_id,),
+    ).fetchall()
+    return {match_id: set(json.loads(player_ids)) for match_id, player_ids in rows}
+
+
+def mark_warm_item(conn, run_id, match_id, status, player_ids=None, http_status=None, error=None):
+    """Record an item's outcome (call inside the transaction that wrote its rows).
+
+    For failed items player_ids narrows the item to the players still missing,
+    so a retry only re-requests those.
+    """
+    conn.execute(
+        "UPDATE warm_run_items SET status = ?, http_status = ?, error = ?, "
+        "attempts = attempts + 1, updated_at = ?, "
+        "player_ids = COALESCE(?, player_ids) "
+        "WHERE run_id = ? AND match_id = ?",
+        (
+            status,
+            http_status,
+            error,
+            time.time(),
+            json.dumps(sorted(player_ids)) if player_ids is not None else None,
+            run_id,
+            match_id,
+        ),
+    )
+
+
+def warm_run_teams(run_id):
+    """Return [(team_id, match_ids, newest_match_id, newest_start_timestamp)] for a run."""
+    rows = get_connection().execute(
+        "SELECT team_id, match_ids, newest_match_id, newest_start_timestamp "
+        "FROM warm_run_teams WHERE run_id = ?",
+        (run_id,),
+    ).fetchall()
+    return [(team_id, json.loads(match_ids), newest_id, newest_ts) for team_id, match_ids, newest_id, newest_ts in rows]
+
+
+def warm_run_summary(run_id):
+    """Return (run row, {status: count}, failed items) for inspecting a run."""
+    conn = get_connection()
+    run = conn.execute(
+        "SELECT run_id, created_at, finished_at, incremental, status, kind FROM warm_runs WHERE run_id = ?",
+        (run_id,),
+    ).fetchone()
+    counts = dict(
+        conn.execute(
+            "SELECT status, COUNT(*) FROM warm_run_items WHERE run_id = ? GROUP BY status",
+            (run_id,),
+        ).fetchall()
+    )
+    failed = conn.execute(
+        "SELECT match_id, http_status, error, attempts FROM warm_run_items "
+        "WHERE run_id = ? AND status = 'failed' ORDER BY match_id",
+        (run_id,),
+    ).fetchall()
+    return run, counts, failed
+
+
+SCHEDULER_TASK_COLUMNS = (
+    "task_key", "kind", "target_id", "kickoff", "due_at", "status", "runs", "last_run_at", "last_result",
+    "run_id",
+)
+
+
+def add_scheduler_task(task_key, kind, target_id, kickoff, due_at):
+    """Queue a task unless it is already known (its status and schedule are kept)."""
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO scheduler_tasks(task_key, kind, target_id, kickoff, due_at, status, updated_at) "
+            "VALUES(?,?,?,?,?,?,?)",
+            (task_key, kind, target_id, kickoff, due_at, "pending", time.time()),
+        )
+
+
+def next_scheduler_task(now):
+    """Return the pending task to run next (earliest due, then soonest kickoff) as a dict, or None.
+
+    The task may not be due yet; callers compare its due_at with now.
+    """
+    row = get_connection().execute(
+        f"SELECT {', '.join(SCHEDULER_TASK_COLUMNS)} FROM scheduler_tasks "
+        "WHERE status = 'pending' ORDER BY due_at, kickoff LIMIT 1"
+    ).fetchone()
+    return dict(zip(SCHEDULER_TASK_COLUMNS, row)) if row else None
+
+
+def update_scheduler_task(task_key, status, result, due_at=None):
+    """Record a run of a task; pass due_at to reschedule it (status stays 'pending')."""
+    now = time.time()
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE scheduler_tasks SET status = ?, last_result = ?, runs = runs + 1, "
+            "last_run_at = ?, updated_at = ?, due_at = COALESCE(?, due_at) WHERE task_key = ?",
+            (status, result, now, now, due_at, task_key),
+        )
+
+
+def set_scheduler_task_run(task_key, run_id):
+    """Remember the warm run a task started, so its retries resume that run."""
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE scheduler_tasks SET run_id = ?, updated_at = ? WHERE task_key = ?",
+            (run_id, time.time(), task_key),
+        )
+
+
+def scheduler_tasks(since_kickoff=0, limit=500):
+    """Return the scheduler queue (tasks for kickoffs at or after since_kickoff) as dicts."""
+    rows = get_connection().execute(
+        f"SELECT {', '.join(SCHEDULER_TASK_COLUMNS)} FROM scheduler_tasks "
+        "WHERE kickoff >= ? ORDER BY status != 'pending', due_at, kickoff LIMIT ?",
+        (since_kickoff, limit),
+    ).fetchall()
+    return [dict(zip(SCHEDULER_TASK_COLUMNS, row)) for row in rows]
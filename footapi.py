@@ -0,0 +1,368 @@
+"""Async footapi client shared by the web app and the batch jobs.
+
+One aiohttp ClientSession (pooled, keep-alive connections) runs on a
+background event loop. Every request goes through a global semaphore so the
+whole process never has more than FOOTAPI_CONCURRENCY upstream calls in
+flight, regardless of how many threads are asking, and is paced by the
+cross-process token bucket in ratelimit.py.
+
+Sync callers (Flask views, run.py) use get()/get_many(); async callers
+schedule their coroutines on the client loop with run(), or with submit() to
+carry on without waiting for the result.
+"""
+import asyncio
+import atexit
+import collections
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+
+import aiohttp
+
+import ratelimit
+import response_cache
+import snapshots
+from config import FOOTAPI_CONCURRENCY, FOOTAPI_TIMEOUT, HEADERS
+
+BASE_URL = "https://footapi7.p.rapidapi.com/api/"
+
+RETRY_STATUSES = (420, 429, 408, 500, 502, 503, 504)
+
+_ID_RE = re.compile(r"\d+")
+
+# Per-endpoint total timeouts (seconds); anything else uses FOOTAPI_TIMEOUT
+ENDPOINT_TIMEOUTS = (
+    (re.compile(r"/player/\d+/image$"), 20.0),
+    (re.compile(r"/team/\d+/players$"), 15.0),
+    (re.compile(r"/matches/(previous|next)/\d+$"), 15.0),
+    (re.compile(r"/matches/top/\d+/\d+/\d+$"), 15.0),
+)
+
+
+class FootapiError(Exception):
+    """Raised when a request could not be completed after all retries."""
+
+
+class BudgetExhausted(FootapiError):
+    """Raised instead of going upstream once the request budget is spent."""
+
+
+class RateLimitWait(FootapiError):
+    """Raised instead of waiting when the rate limiter's wait is longer than the request timeout."""
+
+
+class FootapiResponse:
+    """Minimal requests-like response: status_code, headers, content, text, json()."""
+
+    def __init__(
+        self, url, status_code, headers, content, attempts=1, delays=None, from_cache=False
+    ):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.attempts = attempts
+        self.delays = delays or []
+        self.from_cache = from_cache
+
+    @property
+    def ok(self):
+        return self.status_code == 200
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        # json.JSONDecodeError is a ValueError, which is what callers catch
+        return json.loads(self.content)
+
+
+def build_url(path):
+    if path.startswith("http://") or path.startswith("https://"):
+        return path
+    return BASE_URL + path.lstrip("/")
+
+
+def endpoint_key(url):
+    """(endpoint label, ids) for a URL, e.g. ("match/{id}/lineups", "123")."""
+    path = url.split("?", 1)[0].split("/api/", 1)[-1].strip("/")
+    return _ID_RE.sub("{id}", path), ",".join(_ID_RE.findall(path))
+
+
+def endpoint_of(url):
+    """Endpoint label for a URL, e.g. "match/{id}/lineups" (used for per-endpoint counts)."""
+    return endpoint_key(url)[0]
+
+
+def bucket_for(headers):
+    """Rate limiter bucket for a request: the default one, or one per overriding API key."""
+    key = (headers or {}).get("X-RapidAPI-Key")
+    if key is None or key == HEADERS.get("X-RapidAPI-Key"):
+        return ratelimit.BUCKET
+    return f"{ratelimit.BUCKET}:{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+
+
+def timeout_for(url):
+    for pattern, seconds in ENDPOINT_TIMEOUTS:
+        if pattern.search(url):
+            return seconds
+    return FOOTAPI_TIMEOUT
+
+
+def _parse_retry_after(headers):
+    try:
+        val = headers.get("Retry-After") or headers.get("retry-after")
+        if not val:
+            return None
+        return float(val)
+    except Exception:
+        return None
+
+
+# Event loop, session and semaphore are per process (gunicorn forks workers)
+_state_lock = threading.Lock()
+_loop = None
+_loop_pid = None
+_session = None
+_semaphore = None
+# (url, headers) -> Task for requests currently in flight on the client loop
+_in_flight = {}
+_stats = collections.Counter()
+_endpoint_stats = collections.Counter()
+# Upstream attempt count at which requests stop (None = unlimited); see set_request_budget()
+_budget_limit = None
+
+
+def _get_loop():
+    global _loop, _loop_pid, _session, _semaphore, _in_flight
+    with _state_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _session = None
+            _semaphore = None
+            _in_flight = {}
+            threading.Thread(
+                target=_loop.run_forever, name="footapi-loop", daemon=True
+            ).start()
+        return _loop
+
+
+def _get_session():
+    # Only ever called on the client loop, so no locking is needed here
+    global _session, _semaphore
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=FOOTAPI_CONCURRENCY, keepalive_timeout=60, ttl_dns_cache=300
+        )
+        _session = aiohttp.ClientSession(connector=connector, headers=HEADERS)
+        _semaphore = asyncio.Semaphore(FOOTAPI_CONCURRENCY)
+    return _session, _semaphore
+
+
+async def _close_session():
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+
+@atexit.register
+def close():
+    """Close the pooled session; registered to run at interpreter exit."""
+    if _loop is not None and _loop_pid == os.getpid() and _loop.is_running():
+        try:
+            asyncio.run_coroutine_threadsafe(_close_session(), _loop).result(timeout=5)
+        except Exception:
+            pass
+
+
+async def fetch(url, headers=None, **kwargs):
+    """GET a footapi URL (or path relative to BASE_URL) with retries.
+
+    Concurrent requests for the same URL and options are coalesced: the
+    first caller performs the fetch (cache lookup included) and every other
+    caller awaits the same result instead of issuing a duplicate upstream
+    request. Keyword arguments are those of _fetch() and are part of the
+    coalescing key, so a cache-bypassing call (cache_ttl=0 or refresh=True) is
+    never handed a response another caller served from the cache.
+    """
+    url = build_url(url)
+    key = (
+        url,
+        tuple(sorted(headers.items())) if headers else None,
+        tuple(sorted(kwargs.items())),
+    )
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch(url, headers=headers, **kwargs))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _task: _in_flight.pop(key, None))
+    else:
+        _stats["coalesced"] += 1
+    # shield: one caller being cancelled must not cancel the shared fetch
+    return await asyncio.shield(task)
+
+
+async def _fetch(
+    url,
+    headers=None,
+    max_attempts=8,
+    backoff_base=0.75,
+    backoff_cap=10.0,
+    cache_ttl=None,
+    refresh=False,
+):
+    """Fetch one URL: persistent cache first, then upstream with retries.
+
+    cache_ttl overrides the endpoint's default TTL (pass
+    response_cache.IMMUTABLE_TTL for finished matches, 0 to bypass the cache).
+    refresh=True skips the cache lookup but still stores the new response, so
+    later readers get it.
+    Retries rate limits (420/429) and transient errors, honouring Retry-After.
+    Returns a FootapiResponse for any final HTTP status; raises FootapiError if
+    every attempt failed at the network level.
+    """
+    ttl = response_cache.ttl_for(url) if cache_ttl is None else cache_ttl
+    if ttl > 0 and not refresh:
+        cached = await asyncio.to_thread(response_cache.get, url)
+        if cached is not None:
+            status_code, content = cached
+            _stats["cache_hits"] += 1
+            return FootapiResponse(url, status_code, {}, content, attempts=0, from_cache=True)
+
+    session, semaphore = _get_session()
+    timeout = aiohttp.ClientTimeout(total=timeout_for(url))
+    bucket = bucket_for(headers)
+    attempts = 0
+    delays = []
+    last_response = None
+    last_error = None
+    while attempts < max_attempts:
+        attempts += 1
+        if _budget_limit is not None and _stats["upstream"] >= _budget_limit:
+            raise BudgetExhausted(f"Request budget spent; not requesting {url}")
+        # Counted before pacing so concurrent fetches cannot overshoot the budget
+        _stats["upstream"] += 1
+        _endpoint_stats[endpoint_of(url)] += 1
+        # Pace proactively from the shared bucket instead of waiting for a 429,
+        # but fail rather than block for longer than the request may take
+        wait = await asyncio.to_thread(ratelimit.reserve, timeout.total, bucket)
+        if wait is None:
+            _stats["upstream"] -= 1
+            _endpoint_stats[endpoint_of(url)] -= 1
+            _stats["rate_limit_waits"] += 1
+            raise RateLimitWait(f"Rate limiter wait exceeds {timeout.total:.0f}s; not requesting {url}")
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            async with semaphore:
+                async with session.get(url, headers=headers, timeout=timeout) as resp:
+                    content = await resp.read()
+                    last_response = FootapiResponse(
+                        url, resp.status, resp.headers, content, attempts, delays
+                    )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            last_error = e
+            last_response = None
+        else:
+            await asyncio.to_thread(
+                ratelimit.observe, last_response.status_code, last_response.headers, bucket
+            )
+            # Do NOT retry 204 or other non-transient statuses
+            if last_response.status_code not in RETRY_STATUSES:
+                if ttl > 0:
+                    await asyncio.to_thread(
+                        response_cache.put, url, last_response.status_code, content, ttl
+                    )
+                endpoint, ids = endpoint_key(url)
+                if snapshots.wanted(endpoint, last_response.status_code):
+                    await asyncio.to_thread(
+                        snapshots.put, endpoint, ids, last_response.status_code, content
+                    )
+                return last_response
+
+        if attempts >= max_attempts:
+            break
+        retry_after = (
+            _parse_retry_after(last_response.headers) if last_response is not None else None
+        )
+        wait = retry_after if retry_after is not None else min(
+            backoff_cap, backoff_base * (2 ** (attempts - 1)) + random.random() * 0.25
+        )
+        status = last_response.status_code if last_response is not None else last_error
+        print(f"Retry {attempts} ({status}) for {url} — waiting {wait:.2f}s")
+        delays.append(wait)
+        await asyncio.sleep(wait)
+
+    if last_response is not None:
+        return last_response
+    raise FootapiError(f"GET {url} failed after {attempts} attempts: {last_error}")
+
+
+async def fetch_many(urls, **kwargs):
+    """Fetch several URLs concurrently; failed entries are returned as exceptions."""
+    return await asyncio.gather(
+        *(fetch(url, **kwargs) for url in urls), return_exceptions=True
+    )
+
+
+def stats():
+    """Counters for this process: upstream attempts, cache hits, coalesced callers, rate limit waits refused."""
+    return dict(_stats)
+
+
+def endpoint_stats():
+    """Upstream attempts per endpoint label (see endpoint_of) for this process."""
+    return dict(_endpoint_stats)
+
+
+def set_request_budget(limit):
+    """Allow at most `limit` more upstream attempts in this process (None removes the cap).
+
+    Once spent, requests that would go upstream raise BudgetExhausted; cache
+    hits are still served.
+    """
+    global _budget_limit
+    _budget_limit = None if limit is None else _stats["upstream"] + limit
+
+
+def budget_exhausted():
+    return _budget_limit is not None and _stats["upstream"] >= _budget_limit
+
+
+def run(coro):
+    """Run a coroutine on the client loop from sync code and return its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+def submit(coro):
+    """Schedule a coroutine on the client loop without waiting; returns a concurrent Future."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop())
+
+
+def get(url, **kwargs):
+    """Blocking wrapper around fetch() for Flask views and worker threads."""
+    return run(fetch(url, **kwargs))
+
+
+def get_many(urls, **kwargs):
+    """Blocking wrapper around fetch_many(); total time is bounded by the slowest URL."""
+    return run(fetch_many(urls, **kwargs))
+
+
+def get_json(url, default=None, **kwargs):
+    """GET a URL and return its decoded JSON body, or default on any non-200/invalid body."""
+    try:
+        response = get(url, **kwargs)
+    except FootapiError as e:
+        print(e)
+        return default
+    if response.status_code != 200:
+        return default
+    try:
+        return response.json()
+    except ValueError:
+        return default
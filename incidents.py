@@ -0,0 +1,184 @@
+"""Shared per-match incident index.
+
+Incidents for a match are downloaded once per process and parsed into a
+per-player index (cards, goals, assists, substitutions) that team_detail.py,
+match_detail.py and run.py all read from, instead of each caller re-fetching
+and re-scanning the raw incidents list.
+"""
+import threading
+import time
+
+import footapi
+from response_cache import IMMUTABLE_TTL
+
+# Finished matches never change; live/upcoming ones are re-read after this many seconds
+LIVE_INCIDENTS_TTL = 30
+_INDEX_MAX = 1000
+
+# match_id -> (fetched_at, finished, index)
+_index_by_match = {}
+_fetch_locks = {}
+_guard = threading.Lock()
+
+
+def _empty_player_entry():
+    return {
+        "yellowCardsCount": 0,
+        "redCard": False,
+        "goals": [],
+        "assists": [],
+        "subbedIn": None,
+        "subbedOut": None,
+    }
+
+
+def build_incident_index(incidents):
+    """Parse a raw incidents list into per-player and per-view lookups.
+
+    Returns a dict with:
+      players:     player_id -> {yellowCardsCount, redCard, goals, assists, subbedIn, subbedOut}
+      goal_scorers, assists: player_id -> [minute, ...]
+      cards:       player_id -> [{"time", "type"}, ...]
+      subbed_in:   player_id -> {"time", "out_player_name"}
+      subbed_out:  player_id -> {"time", "in_player_name"}
+    """
+    players = {}
+    goal_scorers = {}
+    assists = {}
+    cards = {}
+    subbed_in = {}
+    subbed_out = {}
+
+    def entry(player_id):
+        if player_id not in players:
+            players[player_id] = _empty_player_entry()
+        return players[player_id]
+
+    for incident in incidents:
+        incident_type = incident.get("incidentType")
+        incident_class = incident.get("incidentClass")
+        minute = incident.get("time")
+
+        if incident_type == "goal":
+            scorer_id = (incident.get("player") or {}).get("id")
+            if scorer_id is not None:
+                goal_scorers.setdefault(scorer_id, []).append(minute)
+                entry(scorer_id)["goals"].append(minute)
+            assist_id = (incident.get("assist1") or {}).get("id")
+            if assist_id is not None:
+                assists.setdefault(assist_id, []).append(minute)
+                entry(assist_id)["assists"].append(minute)
+
+        elif incident_type == "substitution":
+            player_in = incident.get("playerIn") or {}
+            player_out = incident.get("playerOut") or {}
+            if player_in.get("id") is not None:
+                subbed_in[player_in["id"]] = {
+                    "time": minute,
+                    "out_player_name": player_out.get("name"),
+                }
+                entry(player_in["id"])["subbedIn"] = minute
+            if player_out.get("id") is not None:
+                subbed_out[player_out["id"]] = {
+                    "time": minute,
+                    "in_player_name": player_in.get("name"),
+                }
+                entry(player_out["id"])["subbedOut"] = minute
+
+        elif incident_type == "card":
+            player_id = (incident.get("player") or {}).get("id")
+            if player_id is None:
+                continue
+            if incident_class == "red":
+                card_type = "Red"
+            elif incident_class == "yellow":
+                card_type = "Yellow"
+            elif incident_class == "yellowRed":
+                card_type = "YellowRed"
+            else:
+                continue
+            cards.setdefault(player_id, []).append({"time": minute, "type": card_type})
+            player_entry = entry(player_id)
+            if incident_class in ["yellow", "yellowRed"]:
+                player_entry["yellowCardsCount"] += 1
+            if incident_class in ["red", "yellowRed"]:
+                player_entry["redCard"] = True
+
+    return {
+        "players": players,
+        "goal_scorers": goal_scorers,
+        "assists": assists,
+        "cards": cards,
+        "subbed_in": subbed_in,
+        "subbed_out": subbed_out,
+        "count": len(incidents),
+    }
+
+
+def player_cards(index, player_id):
+    """Return the {"yellowCardsCount", "redCard"} entry team pages store per match."""
+    player_entry = (index or {}).get("players", {}).get(player_id)
+    if not player_entry:
+        return {"yellowCardsCount": 0, "redCard": False}
+    return {
+        "yellowCardsCount": player_entry["yellowCardsCount"],
+        "redCard": player_entry["redCard"],
+    }
+
+
+def _fetch_incidents(match_id, finished):
+    url = f"https://footapi7.p.rapidapi.com/api/match/{match_id}/incidents"
+    try:
+        response = footapi.get(url, cache_ttl=IMMUTABLE_TTL if finished else None)
+    except footapi.FootapiError as e:
+        print(f"Incidents fetch failed for match {match_id}: {e}")
+        return None
+    if response.status_code == 204:
+        return []
+    if response.status_code != 200:
+        print(f"Incidents fetch for match {match_id} returned {response.status_code}")
+        return None
+    try:
+        return response.json().get("incidents", [])
+    except ValueError:
+        return None
+
+
+def _cached(match_id):
+    cached = _index_by_match.get(match_id)
+    if cached is None:
+        return None
+    fetched_at, finished, index = cached
+    if finished or time.time() - fetched_at < LIVE_INCIDENTS_TTL:
+        return index
+    return None
+
+
+def get_incident_index(match_id, finished=True):
+    """Return the incident index for a match, fetching it at most once per process.
+
+    Concurrent callers for the same match wait on a single download. Pass
+    finished=False for live/upcoming matches so the index is refreshed after
+    LIVE_INCIDENTS_TTL seconds. Returns None if the incidents could not be fetched.
+    """
+    with _guard:
+        index = _cached(match_id)
+        if index is not None:
+            return index
+        lock = _fetch_locks.setdefault(match_id, threading.Lock())
+
+    with lock:
+        with _guard:
+            index = _cached(match_id)
+            if index is not None:
+                return index
+        incidents = _fetch_incidents(match_id, finished)
+        with _guard:
+            _fetch_locks.pop(match_id, None)
+            if incidents is None:
+                return None
+            index = build_incident_index(incidents)
+            if match_id not in _index_by_match and len(_index_by_match) >= _INDEX_MAX:
+                _index_by_match.pop(next(iter(_index_by_match)))
+            _index_by_match[match_id] = (time.time(), finished, index)
+    return index
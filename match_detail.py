@@ -1,200 +1,65 @@
-import requests
-from config import HEADERS
+import footapi
+import player_images
+import team_form
+from response_cache import IMMUTABLE_TTL
 import os
 from flask import current_app
 from flask import Flask, render_template, jsonify
-from requests.exceptions import JSONDecodeError
-
-
-def fetch_last_10_matches(team_id, current_match_id):
-    url = f"https://footapi7.p.rapidapi.com/api/team/{team_id}/matches/previous/0"
-    response = requests.get(url, headers=HEADERS)
-    matches = response.json().get("events", [])
-    print(matches)
-
-    # Filter out the current match
-    filtered_matches = [match for match in matches if match["id"] != current_match_id]
-
-    # Add results to the matches
-    for match in filtered_matches:
-        # Check if winnerCode is present in match
-        if "winnerCode" in match:
-            if match["winnerCode"] == 1:
-                match["result"] = (
-                    "win" if match["homeTeam"]["id"] == team_id else "loss"
-                )
-            elif match["winnerCode"] == 2:
-                match["result"] = (
-                    "win" if match["awayTeam"]["id"] == team_id else "loss"
-                )
-            else:
-                match["result"] = "draw"
-        else:
-            match[
-                "result"
-            ] = "pending"  # or any other suitable term to indicate the match hasn't been played
-
-    return filtered_matches[-10:][::-1]  # Get the last 10 matches and reverse the list
-
-
-def fetchPlayerImage(playerId):
-    # Ensure the saved image file has a .png extension
-    filename = f"{playerId}_image.png"
-    save_path = os.path.join(current_app.static_folder, "images", filename)
-
-    # Check if the image file already exists
-    if os.path.exists(save_path):
-        # If it exists, return the relative path to the existing file
-        return os.path.join("images", filename)
-
-    # If the image file doesn't exist, download it
-    url = f"https://footapi7.p.rapidapi.com/api/player/{playerId}/image"
-    headers = {
-        "X-RapidAPI-Key": "b42bc11359msh98e3d09a1e9557dp173da4jsn260d881d9ab9",
-        "X-RapidAPI-Host": "footapi7.p.rapidapi.com",
-    }
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-
-        # Save the image to the app's static folder
-        with open(save_path, "wb") as f:
-            f.write(response.content)
-
-        # Return the relative path to the saved image
-        return os.path.join("images", filename)
-
-    except requests.exceptions.RequestException as e:
-        print(f"An error occurred: {e}")
-        return None
+from incidents import get_incident_index
 
 
 def match_detail(match_id):
     # Fetch match details
     match_url = f"https://footapi7.p.rapidapi.com/api/match/{match_id}"
-    match_response = requests.get(match_url, headers=HEADERS)
+    match_response = footapi.get(match_url)
     match = match_response.json().get("event", {})
+    finished = match.get("status", {}).get("type") == "finished"
 
-    # Fetch lineups for the match
+    # Fetch lineups for the match (a finished match's lineups never change)
     lineup_url = f"https://footapi7.p.rapidapi.com/api/match/{match_id}/lineups"
-    lineup_response = requests.get(lineup_url, headers=HEADERS)
+    lineup_response = footapi.get(
+        lineup_url, cache_ttl=IMMUTABLE_TTL if finished else None
+    )
+    photo_sprite = None
     try:
         lineups = lineup_response.json()
-        # Fetch and save player images for home players
-        for player in lineups["home"]["players"]:
-            player_id = player["player"]["id"]
-            fetchPlayerImage(player_id)
-
-        # Fetch and save player images for away players
-        for player in lineups["away"]["players"]:
-            player_id = player["player"]["id"]
-            fetchPlayerImage(player_id)
+        lineup_player_ids = [
+            player["player"]["id"]
+            for side in ("home", "away")
+            for player in lineups[side]["players"]
+        ]
+        # Start downloading missing player photos; the page does not wait, the
+        # browser gets them from /player-image/<id> (sharing these downloads)
+        player_images.prefetch(lineup_player_ids)
+        photo_sprite = player_images.sprite_for(lineup_player_ids)
     except ValueError:
         print(
             f"Error decoding JSON for lineups of match {match_id}. Response content: {lineup_response.content}"
         )
         lineups = {"home": {}, "away": {}}  # Ensuring structure with home and away keys
 
-    # Fetch substitution incidents for the match
-    incidents_url = f"https://footapi7.p.rapidapi.com/api/match/{match_id}/incidents"
-    incidents_response = requests.get(incidents_url, headers=HEADERS)
-
-    try:
-        incidents = incidents_response.json().get("incidents", [])
-    except ValueError:  # Catches JSONDecodeErrors
-        print(
-            f"Error decoding JSON for match {match_id}. Response content: {incidents_response.content}"
-        )
-        incidents = []
-
-    # Fetch last 10 matches for home and away teams
-    home_last_10 = fetch_last_10_matches(match["homeTeam"]["id"], match_id)
-    away_last_10 = fetch_last_10_matches(match["awayTeam"]["id"], match_id)
-
-    # Process substitution incidents
-    subbed_in = {}
-    subbed_out = {}
-    goal_scorers = {}
-    assists = {}  # New dictionary to store player assists and their times
-    cards = {}  # Dictionary to store card incidents
-    subbed_in = {}  # Dictionary to store players who are subbed in
-    subbed_out = {}  # Dictionary to store players who are subbed out
+    # Incidents come from the shared per-match index (fetched once per process)
+    incident_index = get_incident_index(match_id, finished=finished) or {}
 
-    for incident in incidents:
-        # Process goals and goal scorers
-        # Process goals and goal scorers
-        if incident["incidentType"] == "goal":
-            player_id = incident.get("player", {}).get("id")
-            if player_id is not None:
-                if player_id in goal_scorers:
-                    goal_scorers[player_id].append(incident["time"])
-                else:
-                    goal_scorers[player_id] = [incident["time"]]
-
-        # Process goal assists
-        if incident["incidentType"] == "goal":
-            assist_player_id = incident.get("assist1", {}).get("id")
-            if assist_player_id is not None:
-                if assist_player_id in assists:
-                    assists[assist_player_id].append(incident["time"])
-                else:
-                    assists[assist_player_id] = [incident["time"]]
-
-        # Process substitutions
-        if incident["incidentType"] == "substitution":
-            # Map the ID of the player coming in to the name of the player going out
-            if incident["playerIn"]["id"] not in subbed_in:
-                subbed_in[incident["playerIn"]["id"]] = {
-                    "time": incident["time"],
-                    "name": incident["playerOut"]["name"],
-                }
-            # Map the ID of the player going out to the name of the player coming in
-            if incident["playerOut"]["id"] not in subbed_out:
-                subbed_out[incident["playerOut"]["id"]] = {
-                    "time": incident["time"],
-                    "name": incident["playerIn"]["name"],
-                }
-        # Process cards
-        if incident["incidentType"] == "card":
-            player_id = incident.get("player", {}).get("id")
-            if player_id is not None:
-                if incident["incidentClass"] == "red":
-                    card_type = "Red"
-                elif incident["incidentClass"] == "yellow":
-                    card_type = "Yellow"
-                elif incident["incidentClass"] == "yellowRed":
-                    card_type = "YellowRed"
-                else:
-                    continue
-
-                if player_id not in cards:
-                    cards[player_id] = []
-                cards[player_id].append({"time": incident["time"], "type": card_type})
-
-        if incident["incidentType"] == "substitution":
-            # Track the player subbed in
-            sub_in_id = incident["playerIn"]["id"]
-            subbed_in[sub_in_id] = {
-                "time": incident["time"],
-                "out_player_name": incident["playerOut"]["name"],
-            }
-
-            # Track the player subbed out
-            sub_out_id = incident["playerOut"]["id"]
-            subbed_out[sub_out_id] = {
-                "time": incident["time"],
-                "in_player_name": incident["playerIn"]["name"],
-            }
+    # Last 10 matches of both teams from the shared form cache (team_form.py)
+    home_team_id, away_team_id = match["homeTeam"]["id"], match["awayTeam"]["id"]
+    # A finished match missing from a cached form means that form is out of date
+    home_form, away_form = team_form.get_team_forms(
+        [home_team_id, away_team_id], finished_match=match if finished else None
+    )
+    home_last_10 = team_form.last_matches(home_form, exclude_match_id=match_id)
+    away_last_10 = team_form.last_matches(away_form, exclude_match_id=match_id)
 
     return render_template(
         "match_detail.html",
         match=match,
         lineups=lineups,
-        goal_scorers=goal_scorers,
-        subbed_in=subbed_in,
-        subbed_out=subbed_out,
-        assists=assists,  # Pass the assists dictionary to the template
-        cards=cards,  # Add this line to pass the cards info to the template
+        goal_scorers=incident_index.get("goal_scorers", {}),
+        subbed_in=incident_index.get("subbed_in", {}),
+        subbed_out=incident_index.get("subbed_out", {}),
+        assists=incident_index.get("assists", {}),
+        cards=incident_index.get("cards", {}),
         home_last_10=home_last_10,  # Pass the home team's last 10 matches to the template
         away_last_10=away_last_10,  # Pass the away team's last 10 matches to the template
+        photo_sprite=photo_sprite,
     )
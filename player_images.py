@@ -0,0 +1,278 @@
+"""Player photos: a local file store in static/images, served lazily by /player-image/<id>.
+
+Templates point at the player_image() view instead of static files, so pages
+never wait for photos. The view serves the stored file if there is one;
+otherwise it downloads the photo once (concurrent requests for the same id
+share one download) and sends it, or a placeholder if there is no photo.
+Stored photos are sent with a content ETag and ``Cache-Control: immutable``.
+/player-image/<id>/<size> sends a small WebP thumbnail instead (see
+thumbnails.py), made when the photo is downloaded; templates use those.
+
+sprite_for(player_ids) packs the thumbnails a page shows into one sprite
+sheet, served by /player-sprite/<size>/<key>?ids=..., so a lineup or squad is
+one request (PLAYER_PHOTO_SPRITES, needs Pillow). The key hashes the members'
+photo hashes, so a sprite URL never changes content and is cached immutable.
+Players whose thumbnails do not exist yet are left out and get their own
+/player-image/<id> <img> (which makes them) until the next page view.
+
+prefetch(player_ids) starts every missing download at once on the footapi
+client's shared session, so it is bounded by FOOTAPI_CONCURRENCY and paced by
+the rate limiter like any other upstream call. An id that is already being
+downloaded (by this or another thread) is not requested again, and a 404 is
+remembered for NEGATIVE_TTL seconds so players without a photo are not
+re-requested on every page view.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import wait as wait_for
+
+from flask import Response, abort, request, send_file, url_for
+
+import footapi
+import thumbnails
+from config import IMAGE_HEADERS, PLAYER_PHOTO_SPRITES
+
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "images")
+NEGATIVE_TTL = 24 * 3600
+
+# How long the view waits for a photo it has to download (the image endpoint's timeout)
+PROXY_WAIT_SECONDS = 20
+# Most players in one sprite (a squad or both lineups fit with room to spare)
+MAX_SPRITE_TILES = 60
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Failures are retried by the browser after a while rather than cached for good
+PLACEHOLDER_CACHE_CONTROL = "public, max-age=300"
+PLACEHOLDER_SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="50" height="50" viewBox="0 0 50 50">'
+    '<rect width="50" height="50" fill="#e2e8f0"/>'
+    '<circle cx="25" cy="19" r="9" fill="#a0aec0"/>'
+    '<path d="M8 46c2-10 9-15 17-15s15 5 17 15z" fill="#a0aec0"/>'
+    "</svg>"
+)
+
+_guard = threading.Lock()
+# player_id -> concurrent Future of its download
+_in_flight = {}
+# player_id -> time until which a 404 is trusted
+_missing = {}
+# path -> (mtime, size, etag) so files are hashed once
+_etags = {}
+
+# Upstream photos are JPEG, PNG or WebP whatever the file name says
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG", "image/png"),
+    (b"RIFF", "image/webp"),
+    (b"GIF8", "image/gif"),
+)
+
+
+def image_filename(player_id):
+    return f"{player_id}_image.png"
+
+
+def image_path(player_id):
+    return os.path.join(IMAGE_DIR, image_filename(player_id))
+
+
+def is_stored(player_id):
+    # Older downloads left empty files behind for failed fetches
+    path = image_path(player_id)
+    return os.path.exists(path) and os.path.getsize(path) > 0
+
+
+def is_missing(player_id):
+    """True if the upstream recently answered 404 for this player's photo."""
+    with _guard:
+        return _missing.get(player_id, 0) > time.time()
+
+
+def _save(player_id, content):
+    # Write to a temporary name first so readers never see a partial file
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+    path = image_path(player_id)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    thumbnails.make_thumbnails(path, thumbnails.content_hash(content))
+
+
+async def _download(player_id):
+    url = f"https://footapi7.p.rapidapi.com/api/player/{player_id}/image"
+    try:
+        response = await footapi.fetch(url, headers=IMAGE_HEADERS)
+        if response.status_code == 404:
+            with _guard:
+                _missing[player_id] = time.time() + NEGATIVE_TTL
+            return False
+        if response.status_code != 200 or not response.content:
+            print(f"Image fetch for player {player_id} returned {response.status_code}")
+            return False
+        await asyncio.to_thread(_save, player_id, response.content)
+        return True
+    except (footapi.FootapiError, OSError) as e:
+        print(f"Image fetch for player {player_id} failed: {e}")
+        return False
+    finally:
+        with _guard:
+            _in_flight.pop(player_id, None)
+
+
+def prefetch(player_ids, wait=None):
+    """Download the photos of player_ids that are not stored yet.
+
+    Returns immediately unless wait is given, in which case it blocks until
+    those downloads finish or wait seconds pass, whichever comes first.
+    Returns the number of photos being downloaded.
+    """
+    wanted = [
+        player_id
+        for player_id in dict.fromkeys(player_ids)
+        if not is_stored(player_id)
+    ]
+    futures = []
+    with _guard:
+        now = time.time()
+        for player_id in wanted:
+            future = _in_flight.get(player_id)
+            if future is None:
+                if _missing.get(player_id, 0) > now:
+                    continue
+                future = footapi.submit(_download(player_id))
+                _in_flight[player_id] = future
+            futures.append(future)
+    if futures and wait:
+        wait_for(futures, timeout=wait)
+    return len(futures)
+
+
+def photo_digest(player_id):
+    """sha1 of a stored photo (cached until the file changes)."""
+    return _etag(image_path(player_id))
+
+
+def _etag(path):
+    stat = os.stat(path)
+    with _guard:
+        cached = _etags.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+    with open(path, "rb") as f:
+        etag = hashlib.sha1(f.read()).hexdigest()
+    with _guard:
+        _etags[path] = (stat.st_mtime, stat.st_size, etag)
+    return etag
+
+
+def _mimetype(path):
+    with open(path, "rb") as f:
+        head = f.read(4)
+    for signature, mimetype in _SIGNATURES:
+        if head.startswith(signature):
+            return mimetype
+    return "image/png"
+
+
+def _send(path, mimetype, etag):
+    response = send_file(path, mimetype=mimetype, etag=etag, conditional=True)
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def player_image(player_id, size=None):
+    """Send a player's photo, downloading it first if needed; a placeholder if there is none.
+
+    With size (one of thumbnails.THUMBNAIL_SIZES) the thumbnail is sent,
+    or the original photo if no thumbnail can be made.
+    """
+    if size is not None and size not in thumbnails.THUMBNAIL_SIZES:
+        abort(404)
+    path = image_path(player_id)
+    if not is_stored(player_id):
+        prefetch([player_id], wait=PROXY_WAIT_SECONDS)
+    if is_stored(player_id):
+        etag = _etag(path)
+        if size is not None:
+            thumbnail_path = thumbnails.thumbnail(path, etag, size)
+            if thumbnail_path is not None:
+                return _send(
+                    thumbnail_path,
+                    thumbnails.MIMETYPES[thumbnails.thumbnail_format()],
+                    f"{etag[:16]}-{size}",
+                )
+        return _send(path, _mimetype(path), etag)
+    response = Response(PLACEHOLDER_SVG, mimetype="image/svg+xml")
+    response.headers["Cache-Control"] = PLACEHOLDER_CACHE_CONTROL
+    return response
+
+
+def sprite_key(player_ids):
+    """Content key of a sprite of player_ids' photos; None if one is not stored."""
+    if not all(is_stored(player_id) for player_id in player_ids):
+        return None
+    members = ",".join(f"{player_id}:{photo_digest(player_id)}" for player_id in player_ids)
+    return hashlib.sha1(members.encode()).hexdigest()[:16]
+
+
+def sprite_for(player_ids):
+    """Sprite sheet of player_ids' thumbnails for a page, or None to use one <img> per player.
+
+    Returns {"url", "url_2x", "index": {player_id: tile}, "count"}; players
+    missing from index have no thumbnail yet.
+    """
+    if not PLAYER_PHOTO_SPRITES or not thumbnails.available():
+        return None
+    members = []
+    for player_id in dict.fromkeys(player_ids):
+        if len(members) == MAX_SPRITE_TILES:
+            break
+        if not is_stored(player_id):
+            continue
+        path = image_path(player_id)
+        digest = photo_digest(player_id)
+        if all(
+            os.path.exists(thumbnails.thumbnail_path(path, digest, size))
+            for size in thumbnails.THUMBNAIL_SIZES
+        ):
+            members.append(player_id)
+    if len(members) < 2:
+        return None
+    key = sprite_key(members)
+    ids = ",".join(str(player_id) for player_id in members)
+    small, large = thumbnails.THUMBNAIL_SIZES[0], thumbnails.THUMBNAIL_SIZES[-1]
+    return {
+        "url": url_for("player_sprite", size=small, key=key, ids=ids),
+        "url_2x": url_for("player_sprite", size=large, key=key, ids=ids),
+        "index": {player_id: index for index, player_id in enumerate(members)},
+        "count": len(members),
+    }
+
+
+def player_sprite(size, key):
+    """Send the size sprite of the players in ?ids=, building it if needed.
+
+    key must match the members' current photos, so only sprites a page could
+    have asked for are ever built.
+    """
+    if size not in thumbnails.THUMBNAIL_SIZES or not thumbnails.available():
+        abort(404)
+    try:
+        player_ids = [int(player_id) for player_id in request.args.get("ids", "").split(",")]
+    except ValueError:
+        abort(404)
+    if len(player_ids) > MAX_SPRITE_TILES:
+        abort(404)
+    if sprite_key(player_ids) != key:
+        abort(404)
+    path = thumbnails.sprite_path(IMAGE_DIR, key, size)
+    if not os.path.exists(path):
+        tiles = [
+            thumbnails.thumbnail(image_path(player_id), photo_digest(player_id), size)
+            for player_id in player_ids
+        ]
+        thumbnails.make_sprite(tiles, size, path)
+    return _send(path, thumbnails.MIMETYPES[thumbnails.thumbnail_format()], f"{key}-{size}")
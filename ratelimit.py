@@ -0,0 +1,174 @@
+"""Proactive token-bucket rate limiter shared by every thread and process.
+
+The bucket lives in a small SQLite file (RATE_LIMIT_DB_PATH) and every
+reservation runs inside a ``BEGIN IMMEDIATE`` transaction, so gunicorn
+workers, run.py and any backfill processes all draw from the same budget.
+Each API key has its own bucket (see footapi.bucket_for): requests made with
+another key neither spend nor clamp the stats key's budget.
+
+The refill rate starts just under the plan limit (RATE_LIMIT_PER_SECOND x
+RATE_LIMIT_HEADROOM) and adapts to the upstream: the bucket never holds more
+tokens than ``x-ratelimit-remaining`` says are left, an exhausted window
+(or a 420/429) pauses requests until ``x-ratelimit-reset`` / ``Retry-After``
+but never longer than RATE_LIMIT_MAX_PAUSE, and a 420/429 halves the rate,
+which then recovers gradually on successful responses. A response showing
+quota left ends a pause early.
+"""
+import sqlite3
+import time
+
+import db
+from config import (
+    RATE_LIMIT_DB_PATH,
+    RATE_LIMIT_HEADROOM,
+    RATE_LIMIT_MAX_PAUSE,
+    RATE_LIMIT_PER_SECOND,
+)
+
+BUCKET = "footapi"
+MIN_RATE = 0.2  # never slow below one request every 5s
+# Keep this many requests of the upstream window in reserve
+REMAINING_MARGIN = 1
+
+
+
+def enabled():
+    return RATE_LIMIT_PER_SECOND > 0
+
+
+def _max_rate():
+    return RATE_LIMIT_PER_SECOND * RATE_LIMIT_HEADROOM
+
+
+def _burst():
+    return max(1.0, _max_rate())
+
+
+CREATE_BUCKET_SQL = """
+    CREATE TABLE IF NOT EXISTS rate_limit_bucket (
+        name TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        rate REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        not_before REAL NOT NULL DEFAULT 0
+    );
+"""
+
+
+def _get_connection():
+    # Autocommit: reservations manage their own BEGIN IMMEDIATE transactions
+    return db.thread_connection(RATE_LIMIT_DB_PATH, (CREATE_BUCKET_SQL,), isolation_level=None)
+
+
+def _load(conn, now, bucket):
+    row = conn.execute(
+        "SELECT tokens, rate, updated_at, not_before FROM rate_limit_bucket WHERE name = ?",
+        (bucket,),
+    ).fetchone()
+    if row is None:
+        return _burst(), _max_rate(), now, 0.0
+    tokens, rate, updated_at, not_before = row
+    # Refill for the time elapsed since the last reservation
+    tokens = min(_burst(), tokens + max(0.0, now - updated_at) * rate)
+    return tokens, rate, now, not_before
+
+
+def _save(conn, bucket, tokens, rate, updated_at, not_before):
+    conn.execute(
+        "INSERT INTO rate_limit_bucket(name, tokens, rate, updated_at, not_before) VALUES(?,?,?,?,?) "
+        "ON CONFLICT(name) DO UPDATE SET tokens=excluded.tokens, rate=excluded.rate, "
+        "updated_at=excluded.updated_at, not_before=excluded.not_before",
+        (bucket, tokens, rate, updated_at, not_before),
+    )
+
+
+def _transaction(fn):
+    conn = _get_connection()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = fn(conn, now)
+        conn.execute("COMMIT")
+        return result
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def reserve(max_wait=None, bucket=BUCKET):
+    """Reserve one request from bucket and return how many seconds the caller must wait first.
+
+    If the wait would be longer than max_wait, nothing is reserved and None
+    is returned so the caller can fail instead of blocking.
+    """
+    if not enabled():
+        return 0.0
+
+    def _reserve(conn, now):
+        tokens, rate, updated_at, not_before = _load(conn, now, bucket)
+        tokens -= 1
+        wait = max(0.0, not_before - now)
+        if tokens < 0:
+            wait = max(wait, -tokens / rate)
+        if max_wait is not None and wait > max_wait:
+            return None
+        _save(conn, bucket, tokens, rate, updated_at, not_before)
+        return wait
+
+    try:
+        return _transaction(_reserve)
+    except sqlite3.Error as e:
+        # The limiter is best-effort; never fail a request because of it
+        print(f"Rate limiter unavailable: {e}")
+        return 0.0
+
+
+def _header_float(headers, *names):
+    for name in names:
+        try:
+            val = headers.get(name)
+        except Exception:
+            return None
+        if val not in (None, ""):
+            try:
+                return float(val)
+            except ValueError:
+                return None
+    return None
+
+
+def observe(status_code, headers, bucket=BUCKET):
+    """Feed a response's status and x-ratelimit headers back into the bucket it was reserved from."""
+    if not enabled():
+        return
+    remaining = _header_float(headers, "x-ratelimit-remaining")
+    reset = _header_float(headers, "x-ratelimit-reset")
+    retry_after = _header_float(headers, "retry-after")
+    rate_limited = status_code in (420, 429)
+    if not rate_limited and remaining is None:
+        return
+
+    def _observe(conn, now):
+        tokens, rate, updated_at, not_before = _load(conn, now, bucket)
+        if rate_limited:
+            rate = max(MIN_RATE, rate / 2)
+            tokens = min(tokens, 0.0)
+            pause = retry_after if retry_after is not None else (reset or 1.0 / rate)
+            not_before = max(not_before, now + min(pause, RATE_LIMIT_MAX_PAUSE))
+        else:
+            # Additive recovery back towards the plan limit
+            rate = min(_max_rate(), rate + _max_rate() * 0.05)
+        if remaining is not None:
+            # The upstream count is authoritative; never hold more than it has left
+            tokens = min(tokens, remaining - REMAINING_MARGIN)
+            if remaining <= REMAINING_MARGIN and reset:
+                not_before = max(not_before, now + min(reset, RATE_LIMIT_MAX_PAUSE))
+            elif not rate_limited:
+                # Quota is left (e.g. the window reset), so any earlier pause is over
+                not_before = 0.0
+        _save(conn, bucket, tokens, rate, updated_at, not_before)
+
+    try:
+        _transaction(_observe)
+    except sqlite3.Error as e:
+        print(f"Rate limiter unavailable: {e}")
@@ -0,0 +1,126 @@
+"""Persistent footapi response cache with per-endpoint TTLs.
+
+Bodies are stored zlib-compressed in a SQLite file (RESPONSE_CACHE_PATH)
+keyed by the full request URL, so the web app, run.py and every worker
+process share one cache that survives restarts. The footapi client consults
+it before going upstream.
+
+TTLs come from ENDPOINT_TTLS unless the caller knows better: data for a
+finished match never changes, so callers pass ``ttl=IMMUTABLE_TTL`` for
+statistics/incidents/lineups of finished matches.
+"""
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+import db
+from config import RESPONSE_CACHE_PATH
+
+IMMUTABLE_TTL = 365 * 24 * 3600
+
+# First match wins; a TTL of 0 means "never cache"
+ENDPOINT_TTLS = (
+    (re.compile(r"/player/\d+/image$"), 0),
+    (re.compile(r"/matches/top/\d+/\d+/\d+$"), 60),
+    (re.compile(r"/team/\d+/players$"), 24 * 3600),
+    (re.compile(r"/team/\d+$"), 24 * 3600),
+    (re.compile(r"/team/\d+/matches/(previous|next)/\d+$"), 10 * 60),
+    (re.compile(r"/team/\d+/matches/near$"), 60),
+    (re.compile(r"/match/\d+/player/\d+/statistics$"), 60),
+    (re.compile(r"/match/\d+/(lineups|incidents)$"), 30),
+    (re.compile(r"/match/\d+$"), 30),
+)
+DEFAULT_TTL = 60
+
+# Only successful and "no content" answers are worth remembering
+CACHEABLE_STATUSES = (200, 204)
+
+_PURGE_EVERY = 500
+
+_writes = 0
+_writes_lock = threading.Lock()
+
+
+def enabled():
+    return bool(RESPONSE_CACHE_PATH)
+
+
+def ttl_for(url):
+    for pattern, ttl in ENDPOINT_TTLS:
+        if pattern.search(url):
+            return ttl
+    return DEFAULT_TTL
+
+
+CREATE_HTTP_CACHE_SQL = """
+    CREATE TABLE IF NOT EXISTS http_cache (
+        url TEXT PRIMARY KEY,
+        status INT NOT NULL,
+        body BLOB,
+        fetched_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    );
+"""
+
+
+def _get_connection():
+    return db.thread_connection(RESPONSE_CACHE_PATH, (CREATE_HTTP_CACHE_SQL,))
+
+
+def get(url):
+    """Return (status_code, content) for a fresh cached response, or None."""
+    if not enabled():
+        return None
+    try:
+        row = _get_connection().execute(
+            "SELECT status, body FROM http_cache WHERE url = ? AND expires_at > ?",
+            (url, time.time()),
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"Response cache read failed for {url}: {e}")
+        return None
+    if row is None:
+        return None
+    status, body = row
+    return status, zlib.decompress(body) if body else b""
+
+
+def put(url, status_code, content, ttl):
+    """Store a response for ttl seconds (no-op for uncacheable statuses or ttl <= 0)."""
+    global _writes
+    if not enabled() or ttl <= 0 or status_code not in CACHEABLE_STATUSES:
+        return
+    now = time.time()
+    conn = _get_connection()
+    try:
+        conn.execute(
+            "INSERT INTO http_cache(url, status, body, fetched_at, expires_at) VALUES(?,?,?,?,?) "
+            "ON CONFLICT(url) DO UPDATE SET status=excluded.status, body=excluded.body, "
+            "fetched_at=excluded.fetched_at, expires_at=excluded.expires_at",
+            (url, status_code, zlib.compress(content or b"", 6), now, now + ttl),
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Response cache write failed for {url}: {e}")
+        return
+    with _writes_lock:
+        _writes += 1
+        should_purge = _writes % _PURGE_EVERY == 0
+    if should_purge:
+        purge_expired()
+
+
+def purge_expired():
+    """Delete expired entries; returns the number removed."""
+    if not enabled():
+        return 0
+    conn = _get_connection()
+    try:
+        cur = conn.execute("DELETE FROM http_cache WHERE expires_at <= ?", (time.time(),))
+        conn.commit()
+        return cur.rowcount
+    except sqlite3.Error as e:
+        print(f"Response cache purge failed: {e}")
+        return 0
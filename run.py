@@ -1,341 +1,707 @@
-from flask import Flask, render_template, jsonify
-import requests
 from datetime import datetime
-from requests.exceptions import JSONDecodeError
-from flask_caching import Cache
+import argparse
+import asyncio
 import time
-import os
-from flask import current_app
 from collections import defaultdict
 import json
-import sqlite3
-from config import HEADERS
+from config import FOOTAPI_CONCURRENCY, LINEUP_STATS_INGESTION
+import db
+from db import set_team_high_water, upsert_rows
+import footapi
+import response_cache
+import snapshots
+from response_cache import IMMUTABLE_TTL
+from incidents import build_incident_index, get_incident_index
+from team_form import last_finished_matches
 from tqdm import tqdm
-import concurrent.futures  # Add this import
+from concurrent.futures import ThreadPoolExecutor
 
 
-# Create table if it doesn't exist
-def create_table():
-    conn = sqlite3.connect("database.sqlite")
-    try:
-        cur = conn.cursor()
-        create_table_sql = """
-        CREATE TABLE IF NOT EXISTS player_match_statistics (
-            match_id INT,
-            player_id INT,
-            wasFouled INT,
-            fouls INT,
-            shotOffTarget INT,
-            shotOnTarget INT,
-            yellowCardsCount INT,
-            redCard BOOLEAN,
-            avg_minutes_played FLOAT,
-            PRIMARY KEY (match_id, player_id)
-        );
-        """
-        cur.execute(create_table_sql)
-        conn.commit()
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        cur.close()
-        conn.close()
-
-
-# HTTP session (connection reuse for speed)
-SESSION = requests.Session()
-SESSION.headers.update(HEADERS)
-
-
-def get_db_connection():
-    """Return a SQLite connection tuned for faster bulk writes."""
-    conn = sqlite3.connect("database.sqlite", check_same_thread=False)
-    try:
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("PRAGMA synchronous=NORMAL;")
-        conn.execute("PRAGMA temp_store=MEMORY;")
-    except Exception:
-        # Pragmas are best-effort; continue if unsupported
-        pass
-    return conn
+def events_on(day):
+    """Top matches (from /matches/top) that kick off on the given date."""
+    url = f"https://footapi7.p.rapidapi.com/api/matches/top/{day:%d/%m/%Y}"
+    response = footapi.get(url)
+    data = response.json()
+    events = data.get("events", [])
 
+    return [
+        event
+        for event in events
+        if datetime.fromtimestamp(event["startTimestamp"]).date() == day
+    ]
 
-# Call create_table function to ensure table exists
-create_table()
 
+def todays_events():
+    """Today's top matches (from /matches/top) that kick off today."""
+    return events_on(datetime.now().date())
 
-def get_fixtures():
-    today = datetime.now().strftime("%d/%m/%Y")
-    day, month, year = today.split("/")
-    url = f"https://footapi7.p.rapidapi.com/api/matches/top/{day}/{month}/{year}"
-    response = SESSION.get(url)
-    data = response.json()
-    events = data.get("events", [])
 
-    # Use tqdm to create a progress bar
-    for event in tqdm(events, desc="Processing fixtures"):
-        current_date = datetime.now().strftime("%d/%m/%Y")
-        formatted_start_date = datetime.fromtimestamp(event["startTimestamp"]).strftime(
-            "%d/%m/%Y"
-        )
-        if formatted_start_date == current_date:
+def get_fixtures(incremental=False, dry_run=False, engine="queue", team_ids=None):
+    """Warm today's fixtures (or the given team_ids) with the chosen engine."""
+    if team_ids is None:
+        team_ids = []
+        for event in todays_events():
             home_team_name = event["homeTeam"]["name"]
             away_team_name = event["awayTeam"]["name"]
-            home_team_id = event["homeTeam"]["id"]
-            away_team_id = event["awayTeam"]["id"]
             print("Event : ", home_team_name, " v ", away_team_name)
+            team_ids.append(event["homeTeam"]["id"])
+            team_ids.append(event["awayTeam"]["id"])
 
-            # Record the start time before making the next event request
-            start_time = time.time()
+    if dry_run:
+        estimate_teams(team_ids, incremental)
+        return
 
-            # Use concurrent.futures to fetch team details and player statistics concurrently
-            with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-                futures = [
-                    executor.submit(team_detail, home_team_id),
-                    executor.submit(team_detail, away_team_id),
-                ]
+    if engine == "pipeline":
+        import update  # update.py imports this module, so load it only when selected
 
-                # Wait for both tasks to complete before moving on to the next event
-                concurrent.futures.wait(futures)
+        update.warm_teams(team_ids, incremental)
+    else:
+        # Plan every fixture's work up front and run it as one queue
+        warm_teams(team_ids, incremental)
 
-            # Calculate the time it took to get to the next event
-            elapsed_time = time.time() - start_time
-            print(f"Time to next event: {elapsed_time:.2f} seconds")
+    print(f"footapi requests: {footapi.stats()}")
 
 
-def get_new_connection():
-    return get_db_connection()
+def lineup_statistics(lineups_response):
+    """Return {player_id: statistics} for every player in a lineups response, or None."""
+    if isinstance(lineups_response, Exception) or lineups_response.status_code != 200:
+        return None
+    try:
+        lineups = lineups_response.json()
+    except ValueError:
+        return None
+    stats_by_player = {}
+    for side in ("home", "away"):
+        for entry in (lineups.get(side) or {}).get("players", []):
+            player_id = (entry.get("player") or {}).get("id")
+            if player_id is not None:
+                stats_by_player[player_id] = entry.get("statistics") or {}
+    return stats_by_player
 
 
-def fetch_statistics_if_exists(match_id, player_id):
-    """Fetch player statistics if they exist for a given match_id and player_id."""
-    conn = get_new_connection()  # get a database connection
-    cur = conn.cursor()
+def build_row(match_id, player_id, statistics, incidents_by_match):
+    """Build one player_match_stats row from a statistics dict and the incidents map.
 
-    query = """
-        SELECT 
-            wasFouled, fouls, shotOffTarget, shotOnTarget, 
-            yellowCardsCount, redCard, avg_minutes_played
-        FROM player_match_statistics 
-        WHERE match_id = ? AND player_id = ? LIMIT 1
+    Rows are only built from complete upstream answers, so a player without
+    minutes did not play and gets NULL minutes_played (see team_detail.stats_row).
     """
-    cur.execute(query, (match_id, player_id))
-    result = cur.fetchone()
-    conn.close()
+    minutes_played = statistics.get("minutesPlayed", 0) or 0
+    yc, rc = incidents_by_match.get(match_id, {}).get(player_id, (0, False))
+    return (
+        match_id,
+        player_id,
+        statistics.get("wasFouled", 0),
+        statistics.get("fouls", 0),
+        statistics.get("shotOffTarget", 0),
+        statistics.get("onTargetScoringAttempt", 0),
+        yc,
+        1 if rc else 0,
+        float(minutes_played) if minutes_played else None,
+    )
 
-    if result:
-        return True, result  # Record exists, return True and the fetched values
-    else:
-        return False, None  # Record does not exist, return False and None
+
+def match_cards(incident_index):
+    """{player_id: (yellow_cards, red_card)} from a match's incident index."""
+    return {
+        player_id: (entry["yellowCardsCount"], entry["redCard"])
+        for player_id, entry in incident_index.get("players", {}).items()
+    }
 
 
-def upsert_rows(conn, rows):
-    """Bulk upsert rows into player_match_statistics.
+def plan_work(team_ids, incremental=False, dry_run=False):
+    """Collect the (match, player) pairs every team needs, deduplicated across teams and SQLite.
 
-    rows: iterable of tuples (match_id, player_id, wasFouled, fouls, shotOffTarget, shotOnTarget, yellowCardsCount, redCard, avg_minutes_played)
+    Teams playing the same opponents share matches, so each match appears once
+    with the union of the squads that need it. Pairs already stored with a
+    complete row (db.row_is_valid) are dropped.
+    With incremental=True only matches finished after a team's high-water
+    mark are considered. The teams' matches and squads are recorded in SQLite
+    unless dry_run is set.
+
+    Returns (work, team_matches, unplanned): work maps match_id -> set of
+    player_ids still to fetch; team_matches maps team_id -> the finished
+    matches planned for it; unplanned lists teams whose match or squad list
+    could not be fetched (they are left out of the plan).
     """
-    sql = (
-        "INSERT INTO player_match_statistics(\n"
-        "  match_id, player_id, wasFouled, fouls, shotOffTarget, shotOnTarget, yellowCardsCount, redCard, avg_minutes_played\n"
-        ") VALUES(?,?,?,?,?,?,?,?,?)\n"
-        "ON CONFLICT(match_id, player_id) DO UPDATE SET\n"
-        "  wasFouled=excluded.wasFouled,\n"
-        "  fouls=excluded.fouls,\n"
-        "  shotOffTarget=excluded.shotOffTarget,\n"
-        "  shotOnTarget=excluded.shotOnTarget,\n"
-        "  yellowCardsCount=excluded.yellowCardsCount,\n"
-        "  redCard=excluded.redCard,\n"
-        "  avg_minutes_played=excluded.avg_minutes_played;"
+    team_ids = list(dict.fromkeys(team_ids))
+    previous_responses = footapi.get_many(
+        [f"https://footapi7.p.rapidapi.com/api/team/{team_id}/matches/previous/0" for team_id in team_ids]
+    )
+    team_matches = {}
+    unplanned = []
+    for team_id, previous_response in zip(team_ids, previous_responses):
+        try:
+            if isinstance(previous_response, Exception) or previous_response.status_code != 200:
+                raise ValueError(f"status {getattr(previous_response, 'status_code', previous_response)}")
+            finished_matches = last_finished_matches(previous_response.json().get("events", []))
+        except ValueError as e:
+            print(f"Team {team_id}: could not fetch previous matches ({e}), skipping")
+            unplanned.append(team_id)
+            continue
+        high_water = db.get_team_high_water(team_id) if incremental else None
+        if high_water is not None:
+            last_start_timestamp = high_water[1] or 0
+            finished_matches = [
+                match
+                for match in finished_matches
+                if (match.get("startTimestamp") or 0) > last_start_timestamp
+            ]
+        if not finished_matches:
+            print(f"Team {team_id}: no matches finished since last run")
+            continue
+        team_matches[team_id] = finished_matches
+
+    planned_teams = list(team_matches)
+    players_responses = footapi.get_many(
+        [f"https://footapi7.p.rapidapi.com/api/team/{team_id}/players" for team_id in planned_teams]
+    )
+    needed = {}
+    squads = {}
+    for team_id, players_response in zip(planned_teams, players_responses):
+        try:
+            if isinstance(players_response, Exception) or players_response.status_code != 200:
+                raise ValueError(f"status {getattr(players_response, 'status_code', players_response)}")
+            players = players_response.json().get("players", [])
+        except ValueError as e:
+            print(f"Team {team_id}: could not fetch players ({e}), skipping")
+            team_matches.pop(team_id)
+            unplanned.append(team_id)
+            continue
+        squads[team_id] = players
+        player_ids = [player_data["player"]["id"] for player_data in players]
+        for match in team_matches[team_id]:
+            needed.setdefault(match["id"], set()).update(player_ids)
+
+    if not dry_run:
+        for team_id, players in squads.items():
+            db.record_team(team_id, team_matches[team_id], players)
+
+    existing = db.fetch_statistics_bulk(
+        list(needed), [player_id for player_ids in needed.values() for player_id in player_ids]
     )
-    cur = conn.cursor()
-    cur.executemany(sql, rows)
-    cur.close()
+    work = {}
+    for match_id, player_ids in needed.items():
+        # Rows left by failed fetches (0 minutes, no events) are planned again
+        missing = {
+            player_id
+            for player_id in player_ids
+            if not db.row_is_valid(existing.get((match_id, player_id)))
+        }
+        if missing:
+            work[match_id] = missing
+
+    total_pairs = sum(len(player_ids) for player_ids in needed.values())
+    print(
+        f"Planned {len(team_matches)} teams, {len(needed)} matches, {total_pairs} player-match pairs; "
+        f"{total_pairs - sum(len(p) for p in work.values())} already stored, "
+        f"{len(work)} matches to fetch"
+    )
+    return work, team_matches, unplanned
+
 
+def _is_cached(url):
+    return response_cache.get(footapi.build_url(url)) is not None
 
-def team_detail(team_id):
+
+def estimate_work(work):
+    """Count the upstream calls run_work would make for a plan, without making them.
+
+    Responses already in the persistent cache are free. When a match's lineups
+    are cached the per-player fallbacks are counted exactly; otherwise every
+    planned player of that match is counted as a possible fallback, so those
+    figures are upper bounds. Retries are not included.
+
+    Returns (exact, upper): {endpoint: calls} for each kind of count.
+    """
+    exact = defaultdict(int)
+    upper = defaultdict(int)
+    for match_id, player_ids in work.items():
+        incidents_url = f"https://footapi7.p.rapidapi.com/api/match/{match_id}/incidents"
+        if not _is_cached(incidents_url):
+            exact[footapi.endpoint_of(incidents_url)] += 1
+
+        stats_by_player = {}
+        fallback_counts = exact
+        if LINEUP_STATS_INGESTION:
+            lineups_url = f"https://footapi7.p.rapidapi.com/api/match/{match_id}/lineups"
+            cached = response_cache.get(footapi.build_url(lineups_url))
+            if cached is None:
+                exact[footapi.endpoint_of(lineups_url)] += 1
+                # Unknown until the lineups arrive: any planned player may need a fallback
+                fallback_counts = upper
+            else:
+                status_code, content = cached
+                lineups_response = footapi.FootapiResponse(lineups_url, status_code, {}, content)
+                stats_by_player = lineup_statistics(lineups_response) or {}
+
+        for player_id in player_ids:
+            if player_id in stats_by_player:
+                continue
+            statistics_url = (
+                f"https://footapi7.p.rapidapi.com/api/match/{match_id}/player/{player_id}/statistics"
+            )
+            if not _is_cached(statistics_url):
+                fallback_counts[footapi.endpoint_of(statistics_url)] += 1
+    return dict(exact), dict(upper)
+
+
+def estimate_teams(team_ids, incremental=False):
+    """Dry run: plan the warm for these teams and print the upstream calls it would cost.
+
+    Planning itself still reads each team's previous matches and squad (those
+    calls are reported separately); no match data is fetched and nothing is
+    written to SQLite.
+    """
+    planning_before = footapi.endpoint_stats()
+    work, team_matches, unplanned = plan_work(team_ids, incremental, dry_run=True)
+    planning_after = footapi.endpoint_stats()
+    planning = {
+        endpoint: count - planning_before.get(endpoint, 0)
+        for endpoint, count in planning_after.items()
+        if count > planning_before.get(endpoint, 0)
+    }
+    exact, upper = estimate_work(work)
+
+    print(f"Dry run: {len(team_matches)} teams, {len(work)} matches to fetch")
+    if unplanned:
+        print(f"  {len(unplanned)} teams could not be planned: {unplanned}")
+    print(f"  planning calls made: {sum(planning.values())}")
+    for endpoint, count in sorted(planning.items()):
+        print(f"    {endpoint:<40} {count}")
+    print(f"  warm calls needed: {sum(exact.values())} exact + up to {sum(upper.values())} more")
+    for endpoint in sorted(set(exact) | set(upper)):
+        line = f"    {endpoint:<40} {exact.get(endpoint, 0)}"
+        if upper.get(endpoint):
+            line += f" + up to {upper[endpoint]}"
+        print(line)
+    return exact, upper
+
+
+# get_incident_index() blocks on the footapi loop, so it must not run on that
+# loop's default executor (which the client itself uses for cache/limiter I/O)
+_incident_pool = ThreadPoolExecutor(max_workers=FOOTAPI_CONCURRENCY, thread_name_prefix="incidents")
+
+
+def _incident_index_async(match_id):
+    return asyncio.get_running_loop().run_in_executor(_incident_pool, get_incident_index, match_id)
+
+
+QUOTA_STATUSES = (420, 429)
+
+
+async def fetch_match_rows(match_id, player_ids):
+    """Fetch one match's lineups and incidents, then per-player fallbacks, and build its rows.
+
+    Every player in the lineup gets a row (not only player_ids); the per-player
+    statistics endpoint is only called for player_ids missing from it. Failed
+    fetches produce no row, so they are planned again on the next run. With no
+    player_ids the lineups are the only source of players (as in backfill.py),
+    so lineups that could not be fetched fail the match.
+
+    Returns (rows, (failed_player_ids, http_status, error)); nothing is written.
+    """
+    lineups_url = f"https://footapi7.p.rapidapi.com/api/match/{match_id}/lineups"
+    if LINEUP_STATS_INGESTION:
+        lineups_response, incident_index = await asyncio.gather(
+            footapi.fetch(lineups_url, cache_ttl=IMMUTABLE_TTL),
+            _incident_index_async(match_id),
+            return_exceptions=True,
+        )
+        stats_by_player = lineup_statistics(lineups_response)
+        if stats_by_player is None and not player_ids:
+            lineups_status = getattr(lineups_response, "status_code", None)
+            # A match without lineups (404/204) has nothing to store; anything else is retried
+            if lineups_status is None or lineups_status in QUOTA_STATUSES or lineups_status >= 500:
+                return [], (set(), lineups_status, "lineups unavailable")
+        stats_by_player = stats_by_player or {}
+    else:
+        incident_index = await _incident_index_async(match_id)
+        stats_by_player = {}
+
+    if incident_index is None or isinstance(incident_index, Exception):
+        # Cards would be wrong without incidents; retry the whole match next run
+        print(f"Match {match_id}: incidents unavailable, skipping")
+        return [], (set(player_ids), None, "incidents unavailable")
+    incidents_by_match = {match_id: match_cards(incident_index)}
+
+    rows = [
+        build_row(match_id, player_id, statistics, incidents_by_match)
+        for player_id, statistics in stats_by_player.items()
+    ]
+
+    # Fall back to the per-player endpoint for players missing from the lineup
+    fallback_ids = [player_id for player_id in player_ids if player_id not in stats_by_player]
+    statistics_responses = await footapi.fetch_many(
+        [
+            f"https://footapi7.p.rapidapi.com/api/match/{match_id}/player/{player_id}/statistics"
+            for player_id in fallback_ids
+        ],
+        cache_ttl=IMMUTABLE_TTL,
+    )
+    failed_player_ids = set()
+    http_status = None
+    error = None
+    for player_id, statistics_response in zip(fallback_ids, statistics_responses):
+        if isinstance(statistics_response, Exception):
+            failed_player_ids.add(player_id)
+            error = str(statistics_response)
+            continue
+        # 404: the player has no statistics for the match, i.e. did not play
+        if statistics_response.status_code not in (200, 204, 404):
+            failed_player_ids.add(player_id)
+            http_status = statistics_response.status_code
+            continue
+        statistics = {}
+        if statistics_response.status_code == 200:
+            try:
+                statistics = statistics_response.json().get("statistics", {})
+            except ValueError:
+                failed_player_ids.add(player_id)
+                error = "invalid statistics JSON"
+                continue
+        rows.append(build_row(match_id, player_id, statistics, incidents_by_match))
+
+    return rows, (failed_player_ids, http_status, error)
+
+
+async def ingest_match(match_id, player_ids, run_id=None):
+    """Fetch one match (see fetch_match_rows) and store its rows.
+
+    With a run_id the item's checkpoint is updated in the same transaction as its rows.
+    Returns (failed_player_ids, http_status, error); all three are empty on success.
+    """
+    rows, result = await fetch_match_rows(match_id, player_ids)
+    await asyncio.to_thread(store_match, run_id, match_id, rows, result)
+    return result
+
+
+def store_match(run_id, match_id, rows, result):
+    # Rows and the item's status commit together, so a crash never loses or repeats work
+    failed_player_ids, http_status, error = result
+    with db.transaction() as conn:
+        upsert_rows(conn, rows)
+        if run_id is not None:
+            if failed_player_ids or http_status is not None or error is not None:
+                db.mark_warm_item(
+                    conn, run_id, match_id, "failed", failed_player_ids, http_status, error
+                )
+            else:
+                db.mark_warm_item(conn, run_id, match_id, "done")
+
+
+async def run_work(work, run_id=None, concurrency=FOOTAPI_CONCURRENCY):
+    """Run the planned matches as one queue, at most `concurrency` matches at a time.
+
+    Upstream calls are additionally bounded by the footapi client and paced by
+    the shared rate limiter, so the queue drains as fast as the plan allows.
+    Once a match fails with a quota status (420/429, after the client's own
+    retries) no further matches are started; they stay pending for --resume.
+    Returns {match_id: failed_player_ids} for the matches that ran.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = tqdm(total=len(work), desc="Ingesting matches")
+    quota_exhausted = asyncio.Event()
+
+    async def run_one(match_id, player_ids):
+        async with semaphore:
+            if quota_exhausted.is_set():
+                return None
+            if footapi.budget_exhausted():
+                if not quota_exhausted.is_set():
+                    print("Request budget reached; stopping, resume later with --resume")
+                    quota_exhausted.set()
+                return None
+            try:
+                failed_player_ids, http_status, _ = await ingest_match(match_id, player_ids, run_id)
+            except Exception as e:
+                print(f"Match {match_id}: ingestion failed: {e}")
+                if run_id is not None:
+                    await asyncio.to_thread(
+                        store_match, run_id, match_id, [], (set(player_ids), None, str(e))
+                    )
+                return set(player_ids)
+            finally:
+                progress.update(1)
+            if http_status in QUOTA_STATUSES and not quota_exhausted.is_set():
+                print(f"Upstream quota exhausted ({http_status}); stopping, resume later with --resume")
+                quota_exhausted.set()
+            return failed_player_ids
+
+    match_ids = list(work)
+    results = await asyncio.gather(*(run_one(match_id, work[match_id]) for match_id in match_ids))
+    progress.close()
+    return {
+        match_id: failed for match_id, failed in zip(match_ids, results) if failed is not None
+    }
+
+
+def execute_warm_run(run_id):
+    """Run (or resume) a checkpointed batch run: only items not yet done are fetched.
+
+    A team's high-water mark advances once every match planned for it is done.
+    Returns the run's final status ("done" or "incomplete").
+    """
     start_time = time.time()
-    # Fetch team details
-    team_url = f"https://footapi7.p.rapidapi.com/api/team/{team_id}"
-    team_response = SESSION.get(team_url)
-    team = team_response.json().get("team", {})
-
-    # Fetch players for the team
-    players_url = f"https://footapi7.p.rapidapi.com/api/team/{team_id}/players"
-    players_response = SESSION.get(players_url)
-    players = players_response.json().get("players", [])
-
-    # Fetch the last 5 matches for the team
-    matches_url = (
-        f"https://footapi7.p.rapidapi.com/api/team/{team_id}/matches/previous/0"
+    work = db.unfinished_warm_items(run_id)
+    print(f"Warm run {run_id}: {len(work)} matches to fetch")
+    db.set_warm_run_status(run_id, "running")
+    if work:
+        footapi.run(run_work(work, run_id))
+
+    unfinished = db.unfinished_warm_items(run_id)
+    for team_id, match_ids, newest_match_id, newest_start_timestamp in db.warm_run_teams(run_id):
+        if any(match_id in unfinished for match_id in match_ids):
+            print(f"Team {team_id}: some fetches failed or are pending; resume with --resume {run_id}")
+            continue
+        with db.transaction() as conn:
+            set_team_high_water(conn, team_id, newest_match_id, newest_start_timestamp)
+
+    status = "incomplete" if unfinished else "done"
+    db.set_warm_run_status(run_id, status)
+    print(
+        f"Warm run {run_id} {status}: {len(work) - len(unfinished)} matches ingested, "
+        f"{len(unfinished)} left in {time.time() - start_time:.2f}s"
     )
-    next_matches_response = SESSION.get(matches_url)
-    all_matches = next_matches_response.json().get("events", [])
-    # print(all_matches[0]["status"])
+    return status
 
-    # Fetch the next match for the team
-    next_matches_url = (
-        f"https://footapi7.p.rapidapi.com/api/team/{team_id}/matches/next/0"
-    )
-    next_matches_response = SESSION.get(next_matches_url)
-    next_matches = next_matches_response.json().get("events", [])
-    next_match_id = next_matches[0]["id"]
-
-    near_matches_url = (
-        next_matches_url
-    ) = f"https://footapi7.p.rapidapi.com/api/team/{team_id}/matches/near"
-    near_matches_response = SESSION.get(near_matches_url)
-    near_matches = near_matches_response.json().get("previousEvent", [])
-    previous_event = near_matches["status"]
-    # print(previous_event)
-    previous_match_id = near_matches["id"]
-
-    near_matches_response = SESSION.get(near_matches_url)
-    near_matches = near_matches_response.json().get("nextEvent", [])
-    next_match = near_matches["status"]
-    next_match_id = near_matches["id"]
-    if previous_event["type"] == "inprogress":
-        # print("game in progress")
-        live_match_id = previous_match_id
-    if previous_event["type"] != "inprogress":
-        # print("game coming up")
-        live_match_id = next_match_id
-
-    # Fetch lineups for the match
-    lineup_url = f"https://footapi7.p.rapidapi.com/api/match/{live_match_id}/lineups"
-    lineup_response = SESSION.get(lineup_url)
-
-    # Check if the lineup request was successful
-    if lineup_response.status_code == 200:
-        try:
-            lineups = lineup_response.json()
 
-        except JSONDecodeError:
-            print("Failed to decode JSON for lineups data")
-            lineups = {"home": {}, "away": {}}  # Provide a default value
-    else:
-        print(f"Failed to fetch lineups. Status code: {lineup_response.status_code}")
-        lineups = {
-            "home": {},
-            "away": {},
-        }  # Provide a default value in case of failure
+def plan_warm_run(team_ids, incremental=False):
+    """Plan several teams' last finished matches as one checkpointed run.
 
-    try:
-        lineups = lineup_response.json()
-        # Fetch and save player images for home players
-        for player in lineups["home"]["players"]:
-            player_id = player["player"]["id"]
-        # Fetch and save player images for away players
-        for player in lineups["away"]["players"]:
-            player_id = player["player"]["id"]
-    except ValueError:
-        print(
-            f"Error decoding JSON for lineups of match {live_match_id}. Response content: {lineup_response.content}"
-        )
-        lineups = {
-            "home": {},
-            "away": {},
-        }  # Ensuring structure with home and away keys
-
-    # Check to see if they currently have a match
-
-    last_5_matches = all_matches[::-1][:10]
-    last_5_finished_matches = [
-        match
-        for match in all_matches[::-1]
-        if match.get("status", {}).get("type") == "finished"
-    ][:10]
-
-    # Build incidents map once per match: match_id -> {player_id: (yellow_count, red_bool)}
-    incidents_by_match = {}
-    for match in last_5_finished_matches:
-        match_id = match["id"]
+    Returns (run_id, unplanned); unplanned lists the teams left out of the run.
+    """
+    work, team_matches, unplanned = plan_work(team_ids, incremental)
+    return db.create_warm_run(work, team_matches, incremental), unplanned
+
+
+def warm_teams(team_ids, incremental=False):
+    """Plan several teams' last finished matches as one checkpointed run and execute it.
+
+    Returns the run's status; "incomplete" also when some teams could not be planned.
+    """
+    run_id, unplanned = plan_warm_run(team_ids, incremental)
+    status = execute_warm_run(run_id)
+    return "incomplete" if unplanned else status
+
+
+def team_detail(team_id, incremental=False):
+    """Fetch and store stats for one team's last finished matches (see warm_teams)."""
+    warm_teams([team_id], incremental)
+
+
+REPROCESS_BATCH_ROWS = 1000
+
+
+def reprocess_snapshots(match_ids=None):
+    """Rebuild player_match_stats from stored snapshots, without any upstream calls.
+
+    Match details are refreshed from the match and previous-matches snapshots
+    first. Every finished match with an incidents snapshot is then rebuilt:
+    each player in its lineups snapshot gets a row, as does each player with a
+    per-player statistics snapshot. Snapshots of live or upcoming matches hold
+    partial data and are skipped. Change build_row (and the schema) to derive
+    a new metric, then reprocess. match_ids limits the rebuild to those
+    matches. Returns the number of rows written.
+    """
+    # Match details (kickoff, status, tournament, teams) for the matches table
+    events = []
+    for _, status_code, content in snapshots.iter_snapshots("team/{id}/matches/previous/{id}"):
+        if status_code != 200:
+            continue
+        try:
+            events.extend(json.loads(content).get("events", []))
+        except ValueError:
+            continue
+    for _, status_code, content in snapshots.iter_snapshots("match/{id}"):
+        if status_code != 200:
+            continue
+        try:
+            events.append(json.loads(content).get("event"))
+        except ValueError:
+            continue
+    # Finished events go last so an older live snapshot cannot overwrite their status
+    events = [event for event in events if event]
+    events.sort(key=lambda event: (event.get("status") or {}).get("type") == "finished")
+    with db.transaction() as conn:
+        db.upsert_matches(conn, events)
+
+    # Only finished matches are rebuilt; other snapshots hold partial data
+    finished = db.finished_match_ids()
+
+    wanted_matches = set(match_ids) if match_ids else None
+    cards_by_match = {}
+    for (match_id,), status_code, content in snapshots.iter_snapshots("match/{id}/incidents"):
+        if status_code != 200 or match_id not in finished:
+            continue
+        if wanted_matches is not None and match_id not in wanted_matches:
+            continue
         try:
-            incidents_url = f"https://footapi7.p.rapidapi.com/api/match/{match_id}/incidents"
-            incidents_response = SESSION.get(incidents_url)
-            incidents = []
-            if incidents_response.status_code == 200:
-                try:
-                    incidents = incidents_response.json().get("incidents", [])
-                except json.JSONDecodeError:
-                    incidents = []
-            per_player = {}
-            for incident in incidents:
-                player_id = incident.get("player", {}).get("id")
-                if not player_id:
-                    continue
-                iclass = incident.get("incidentClass")
-                if iclass in ["yellow", "yellowRed"]:
-                    yc, rc = per_player.get(player_id, (0, False))
-                    per_player[player_id] = (yc + 1, rc or iclass in ["red", "yellowRed"])  # yellowRed implies both
-                elif iclass == "red":
-                    yc, rc = per_player.get(player_id, (0, False))
-                    per_player[player_id] = (yc, True)
-            incidents_by_match[match_id] = per_player
-        except Exception as e:
-            print(f"Incidents fetch failed for match {match_id}: {e}")
-            incidents_by_match[match_id] = {}
-
-    # Prepare bulk rows for upsert inside one transaction
-    conn = get_new_connection()
-    rows_to_write = []
-
-    for player_data in players:
-        player_id = player_data["player"]["id"]
-
-        rows_for_player = []
-        minutes_sum = 0
-        minutes_count = 0
-
-        for match in last_5_finished_matches:
-            match_id = match["id"]
-            statistics_url = f"https://footapi7.p.rapidapi.com/api/match/{match_id}/player/{player_id}/statistics"
-            statistics_response = SESSION.get(statistics_url)
-            was_fouled = 0
-            fouls = 0
-            shot_off = 0
-            shot_on = 0
-            minutes_played = 0
-            if statistics_response.status_code == 200:
-                try:
-                    statistics = statistics_response.json().get("statistics", {})
-                    was_fouled = statistics.get("wasFouled", 0)
-                    fouls = statistics.get("fouls", 0)
-                    shot_off = statistics.get("shotOffTarget", 0)
-                    shot_on = statistics.get("onTargetScoringAttempt", 0)
-                    minutes_played = statistics.get("minutesPlayed", 0) or 0
-                except JSONDecodeError:
-                    pass
-            if isinstance(minutes_played, (int, float)):
-                minutes_sum += minutes_played
-                minutes_count += 1
-
-            yc, rc = incidents_by_match.get(match_id, {}).get(player_id, (0, False))
-            # Store per-match minutes directly in avg_minutes_played column for compatibility
-            rows_for_player.append((
-                match_id,
-                player_id,
-                was_fouled,
-                fouls,
-                shot_off,
-                shot_on,
-                yc,
-                1 if rc else 0,
-                float(minutes_played),
-            ))
-
-        # Average still computed for potential reporting, but we now persist per-match minutes
-        avg_minutes = (minutes_sum / minutes_count) if minutes_count > 0 else 0.0
-        rows_to_write.extend(rows_for_player)
+            incidents = json.loads(content).get("incidents", [])
+        except ValueError:
+            continue
+        cards_by_match[match_id] = match_cards(build_incident_index(incidents))
+
+    rows = []
+    written = 0
+    built = set()
+
+    def flush():
+        nonlocal rows, written
+        if rows:
+            with db.transaction() as conn:
+                upsert_rows(conn, rows)
+            written += len(rows)
+            rows = []
+
+    for (match_id,), status_code, content in snapshots.iter_snapshots("match/{id}/lineups"):
+        if match_id not in cards_by_match:
+            continue
+        lineups_response = footapi.FootapiResponse(None, status_code, {}, content)
+        for player_id, statistics in (lineup_statistics(lineups_response) or {}).items():
+            rows.append(build_row(match_id, player_id, statistics, cards_by_match))
+            built.add((match_id, player_id))
+        if len(rows) >= REPROCESS_BATCH_ROWS:
+            flush()
+
+    statistics_endpoint = "match/{id}/player/{id}/statistics"
+    for (match_id, player_id), status_code, content in snapshots.iter_snapshots(statistics_endpoint):
+        if match_id not in cards_by_match or (match_id, player_id) in built:
+            continue
+        statistics = {}
+        if status_code == 200:
+            try:
+                statistics = json.loads(content).get("statistics", {})
+            except ValueError:
+                continue
+        rows.append(build_row(match_id, player_id, statistics, cards_by_match))
+        if len(rows) >= REPROCESS_BATCH_ROWS:
+            flush()
+    flush()
+
+    print(f"Reprocessed {len(cards_by_match)} matches from snapshots: {written} rows written")
+    for endpoint, count, size in snapshots.summary():
+        print(f"  {endpoint:<40} {count} snapshots, {size or 0} bytes compressed")
+    return written
+
+
+def print_warm_run_status(run_id):
+    run, counts, failed = db.warm_run_summary(run_id)
+    if run is None:
+        print(f"No warm run {run_id}")
+        return
+    _, created_at, finished_at, incremental, status, kind = run
+    mode = "backfill" if kind == "backfill" else ("incremental" if incremental else "full")
+    print(
+        f"Warm run {run_id} ({mode}): {status}, "
+        f"created {datetime.fromtimestamp(created_at):%Y-%m-%d %H:%M:%S}"
+        + (f", finished {datetime.fromtimestamp(finished_at):%Y-%m-%d %H:%M:%S}" if finished_at else "")
+    )
+    print("Items: " + ", ".join(f"{name}={count}" for name, count in sorted(counts.items())))
+    for match_id, http_status, error, attempts in failed[:20]:
+        print(f"  match {match_id}: failed after {attempts} attempt(s) — {http_status or error}")
+    if len(failed) > 20:
+        print(f"  ... and {len(failed) - 20} more failed items")
 
-    try:
-        conn.execute("BEGIN")
-        upsert_rows(conn, rows_to_write)
-        conn.commit()
-    except Exception as e:
-        print(f"Bulk upsert failed: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Pre-populate player match statistics for today's fixtures."
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only fetch matches finished since each team's last run",
+    )
+    parser.add_argument(
+        "--resume",
+        nargs="?",
+        const="latest",
+        metavar="RUN_ID",
+        help="continue a previous run (default: the latest unfinished one); "
+        "done items are skipped and failed ones retried",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("queue", "pipeline"),
+        default="queue",
+        help="queue: plan every team, then fetch the matches as one checkpointed queue "
+        "(default); pipeline: update.py's streaming engine, not checkpointed",
+    )
+    parser.add_argument(
+        "--team",
+        action="append",
+        type=int,
+        metavar="TEAM_ID",
+        help="warm these teams instead of today's fixtures (repeatable)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="plan today's warm and print the upstream calls it needs per endpoint, "
+        "without fetching any match data",
+    )
+    parser.add_argument(
+        "--budget",
+        type=int,
+        metavar="N",
+        help="make at most N upstream requests; the run stops when they are spent "
+        "and can be continued with --resume",
+    )
+    parser.add_argument(
+        "--reprocess",
+        nargs="*",
+        type=int,
+        metavar="MATCH_ID",
+        help="rebuild stored statistics from raw snapshots without upstream calls "
+        "(all snapshotted matches, or only the given ones) and exit",
+    )
+    parser.add_argument(
+        "--status",
+        nargs="?",
+        const="latest",
+        metavar="RUN_ID",
+        help="show a run's progress and failures (default: the latest warm run; "
+        "backfill runs by id) and exit",
+    )
+    args = parser.parse_args(argv)
+
+    if args.status:
+        run_id = db.latest_warm_run_id() if args.status == "latest" else int(args.status)
+        if run_id is None:
+            print("No warm runs recorded yet")
+        else:
+            print_warm_run_status(run_id)
+        return
+
+    if args.reprocess is not None:
+        reprocess_snapshots(args.reprocess)
+        return
+
+    if args.budget is not None:
+        footapi.set_request_budget(args.budget)
+
+    if args.resume:
+        run_id = (
+            db.latest_warm_run_id(unfinished_only=True)
+            if args.resume == "latest"
+            else int(args.resume)
+        )
+        if run_id is None:
+            print("Nothing to resume")
+            return
+        if db.warm_run_kind(run_id) not in (None, "warm"):
+            parser.error(f"run {run_id} is a backfill run; resume it with backfill.py --resume {run_id}")
+        execute_warm_run(run_id)
+        print(f"footapi requests: {footapi.stats()}")
+        return
+
+    get_fixtures(
+        incremental=args.incremental,
+        dry_run=args.dry_run,
+        engine=args.engine,
+        team_ids=args.team,
+    )
 
 
-get_fixtures()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Long-running, kickoff-aware warm scheduler.
+
+Every SCHEDULER_FIXTURES_REFRESH_MINUTES the scheduler reads today's
+/matches/top fixture list and queues two kinds of task per match in the
+scheduler_tasks table (see db.py), which is also how its state is exposed
+(``python scheduler.py --status`` or the app's /scheduler route):
+
+- warm:    ingest both teams' recent stats as a checkpointed run.py warm run
+           (incremental), due SCHEDULER_WARM_LEAD_MINUTES before kickoff; a
+           retry resumes the task's run instead of planning a new one
+- lineups: re-read the match lineups every SCHEDULER_LINEUP_POLL_MINUTES from
+           SCHEDULER_LINEUP_WINDOW_MINUTES before kickoff until they are
+           confirmed, so team and match pages show the real starting XI
+
+Tasks run earliest-due first and, among those, soonest kickoff first. With
+SCHEDULER_DAILY_BUDGET set, the requests left for the day are spread over the
+hours left: after each task the scheduler pauses in proportion to what it spent.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import db
+import footapi
+import run
+from config import (
+    SCHEDULER_DAILY_BUDGET,
+    SCHEDULER_FIXTURES_REFRESH_MINUTES,
+    SCHEDULER_LINEUP_POLL_MINUTES,
+    SCHEDULER_LINEUP_WINDOW_MINUTES,
+    SCHEDULER_WARM_LEAD_MINUTES,
+)
+
+IDLE_SLEEP_SECONDS = 60
+# Stop polling lineups this long after kickoff if they never get confirmed
+LINEUP_GRACE_SECONDS = 15 * 60
+
+
+def schedule_fixtures(now=None):
+    """Queue warm and lineup tasks for today's fixtures; returns how many matches were seen."""
+    now = now or time.time()
+    events = run.todays_events()
+    for event in events:
+        if event.get("status", {}).get("type") != "notstarted":
+            continue
+        kickoff = event["startTimestamp"]
+        day = datetime.fromtimestamp(kickoff).strftime("%Y-%m-%d")
+        warm_due = max(now, kickoff - SCHEDULER_WARM_LEAD_MINUTES * 60)
+        for side in ("homeTeam", "awayTeam"):
+            team_id = event[side]["id"]
+            db.add_scheduler_task(f"warm:{day}:{team_id}", "warm", team_id, kickoff, warm_due)
+        lineup_due = max(now, kickoff - SCHEDULER_LINEUP_WINDOW_MINUTES * 60)
+        db.add_scheduler_task(f"lineups:{event['id']}", "lineups", event["id"], kickoff, lineup_due)
+    return len(events)
+
+
+def run_warm(task):
+    run_id = task["run_id"]
+    if run_id is None:
+        run_id, unplanned = run.plan_warm_run([task["target_id"]], incremental=True)
+        if unplanned:
+            # The team could not be planned: close the empty run and plan again on the retry
+            run.execute_warm_run(run_id)
+            return "pending", "incomplete", time.time() + SCHEDULER_LINEUP_POLL_MINUTES * 60
+        db.set_scheduler_task_run(task["task_key"], run_id)
+    # Retries resume the same run, fetching only its pending and failed items
+    status = run.execute_warm_run(run_id)
+    if status == "done":
+        return "done", status, None
+    return "pending", status, time.time() + SCHEDULER_LINEUP_POLL_MINUTES * 60
+
+
+def run_lineups(task):
+    url = f"https://footapi7.p.rapidapi.com/api/match/{task['target_id']}/lineups"
+    # Read upstream past the cache, refreshing the cached copy for the web pages
+    lineups = footapi.get_json(url, {}, refresh=True)
+    if lineups.get("confirmed"):
+        return "done", "confirmed", None
+    if time.time() > task["kickoff"] + LINEUP_GRACE_SECONDS:
+        return "expired", "never confirmed", None
+    return "pending", "not confirmed", time.time() + SCHEDULER_LINEUP_POLL_MINUTES * 60
+
+
+TASK_RUNNERS = {"warm": run_warm, "lineups": run_lineups}
+
+
+def _seconds_until_midnight(now):
+    tomorrow = datetime.fromtimestamp(now).date() + timedelta(days=1)
+    return max(1.0, datetime.combine(tomorrow, datetime.min.time()).timestamp() - now)
+
+
+def budget_pause(spent_today, last_cost, now):
+    """Seconds to wait after a task that cost last_cost requests (0 without a budget)."""
+    if SCHEDULER_DAILY_BUDGET <= 0:
+        return 0.0
+    remaining = SCHEDULER_DAILY_BUDGET - spent_today
+    seconds_left = _seconds_until_midnight(now)
+    if remaining <= 0:
+        return seconds_left
+    # Pace at the rate that would use the rest of the budget exactly by midnight
+    return min(seconds_left, last_cost * seconds_left / remaining)
+
+
+def run_forever():
+    next_fixtures_at = 0.0
+    spent_day = datetime.now().date()
+    spent_today = 0
+    while True:
+        now = time.time()
+        if datetime.now().date() != spent_day:
+            spent_day, spent_today = datetime.now().date(), 0
+
+        if now >= next_fixtures_at:
+            try:
+                seen = schedule_fixtures(now)
+                print(f"Scheduler: {seen} fixtures today")
+            except Exception as e:
+                print(f"Scheduler: could not read fixtures: {e}")
+            next_fixtures_at = now + SCHEDULER_FIXTURES_REFRESH_MINUTES * 60
+
+        if SCHEDULER_DAILY_BUDGET > 0 and spent_today >= SCHEDULER_DAILY_BUDGET:
+            time.sleep(min(IDLE_SLEEP_SECONDS, _seconds_until_midnight(now)))
+            continue
+
+        task = db.next_scheduler_task(now)
+        if task is None or task["due_at"] > now:
+            wake_at = min(next_fixtures_at, task["due_at"] if task else next_fixtures_at)
+            time.sleep(max(1.0, min(IDLE_SLEEP_SECONDS, wake_at - now)))
+            continue
+
+        upstream_before = footapi.stats().get("upstream", 0)
+        try:
+            status, result, due_at = TASK_RUNNERS[task["kind"]](task)
+        except Exception as e:
+            # Retry failed tasks after a poll interval instead of dropping them
+            status, result = "pending", f"error: {e}"
+            due_at = time.time() + SCHEDULER_LINEUP_POLL_MINUTES * 60
+        db.update_scheduler_task(task["task_key"], status, result, due_at)
+
+        cost = footapi.stats().get("upstream", 0) - upstream_before
+        spent_today += cost
+        print(f"Scheduler: {task['task_key']} -> {status} ({result}), {cost} requests, {spent_today} today")
+        pause = budget_pause(spent_today, cost, time.time())
+        if pause > 0:
+            time.sleep(min(pause, IDLE_SLEEP_SECONDS * 10))
+
+
+def print_status():
+    since = datetime.combine(datetime.now().date(), datetime.min.time()).timestamp()
+    tasks = db.scheduler_tasks(since_kickoff=since)
+    if not tasks:
+        print("No scheduled tasks for today")
+        return
+    for task in tasks:
+        print(
+            f"{task['task_key']:<28} {task['status']:<8} "
+            f"kickoff {datetime.fromtimestamp(task['kickoff']):%H:%M}  "
+            f"due {datetime.fromtimestamp(task['due_at']):%H:%M:%S}  "
+            f"runs {task['runs']}  {task['last_result'] or ''}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Warm team stats and lineups ahead of today's kickoffs."
+    )
+    parser.add_argument(
+        "--status", action="store_true", help="print today's task queue and exit"
+    )
+    args = parser.parse_args(argv)
+    if args.status:
+        print_status()
+        return
+    run_forever()
+
+
+if __name__ == "__main__":
+    main()
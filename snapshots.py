@@ -0,0 +1,112 @@
+"""Raw snapshot store: every upstream match-data response, kept for good.
+
+The response cache expires and only serves repeat requests. This store keeps
+the latest body of each SNAPSHOT_ENDPOINTS response, zlib-compressed in its
+own SQLite file (SNAPSHOTS_PATH), keyed by endpoint label and ids (e.g.
+("match/{id}/player/{id}/statistics", "123,456")). The footapi client writes
+every upstream 200/204 for those endpoints here, so new metrics can be derived
+from history without re-requesting it (``python run.py --reprocess``).
+
+zlib is used rather than zstd to keep the store dependency-free, as in
+response_cache.py.
+"""
+import sqlite3
+import time
+import zlib
+
+import db
+from config import SNAPSHOTS_PATH
+
+SNAPSHOT_ENDPOINTS = frozenset(
+    (
+        "match/{id}",
+        "match/{id}/lineups",
+        "match/{id}/incidents",
+        "match/{id}/player/{id}/statistics",
+        "team/{id}/matches/previous/{id}",
+    )
+)
+SNAPSHOT_STATUSES = (200, 204)
+COMPRESSION_LEVEL = 9
+
+
+
+def enabled():
+    return bool(SNAPSHOTS_PATH)
+
+
+def wanted(endpoint, status_code):
+    return enabled() and endpoint in SNAPSHOT_ENDPOINTS and status_code in SNAPSHOT_STATUSES
+
+
+CREATE_SNAPSHOTS_SQL = """
+    CREATE TABLE IF NOT EXISTS snapshots (
+        endpoint TEXT NOT NULL,
+        ids TEXT NOT NULL,
+        status INT NOT NULL,
+        body BLOB,
+        fetched_at REAL NOT NULL,
+        PRIMARY KEY (endpoint, ids)
+    ) WITHOUT ROWID;
+"""
+
+
+def _get_connection():
+    return db.thread_connection(SNAPSHOTS_PATH, (CREATE_SNAPSHOTS_SQL,))
+
+
+def put(endpoint, ids, status_code, content):
+    """Store (or replace) the snapshot for endpoint + ids; no-op unless wanted()."""
+    if not wanted(endpoint, status_code):
+        return
+    conn = _get_connection()
+    try:
+        conn.execute(
+            "INSERT INTO snapshots(endpoint, ids, status, body, fetched_at) VALUES(?,?,?,?,?) "
+            "ON CONFLICT(endpoint, ids) DO UPDATE SET status=excluded.status, "
+            "body=excluded.body, fetched_at=excluded.fetched_at",
+            (endpoint, ids, status_code, zlib.compress(content or b"", COMPRESSION_LEVEL), time.time()),
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Snapshot write failed for {endpoint} {ids}: {e}")
+
+
+def get(endpoint, ids):
+    """Return (status_code, content) for a stored snapshot, or None."""
+    if not enabled():
+        return None
+    row = _get_connection().execute(
+        "SELECT status, body FROM snapshots WHERE endpoint = ? AND ids = ?", (endpoint, ids)
+    ).fetchone()
+    if row is None:
+        return None
+    status, body = row
+    return status, zlib.decompress(body) if body else b""
+
+
+def iter_snapshots(endpoint):
+    """Yield (ids, status_code, content) for every snapshot of an endpoint.
+
+    ids is a tuple of ints in URL order, e.g. (match_id, player_id).
+    """
+    if not enabled():
+        return
+    cursor = _get_connection().execute(
+        "SELECT ids, status, body FROM snapshots WHERE endpoint = ?", (endpoint,)
+    )
+    for ids, status, body in cursor:
+        yield (
+            tuple(int(i) for i in ids.split(",") if i),
+            status,
+            zlib.decompress(body) if body else b"",
+        )
+
+
+def summary():
+    """Return [(endpoint, snapshots, compressed_bytes)] for every stored endpoint."""
+    if not enabled():
+        return []
+    return _get_connection().execute(
+        "SELECT endpoint, COUNT(*), SUM(LENGTH(body)) FROM snapshots GROUP BY endpoint ORDER BY endpoint"
+    ).fetchall()
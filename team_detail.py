@@ -1,50 +1,26 @@
-import requests
+import asyncio
 import time
 from flask import Flask, render_template, jsonify
-from config import HEADERS
-from requests.exceptions import JSONDecodeError
-import sqlite3
+from config import (
+    FOOTAPI_CONCURRENCY,
+    LINEUP_STATS_INGESTION,
+    TEAM_PAGE_BACKGROUND_INGESTION,
+)
+import threading
+import background
+import db
+from db import fetch_statistics_bulk, fetch_statistics_if_exists, row_is_valid, upsert_rows
+import footapi
+import player_images
+import team_form
+from team_form import last_finished_matches
+from response_cache import IMMUTABLE_TTL
+from incidents import get_incident_index, player_cards as cards_for_player
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 import logging
 import os
 from logging.handlers import RotatingFileHandler
-import random
-
-# Establish a database connection
-conn = sqlite3.connect("database.sqlite")
-
-
-# Create table if it doesn't exist
-def create_table():
-    conn = sqlite3.connect("database.sqlite")
-    try:
-        cur = conn.cursor()
-        create_table_sql = """
-        CREATE TABLE IF NOT EXISTS player_match_statistics (
-            match_id INT,
-            player_id INT,
-            wasFouled INT,
-            fouls INT,
-            shotOffTarget INT,
-            shotOnTarget INT,
-            yellowCardsCount INT,
-            redCard BOOLEAN,
-            avg_minutes_played FLOAT,
-            PRIMARY KEY (match_id, player_id)
-        );
-        """
-        cur.execute(create_table_sql)
-        conn.commit()
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        cur.close()
-        conn.close()
-
-
-# Call create_table function to ensure table exists
-create_table()
 
 # Configure rotating file logger for player stats
 LOG_PATH = os.path.join(os.path.dirname(__file__), "player_stats.log")
@@ -57,163 +33,210 @@ if not player_logger.handlers:
     player_logger.propagate = False
 
 
-def _parse_retry_after(headers):
-    try:
-        val = headers.get("Retry-After") or headers.get("retry-after")
-        if not val:
-            return None
-        return float(val)
-    except Exception:
-        return None
-
+def stats_row(match_id, player_id, fouls_entry, cards_entry, confirmed=True):
+    """Build one player_match_stats row from a fouls/cards entry pair.
 
-def http_get_with_retry(url, headers, max_attempts=8, backoff_base=0.75, backoff_cap=10.0):
-    attempts = 0
-    delays = []
-    last_resp = None
-    while attempts < max_attempts:
-        attempts += 1
-        resp = requests.get(url, headers=headers)
-        status = resp.status_code
-        if status == 200:
-            return resp, attempts, delays
-        # Retry on rate limits and transient errors (do NOT retry 204)
-        if status in (420, 429, 408, 500, 502, 503, 504):
-            retry_after = _parse_retry_after(resp.headers)
-            wait = retry_after if retry_after is not None else min(
-                backoff_cap, backoff_base * (2 ** (attempts - 1)) + random.random() * 0.25
-            )
-            try:
-                print(f"Retry {attempts} ({status}) for {url} — waiting {wait:.2f}s")
-            except Exception:
-                pass
-            try:
-                time.sleep(wait)
-            except Exception:
-                pass
-            delays.append(wait)
-            last_resp = resp
-            continue
-        # Non-retriable
-        return resp, attempts, delays
-    return (last_resp or resp), attempts, delays
-
-
-def get_new_connection():
-    return sqlite3.connect("database.sqlite")
-
-
-def fetch_statistics_if_exists(match_id, player_id):
-    """Fetch player statistics if they exist for a given match_id and player_id."""
-    conn = get_new_connection()  # get a database connection
-    cur = conn.cursor()
-
-    query = """
-        SELECT 
-            wasFouled, fouls, shotOffTarget, shotOnTarget, 
-            yellowCardsCount, redCard, avg_minutes_played
-        FROM player_match_statistics 
-        WHERE match_id = ? AND player_id = ? LIMIT 1
+    confirmed means the entry came from a complete upstream answer (the
+    lineups, or a 200/204/404 from the statistics endpoint). A confirmed
+    player without minutes did not play and gets a NULL minutes_played
+    marker; an unconfirmed one (failed fetch) keeps 0 so it is refetched.
     """
-    cur.execute(query, (match_id, player_id))
-    result = cur.fetchone()
-    conn.close()
-
-    if result:
-        return True, result  # Record exists, return True and the fetched values
-    else:
-        return False, None  # Record does not exist, return False and None
-
-
-def insert_data(match_id, player_id, fouls_data, cards_data, avg_minutes_played_dict, api_context=None, source="api"):
-    fouls_entry = fouls_data[player_id].get(match_id, {})
-    cards_entry = cards_data[player_id].get(match_id, {})
-
-    # Store per-match minutesPlayed in the DB (column name kept for compatibility)
-    if isinstance(fouls_entry, dict):
-        avg_minutes_played = fouls_entry.get("minutesPlayed", 0)
-    else:
-        avg_minutes_played = 0
-
-    was_fouled = fouls_entry.get("wasFouled", 0)
-    fouls = fouls_entry.get("fouls", 0)
-    shot_off_target = fouls_entry.get("shotOffTarget", 0)
-    shot_on_target = fouls_entry.get("shotOnTarget", 0)
-    yellow_cards_count = cards_entry.get("yellowCardsCount", 0)
-    red_card = cards_entry.get("redCard", False)
-
-    sql = (
-        "INSERT INTO player_match_statistics(\n"
-        "  match_id, player_id, wasFouled, fouls, shotOffTarget, shotOnTarget, yellowCardsCount, redCard, avg_minutes_played\n"
-        ") VALUES(?,?,?,?,?,?,?,?,?)\n"
-        "ON CONFLICT(match_id, player_id) DO UPDATE SET\n"
-        "  wasFouled=excluded.wasFouled,\n"
-        "  fouls=excluded.fouls,\n"
-        "  shotOffTarget=excluded.shotOffTarget,\n"
-        "  shotOnTarget=excluded.shotOnTarget,\n"
-        "  yellowCardsCount=excluded.yellowCardsCount,\n"
-        "  redCard=excluded.redCard,\n"
-        "  avg_minutes_played=excluded.avg_minutes_played;"
+    minutes = fouls_entry.get("minutesPlayed", 0)
+    if confirmed and not minutes:
+        minutes = None
+    return (
+        match_id,
+        player_id,
+        fouls_entry.get("wasFouled", 0),
+        fouls_entry.get("fouls", 0),
+        fouls_entry.get("shotOffTarget", 0),
+        fouls_entry.get("shotOnTarget", 0),
+        cards_entry.get("yellowCardsCount", 0),
+        cards_entry.get("redCard", False),
+        minutes,
     )
 
-    conn_local = get_new_connection()
-    db_success = False
+
+def write_rows(rows, source="api"):
+    """Upsert rows in a single transaction so SQLite syncs once per batch, not per row."""
+    if not rows:
+        return
     db_error = None
     try:
-        cur = conn_local.cursor()
-        cur.execute(
-            sql,
-            (
-                match_id,
-                player_id,
-                was_fouled,
-                fouls,
-                shot_off_target,
-                shot_on_target,
-                yellow_cards_count,
-                red_card,
-                avg_minutes_played,
-            ),
-        )
-        conn_local.commit()
-        db_success = True
+        with db.transaction() as conn:
+            upsert_rows(conn, rows)
     except Exception as e:
-        print(f"An error occurred: {e}")
+        print(f"Bulk upsert failed: {e}")
         db_error = str(e)
-    finally:
-        cur.close()
-        conn_local.close()
 
-    # Print a confirmation message
-    print(f"Data for player ID {player_id} in match ID {match_id} successfully added.")
-    # Log full stats for debugging
+    print(f"Saved {len(rows)} player match rows ({source}).")
     try:
         player_logger.info(
             json.dumps(
                 {
-                    "action": "insert_player_match_statistics",
-                    "match_id": match_id,
-                    "player_id": player_id,
-                    "wasFouled": was_fouled,
-                    "fouls": fouls,
-                    "shotOffTarget": shot_off_target,
-                    "shotOnTarget": shot_on_target,
-                    "yellowCardsCount": yellow_cards_count,
-                    "redCard": bool(red_card),
-                    "minutesPlayed": avg_minutes_played,
+                    "action": "upsert_player_match_statistics",
+                    "rows": len(rows),
                     "source": source,
-                    "db": {"success": db_success, "error": db_error},
-                    "api": api_context or {},
+                    "db": {"success": db_error is None, "error": db_error},
                 }
             )
         )
     except Exception as log_err:
-        print(f"Logging failed for player {player_id}, match {match_id}: {log_err}")
+        print(f"Logging failed for batch of {len(rows)} rows: {log_err}")
+
+
+def entries_from_row(stats):
+    """Turn a cached player_match_stats row into (fouls_entry, cards_entry)."""
+    (
+        was_fouled,
+        fouls,
+        shot_off_target,
+        shot_on_target,
+        yellow_cards_count,
+        red_card,
+        avg_minutes,
+    ) = stats
+    fouls_entry = {
+        "wasFouled": was_fouled or 0,
+        "fouls": fouls or 0,
+        "shotOffTarget": shot_off_target or 0,
+        "shotOnTarget": shot_on_target or 0,
+        "minutesPlayed": avg_minutes or 0,
+    }
+    cards_entry = {
+        "yellowCardsCount": yellow_cards_count or 0,
+        "redCard": bool(red_card),
+    }
+    return fouls_entry, cards_entry
+
+
+# Per-process memo of lineup-derived entries: match_id -> {player_id: (fouls_entry, cards_entry)}
+_LINEUP_MEMO_MAX = 500
+_lineup_entries_by_match = {}
+_lineup_locks = {}
+_lineup_guard = threading.Lock()
+
+
+def _fouls_entry_from_statistics(statistics):
+    return {
+        "wasFouled": statistics.get("wasFouled", 0),
+        "fouls": statistics.get("fouls", 0),
+        "shotOffTarget": statistics.get("shotOffTarget", 0),
+        "shotOnTarget": statistics.get("onTargetScoringAttempt", 0),
+        "minutesPlayed": statistics.get("minutesPlayed", 0),
+    }
+
+
+def _ingest_match_lineups(mid, row_sink=None):
+    """Fetch lineups for one match and build a row for every player in it.
+
+    Rows are appended to row_sink when given (the caller flushes them),
+    otherwise written immediately. Returns {player_id: (fouls_entry, cards_entry)}, {} when the match has no
+    lineup data, or None on a transient failure (caller falls back per player).
+    """
+    lineups_url = f"https://footapi7.p.rapidapi.com/api/match/{mid}/lineups"
+    incidents_url = f"https://footapi7.p.rapidapi.com/api/match/{mid}/incidents"
 
+    try:
+        r = footapi.get(lineups_url, max_attempts=10, cache_ttl=IMMUTABLE_TTL)
+    except Exception as e:
+        print(f"Error fetching lineups for match {mid}: {e}")
+        return None
+    if r.status_code != 200:
+        return {} if r.status_code in (204, 404) else None
+    try:
+        lineups = r.json()
+    except ValueError:
+        return {}
+
+    stats_by_player = {}
+    for side in ("home", "away"):
+        for entry in (lineups.get(side) or {}).get("players", []):
+            lineup_player_id = (entry.get("player") or {}).get("id")
+            if lineup_player_id is not None:
+                stats_by_player[lineup_player_id] = entry.get("statistics") or {}
+    if not stats_by_player:
+        return {}
+
+    # Cards are not part of the lineup statistics; read them from the shared incident index
+    incident_index = get_incident_index(mid)
+    if incident_index is None:
+        return None
 
-def fetch_player_matches_concurrently(player_id, finished_matches):
+    api_ctx = {
+        "lineups": {
+            "url": lineups_url,
+            "status_code": r.status_code,
+            "players": len(stats_by_player),
+            "attempts": r.attempts,
+            "delays_s": r.delays,
+        },
+        "incidents": {
+            "url": incidents_url,
+            "ok": True,
+            "response_count": incident_index["count"],
+            "shared_index": True,
+        },
+    }
+    try:
+        player_logger.info(
+            json.dumps({"action": "ingest_match_lineups", "match_id": mid, "api": api_ctx})
+        )
+    except Exception as log_err:
+        print(f"Logging failed for lineups of match {mid}: {log_err}")
+
+    entries = {}
+    rows = []
+    for lineup_player_id, statistics in stats_by_player.items():
+        fouls_entry = _fouls_entry_from_statistics(statistics)
+        cards_entry = cards_for_player(incident_index, lineup_player_id)
+        entries[lineup_player_id] = (fouls_entry, cards_entry)
+        rows.append(stats_row(mid, lineup_player_id, fouls_entry, cards_entry))
+    if row_sink is not None:
+        row_sink.extend(rows)
+    else:
+        write_rows(rows, source="lineups")
+    return entries
+
+
+def fetch_match_lineup_entries(mid, row_sink=None):
+    """Return {player_id: (fouls_entry, cards_entry)} for every player in a match.
+
+    The lineups payload is fetched at most once per match per process; threads
+    asking for the same match wait on the first fetch instead of repeating it.
+    """
+    with _lineup_guard:
+        if mid in _lineup_entries_by_match:
+            return _lineup_entries_by_match[mid]
+        lock = _lineup_locks.setdefault(mid, threading.Lock())
+
+    with lock:
+        with _lineup_guard:
+            if mid in _lineup_entries_by_match:
+                return _lineup_entries_by_match[mid]
+        entries = _ingest_match_lineups(mid, row_sink)
+        with _lineup_guard:
+            _lineup_locks.pop(mid, None)
+            if entries is None:
+                return {}
+            if len(_lineup_entries_by_match) >= _LINEUP_MEMO_MAX:
+                _lineup_entries_by_match.pop(next(iter(_lineup_entries_by_match)))
+            _lineup_entries_by_match[mid] = entries
+    return entries
+
+
+def fetch_player_matches_concurrently(
+    player_id, finished_matches, cached_rows=None, row_sink=None, max_workers=FOOTAPI_CONCURRENCY
+):
     """Fetch a player's last N finished matches concurrently and return aggregates.
 
+    cached_rows is the map returned by fetch_statistics_bulk(); when given, the
+    DB is not queried again per match. Newly fetched rows are appended to
+    row_sink for the caller to flush in one transaction, or written at the
+    end of this call when no sink is given. max_workers=1 fetches the matches
+    one after another in the calling thread (for callers that already run
+    players concurrently).
+
     Returns a tuple: (player_fouls_dict, player_cards_dict, avg_minutes)
     """
     player_fouls = {}
@@ -227,54 +250,31 @@ def fetch_player_matches_concurrently(player_id, finished_matches):
     except Exception:
         pass
 
-    # First, check DB for existing rows (sequential to avoid sqlite locking)
+    # First, check existing rows (from the bulk map, or the DB when called standalone)
     missing_ids = []
-    api_ctx_by_mid = {}
+    confirmed = set()
     for match_id in match_ids:
-        exists, stats = fetch_statistics_if_exists(match_id, player_id)
-        if exists and stats:
-            (
-                was_fouled,
-                fouls,
-                shot_off_target,
-                shot_on_target,
-                yellow_cards_count,
-                red_card,
-                avg_minutes,
-            ) = stats
-            existing_is_valid = False
-            try:
-                existing_is_valid = (
-                    (isinstance(avg_minutes, (int, float)) and avg_minutes > 0)
-                    or any([
-                        was_fouled, fouls, shot_off_target, shot_on_target,
-                        yellow_cards_count, 1 if red_card else 0
-                    ])
-                )
-            except Exception:
-                existing_is_valid = False
-
-            if existing_is_valid:
-                player_fouls[match_id] = {
-                    "wasFouled": was_fouled or 0,
-                    "fouls": fouls or 0,
-                    "shotOffTarget": shot_off_target or 0,
-                    "shotOnTarget": shot_on_target or 0,
-                    "minutesPlayed": avg_minutes or 0,
-                }
-                player_cards[match_id] = {
-                    "yellowCardsCount": yellow_cards_count or 0,
-                    "redCard": bool(red_card),
-                }
-                if isinstance(avg_minutes, (int, float)):
-                    minutes_values.append(avg_minutes)
-            else:
-                # Stale/empty row; refetch to correct it
-                missing_ids.append(match_id)
+        if cached_rows is not None:
+            stats = cached_rows.get((match_id, player_id))
+        else:
+            _, stats = fetch_statistics_if_exists(match_id, player_id)
+        if stats and row_is_valid(stats):
+            fouls_entry, cards_entry = entries_from_row(stats)
+            player_fouls[match_id] = fouls_entry
+            player_cards[match_id] = cards_entry
+            # A did-not-play row (NULL minutes) counts as 0 minutes, as before
+            minutes_values.append(fouls_entry["minutesPlayed"])
         else:
+            # Missing, or a stale/empty row; refetch to correct it
             missing_ids.append(match_id)
 
     def fetch_for_match(mid):
+        if LINEUP_STATS_INGESTION:
+            lineup_entries = fetch_match_lineup_entries(mid, row_sink)
+            if player_id in lineup_entries:
+                fouls_entry, cards_entry = lineup_entries[player_id]
+                return mid, fouls_entry, cards_entry, None
+
         statistics_url = f"https://footapi7.p.rapidapi.com/api/match/{mid}/player/{player_id}/statistics"
         incidents_url = f"https://footapi7.p.rapidapi.com/api/match/{mid}/incidents"
 
@@ -282,25 +282,22 @@ def fetch_player_matches_concurrently(player_id, finished_matches):
         yellow_cards_count = 0
         red_card = False
         statistics_status = None
-        incidents_status = None
         incidents_len = 0
         # Extra diagnostics for non-200s (e.g., 420/429)
         statistics_headers = {}
-        incidents_headers = {}
         statistics_body = None
-        incidents_body = None
 
         stats_attempts = 0
         stats_delays = []
         try:
-            r, stats_attempts, stats_delays = http_get_with_retry(
-                statistics_url, HEADERS, max_attempts=10
-            )
+            # Only finished matches reach here, so their statistics never change
+            r = footapi.get(statistics_url, max_attempts=10, cache_ttl=IMMUTABLE_TTL)
+            stats_attempts, stats_delays = r.attempts, r.delays
             statistics_status = r.status_code
             if statistics_status == 200:
                 try:
                     statistics = r.json().get("statistics", {})
-                except JSONDecodeError:
+                except ValueError:
                     statistics = {}
             else:
                 try:
@@ -323,60 +320,15 @@ def fetch_player_matches_concurrently(player_id, finished_matches):
         except Exception as e:
             print(f"Error fetching statistics for match {mid}, player {player_id}: {e}")
 
-        inc_attempts = 0
-        inc_delays = []
-        try:
-            r2, inc_attempts, inc_delays = http_get_with_retry(
-                incidents_url, HEADERS, max_attempts=10
-            )
-            incidents_status = r2.status_code
-            if incidents_status == 200:
-                try:
-                    incidents = r2.json().get("incidents", [])
-                    incidents_len = len(incidents)
-                    yellow_cards_count = sum(
-                        1
-                        for incident in incidents
-                        if incident.get("incidentClass") in ["yellow", "yellowRed"]
-                        and incident.get("player", {}).get("id") == player_id
-                    )
-
-                    red_card = any(
-                        incident
-                        for incident in incidents
-                        if incident.get("incidentClass") in ["red", "yellowRed"]
-                        and incident.get("player", {}).get("id") == player_id
-                    )
-                except json.JSONDecodeError:
-                    incidents = []
-            else:
-                incidents = []
-                try:
-                    incidents_body = r2.text[:500]
-                except Exception:
-                    incidents_body = None
-                try:
-                    incidents_headers = {
-                        k: r2.headers.get(k)
-                        for k in [
-                            "retry-after",
-                            "x-ratelimit-remaining",
-                            "x-ratelimit-reset",
-                            "x-ratelimit-limit",
-                        ]
-                    }
-                except Exception:
-                    incidents_headers = {}
-        except Exception as e:
-            print(f"Error fetching incidents for match {mid}, player {player_id}: {e}")
-
-        fouls_entry = {
-            "wasFouled": statistics.get("wasFouled", 0),
-            "fouls": statistics.get("fouls", 0),
-            "shotOffTarget": statistics.get("shotOffTarget", 0),
-            "shotOnTarget": statistics.get("onTargetScoringAttempt", 0),
-            "minutesPlayed": statistics.get("minutesPlayed", 0),
-        }
+        # Incidents are fetched once per match and shared by every player
+        incident_index = get_incident_index(mid)
+        if incident_index is not None:
+            cards = cards_for_player(incident_index, player_id)
+            yellow_cards_count = cards["yellowCardsCount"]
+            red_card = cards["redCard"]
+            incidents_len = incident_index["count"]
+
+        fouls_entry = _fouls_entry_from_statistics(statistics)
         cards_entry = {"yellowCardsCount": yellow_cards_count, "redCard": red_card}
         api_ctx = {
             "statistics": {
@@ -394,32 +346,49 @@ def fetch_player_matches_concurrently(player_id, finished_matches):
             },
             "incidents": {
                 "url": incidents_url,
-                "status_code": incidents_status,
-                "ok": incidents_status == 200,
+                "ok": incident_index is not None,
                 "response_count": incidents_len,
-                "status_explanation": (
-                    "Enhance Your Calm / Rate limited" if incidents_status in (420, 429) else None
-                ),
-                "headers": incidents_headers,
-                "body": incidents_body,
-                "attempts": inc_attempts,
-                "delays_s": inc_delays,
+                "shared_index": True,
             },
         }
         return mid, fouls_entry, cards_entry, api_ctx
 
     if missing_ids:
-        max_workers = min(3, len(missing_ids))
         total_jobs = len(missing_ids)
         completed_jobs = 0
         last_percent = -1
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # The footapi client caps requests in flight process-wide
+        executor = None
+        if max_workers > 1 and total_jobs > 1:
+            executor = ThreadPoolExecutor(max_workers=min(max_workers, total_jobs))
             futures = [executor.submit(fetch_for_match, mid) for mid in missing_ids]
-            for fut in as_completed(futures):
-                mid, fouls_entry, cards_entry, api_ctx = fut.result()
+            results = (fut.result() for fut in as_completed(futures))
+        else:
+            results = map(fetch_for_match, missing_ids)
+        try:
+            for mid, fouls_entry, cards_entry, api_ctx in results:
                 player_fouls[mid] = fouls_entry
                 player_cards[mid] = cards_entry
-                api_ctx_by_mid[mid] = api_ctx
+                # Lineup entries are complete; so is a 404 (no statistics: the player was not in the match)
+                if api_ctx is None or (
+                    api_ctx["statistics"]["status_code"] in (200, 204, 404) and api_ctx["incidents"]["ok"]
+                ):
+                    confirmed.add(mid)
+                if api_ctx is not None and api_ctx["statistics"]["status_code"] not in (200, 204):
+                    # Only failed upstream calls are logged in full
+                    try:
+                        player_logger.warning(
+                            json.dumps(
+                                {
+                                    "action": "fetch_player_match_statistics",
+                                    "match_id": mid,
+                                    "player_id": player_id,
+                                    "api": api_ctx,
+                                }
+                            )
+                        )
+                    except Exception as log_err:
+                        print(f"Logging failed for player {player_id}, match {mid}: {log_err}")
                 minutes = fouls_entry.get("minutesPlayed", 0)
                 if isinstance(minutes, (int, float)):
                     minutes_values.append(minutes)
@@ -430,6 +399,9 @@ def fetch_player_matches_concurrently(player_id, finished_matches):
                         elapsed = time.time() - player_start_time
                         print(f"Player {player_id}: fetched {completed_jobs}/{total_jobs} matches ({percent}%) — {elapsed:.1f}s elapsed")
                         last_percent = percent
+        finally:
+            if executor is not None:
+                executor.shutdown()
     try:
         total_elapsed = time.time() - player_start_time
         print(f"Player {player_id}: completed in {total_elapsed:.2f}s")
@@ -438,81 +410,225 @@ def fetch_player_matches_concurrently(player_id, finished_matches):
 
     avg_minutes = (sum(minutes_values) / len(minutes_values)) if minutes_values else 0.0
 
-    # Insert newly fetched matches into DB with the computed average
-    if missing_ids:
-        avg_map = {player_id: avg_minutes}
-        for mid in missing_ids:
-            insert_data(
-                mid,
-                player_id,
-                {player_id: player_fouls},
-                {player_id: player_cards},
-                avg_map,
-                api_context=api_ctx_by_mid.get(mid),
-                source="api",
-            )
+    # Queue (or write) newly fetched matches. Lineup-derived entries are included
+    # too: the fan-out that produced them may have belonged to another request.
+    rows = [
+        stats_row(mid, player_id, player_fouls[mid], player_cards[mid], confirmed=mid in confirmed)
+        for mid in missing_ids
+    ]
+    if row_sink is not None:
+        row_sink.extend(rows)
+    else:
+        write_rows(rows, source="api")
 
     return player_fouls, player_cards, avg_minutes
 
 
-def team_detail(team_id):
-    start_time = time.time()
-    # Fetch team details
-    team_url = f"https://footapi7.p.rapidapi.com/api/team/{team_id}"
-    team_response = requests.get(team_url, headers=HEADERS)
-    team = team_response.json().get("team", {})
+def cells_from_rows(cached_rows, player_ids, finished_matches):
+    """Build the team page's per-player maps from cached rows alone (no upstream calls).
 
-    # Fetch players for the team
-    players_url = f"https://footapi7.p.rapidapi.com/api/team/{team_id}/players"
-    players_response = requests.get(players_url, headers=HEADERS)
-    players = players_response.json().get("players", [])
+    Returns (fouls_data, cards_data, avg_minutes_played, stale_player_ids); a
+    player is stale when any of its matches has no row or only an empty one.
+    """
+    fouls_data = {}
+    cards_data = {}
+    avg_minutes_played = {}
+    stale_player_ids = []
+    for player_id in player_ids:
+        player_fouls = {}
+        player_cards = {}
+        minutes_values = []
+        stale = False
+        for match in finished_matches:
+            stats = cached_rows.get((match["id"], player_id))
+            if not stats:
+                stale = True
+                continue
+            if not row_is_valid(stats):
+                stale = True
+            player_fouls[match["id"]], player_cards[match["id"]] = entries_from_row(stats)
+            minutes_values.append(player_fouls[match["id"]]["minutesPlayed"])
+        fouls_data[player_id] = player_fouls
+        cards_data[player_id] = player_cards
+        avg_minutes_played[player_id] = (
+            (sum(minutes_values) / len(minutes_values)) if minutes_values else 0.0
+        )
+        if stale:
+            stale_player_ids.append(player_id)
+    return fouls_data, cards_data, avg_minutes_played, stale_player_ids
+
+
+def collect_team_stats(player_ids, finished_matches, cached_rows):
+    """Fetch every player's stats in the request thread and flush them in one write.
+
+    This is the blocking path used when TEAM_PAGE_BACKGROUND_INGESTION is off.
+    Returns (fouls_data, cards_data, avg_minutes_played).
+    """
+    fouls_data = {}
+    cards_data = {}
+    avg_minutes_played = {}
+
+    # Rows from every player are flushed in one write transaction at the end
+    rows_to_write = []
+
+    total_players = len(player_ids)
+    current_player_index = 0
+    players_start_time = time.time()
+    # Players run concurrently, each fetching its matches serially; the footapi
+    # semaphore bounds upstream load
+    with ThreadPoolExecutor(max_workers=max(1, min(FOOTAPI_CONCURRENCY, total_players))) as executor:
+        futures = {
+            executor.submit(
+                fetch_player_matches_concurrently,
+                player_id,
+                finished_matches,
+                cached_rows,
+                rows_to_write,
+                1,
+            ): player_id
+            for player_id in player_ids
+        }
+        for fut in as_completed(futures):
+            player_id = futures[fut]
+            player_fouls, player_cards, player_avg = fut.result()
+
+            fouls_data[player_id] = player_fouls
+            cards_data[player_id] = player_cards
+            avg_minutes_played[player_id] = player_avg
+            current_player_index += 1
+            if total_players > 0:
+                pcent = int((current_player_index * 100) / total_players)
+                elapsed_players = time.time() - players_start_time
+                print(f"Players processed: {current_player_index}/{total_players} ({pcent}%) — {elapsed_players:.1f}s elapsed")
+
+    write_rows(rows_to_write, source="team_detail")
+    return fouls_data, cards_data, avg_minutes_played
 
-    # Fetch the last 5 matches for the team
-    matches_url = (
-        f"https://footapi7.p.rapidapi.com/api/team/{team_id}/matches/previous/0"
+
+def enqueue_team_stats(team_id, player_ids, finished_matches, cached_rows=None):
+    """Fetch the given players' stats in the background; returns the job status.
+
+    Each player's rows are written as soon as that player completes, so the
+    page's poller sees cells fill in progressively. A team already queued or
+    running is not queued twice.
+    """
+
+    def ingest_player(player_id):
+        # The job already runs players concurrently; one thread per player is enough
+        fetch_player_matches_concurrently(player_id, finished_matches, cached_rows, max_workers=1)
+
+    return background.submit(("team", team_id), ingest_player, player_ids)
+
+
+def team_stats(team_id):
+    """JSON polled by the team page: every cached cell plus background job progress."""
+    players = footapi.get_json(
+        f"https://footapi7.p.rapidapi.com/api/team/{team_id}/players", {}
+    ).get("players", [])
+    form = team_form.get_team_form(team_id)
+    all_matches = form["events"] if form else []
+    finished_matches = last_finished_matches(all_matches)
+    player_ids = [player_data["player"]["id"] for player_data in players]
+
+    cached_rows = fetch_statistics_bulk(
+        [match["id"] for match in finished_matches], player_ids
+    )
+    fouls_data, cards_data, _, stale_players = cells_from_rows(
+        cached_rows, player_ids, finished_matches
     )
-    next_matches_response = requests.get(matches_url, headers=HEADERS)
-    all_matches = next_matches_response.json().get("events", [])
-    print(all_matches[0]["status"])
 
-    # Fetch the next match for the team
-    next_matches_url = (
-        f"https://footapi7.p.rapidapi.com/api/team/{team_id}/matches/next/0"
+    job = background.status(("team", team_id))
+    if job is None and stale_players:
+        # The page was rendered by another worker process (or before a restart)
+        job = enqueue_team_stats(team_id, stale_players, finished_matches, cached_rows)
+
+    cells = {
+        str(player_id): {
+            str(match_id): {**fouls_entry, **cards_data[player_id][match_id]}
+            for match_id, fouls_entry in player_fouls.items()
+        }
+        for player_id, player_fouls in fouls_data.items()
+    }
+    return jsonify(
+        {
+            "team_id": team_id,
+            "cells": cells,
+            "stale_players": len(stale_players),
+            "job": job,
+            "done": job is None or job["status"] == "done",
+        }
     )
-    next_matches_response = requests.get(next_matches_url, headers=HEADERS)
-    next_matches = next_matches_response.json().get("events", [])
-    next_match_id = next_matches[0]["id"]
 
-    near_matches_url = (
-        next_matches_url
-    ) = f"https://footapi7.p.rapidapi.com/api/team/{team_id}/matches/near"
-    near_matches_response = requests.get(near_matches_url, headers=HEADERS)
-    near_matches = near_matches_response.json().get("previousEvent", [])
-    previous_event = near_matches["status"]
-    print(previous_event)
-    previous_match_id = near_matches["id"]
 
-    near_matches_response = requests.get(near_matches_url, headers=HEADERS)
-    near_matches = near_matches_response.json().get("nextEvent", [])
-    next_match = near_matches["status"]
-    next_match_id = near_matches["id"]
+async def _fetch_near_and_lineups(team_id):
+    """Fetch matches/near once, then start the lineup fetch for the live/next match right away.
+
+    Returns (live_match_id, lineup_response).
+    """
+    near_matches_url = f"https://footapi7.p.rapidapi.com/api/team/{team_id}/matches/near"
+    near_matches_response = await footapi.fetch(near_matches_url)
+    near_matches = near_matches_response.json()
+
+    previous_match = near_matches.get("previousEvent", [])
+    previous_event = previous_match["status"]
+    print(previous_event)
     if previous_event["type"] == "inprogress":
         print("game in progress")
-        live_match_id = previous_match_id
-    if previous_event["type"] != "inprogress":
+        live_match_id = previous_match["id"]
+    else:
         print("game coming up")
-        live_match_id = next_match_id
+        live_match_id = near_matches.get("nextEvent", [])["id"]
 
     # Fetch lineups for the match
     lineup_url = f"https://footapi7.p.rapidapi.com/api/match/{live_match_id}/lineups"
-    lineup_response = requests.get(lineup_url, headers=HEADERS)
+    lineup_response = await footapi.fetch(lineup_url)
+    return live_match_id, lineup_response
+
+
+async def fetch_team_header(team_id):
+    """Fetch everything the team page needs before stats work starts, concurrently.
+
+    Returns (team_response, players_response, previous_form (team_form.py,
+    None if unavailable), next_matches_response, (live_match_id, lineup_response)).
+    """
+    base_url = f"https://footapi7.p.rapidapi.com/api/team/{team_id}"
+    return await asyncio.gather(
+        footapi.fetch(base_url),
+        footapi.fetch(f"{base_url}/players"),
+        team_form.fetch_team_form(team_id),
+        footapi.fetch(f"{base_url}/matches/next/0"),
+        _fetch_near_and_lineups(team_id),
+    )
+
+
+def team_detail(team_id):
+    start_time = time.time()
+    # Team, players, previous/next matches and near -> lineups in about two round-trips
+    (
+        team_response,
+        players_response,
+        previous_form,
+        next_matches_response,
+        (live_match_id, lineup_response),
+    ) = footapi.run(fetch_team_header(team_id))
+
+    team = team_response.json().get("team", {})
+    players = players_response.json().get("players", [])
+
+    # The last matches for the team
+    all_matches = previous_form["events"] if previous_form else []
+    print(all_matches[0]["status"])
+
+    # The next match for the team
+    next_matches = next_matches_response.json().get("events", [])
+    next_match_id = next_matches[0]["id"]
 
     # Check if the lineup request was successful
     if lineup_response.status_code == 200:
         try:
             lineups = lineup_response.json()
 
-        except JSONDecodeError:
+        except ValueError:
             print("Failed to decode JSON for lineups data")
             lineups = {"home": {}, "away": {}}  # Provide a default value
     else:
@@ -541,39 +657,51 @@ def team_detail(team_id):
 
     # Check to see if they currently have a match
 
-    last_5_matches = all_matches[::-1][:10]
-    last_5_finished_matches = [
-        match
-        for match in all_matches[::-1]
-        if match.get("status", {}).get("type") == "finished"
-    ][:10]
+    last_5_finished_matches = last_finished_matches(all_matches)
+    player_ids = [player_data["player"]["id"] for player_data in players]
 
-    fouls_data = {}
-    cards_data = {}
-    avg_minutes_played = {}
+    # One query for every cached (match, player) pair of the squad
+    cached_rows = fetch_statistics_bulk(
+        [match["id"] for match in last_5_finished_matches], player_ids
+    )
 
-    total_players = len(players)
-    current_player_index = 0
     players_start_time = time.time()
-    for player_data in players:
-        player_id = player_data["player"]["id"]
-
-        player_fouls, player_cards, player_avg = fetch_player_matches_concurrently(
-            player_id, last_5_finished_matches
+    stats_job = None
+    if TEAM_PAGE_BACKGROUND_INGESTION:
+        # Render whatever SQLite already has; missing/stale pairs are fetched in
+        # the background and the page polls team_stats() to fill them in
+        fouls_data, cards_data, avg_minutes_played, stale_players = cells_from_rows(
+            cached_rows, player_ids, last_5_finished_matches
+        )
+        if stale_players:
+            db.record_team(team_id, last_5_finished_matches, players)
+            stats_job = enqueue_team_stats(
+                team_id, stale_players, last_5_finished_matches, cached_rows
+            )
+    else:
+        db.record_team(team_id, last_5_finished_matches, players)
+        fouls_data, cards_data, avg_minutes_played = collect_team_stats(
+            player_ids, last_5_finished_matches, cached_rows
         )
-
-        fouls_data[player_id] = player_fouls
-        cards_data[player_id] = player_cards
-        avg_minutes_played[player_id] = player_avg
-        current_player_index += 1
-        if total_players > 0:
-            pcent = int((current_player_index * 100) / total_players)
-            elapsed_players = time.time() - players_start_time
-            print(f"Players processed: {current_player_index}/{total_players} ({pcent}%) — {elapsed_players:.1f}s elapsed")
 
     try:
         total_elapsed_players = time.time() - players_start_time
-        print(f"All players processed in {total_elapsed_players:.2f}s")
+        if stats_job is None:
+            print(f"All players processed in {total_elapsed_players:.2f}s")
+        else:
+            print(f"Queued {stats_job['total']} players for background ingestion in {total_elapsed_players:.2f}s")
+        # Process-wide client counters: upstream attempts vs cache hits and coalesced duplicates
+        player_logger.info(
+            json.dumps(
+                {
+                    "action": "team_detail_summary",
+                    "team_id": team_id,
+                    "elapsed_s": round(time.time() - start_time, 2),
+                    "background_players": stats_job["total"] if stats_job else 0,
+                    "footapi": footapi.stats(),
+                }
+            )
+        )
     except Exception:
         pass
 
@@ -587,4 +715,6 @@ def team_detail(team_id):
         cards_data=cards_data,
         lineups=lineups,
         avg_minutes_played=avg_minutes_played,
+        stats_pending=stats_job is not None,
+        photo_sprite=player_images.sprite_for(player_ids),
     )
@@ -0,0 +1,164 @@
+"""Shared per-team form: each team's matches/previous/0 list with results.
+
+match_detail.py (the last 10 matches of both teams) and team_detail.py (the
+finished matches the stats table covers) read a team's previous matches from
+here instead of each fetching matches/previous/0 and re-scanning it. A form is
+built once per fetch: every match gets its "result" from the team's point of
+view ("win", "loss", "draw", or "pending" without a winnerCode). Concurrent
+fetches for the same team share one upstream request (footapi coalescing).
+
+A form is reused for TEAM_FORM_TTL seconds, or PENDING_FORM_TTL while one of
+its matches has no result yet. A caller looking at a finished match passes it
+as finished_match: if the form has no result for it, the form is stale and is
+re-fetched past the response cache, so a new result shows up right away.
+"""
+import asyncio
+import threading
+import time
+
+import footapi
+
+TEAM_FORM_TTL = 10 * 60
+PENDING_FORM_TTL = 60
+_FORMS_MAX = 1000
+
+# team_id -> (fetched_at, form)
+_forms = {}
+_guard = threading.Lock()
+
+
+def _previous_url(team_id):
+    return f"https://footapi7.p.rapidapi.com/api/team/{team_id}/matches/previous/0"
+
+
+def match_result(match, team_id):
+    """"win", "loss" or "draw" for team_id, or "pending" if the match has no winnerCode."""
+    if "winnerCode" not in match:
+        return "pending"
+    if match["winnerCode"] == 1:
+        return "win" if match["homeTeam"]["id"] == team_id else "loss"
+    if match["winnerCode"] == 2:
+        return "win" if match["awayTeam"]["id"] == team_id else "loss"
+    return "draw"
+
+
+def build_team_form(team_id, events):
+    """Build a team's form from a matches/previous events list (oldest first, as upstream sends it).
+
+    Returns a dict with:
+      events:  the events list as received
+      recent:  copies of the events with "result" added, newest first
+      results: match_id -> result
+      checked: finished match ids the upstream list was re-read for and
+               still lacked (so they do not trigger another refresh)
+    """
+    recent = [{**match, "result": match_result(match, team_id)} for match in events[::-1]]
+    return {
+        "events": events,
+        "recent": recent,
+        "results": {match["id"]: match["result"] for match in recent},
+        "checked": set(),
+    }
+
+
+def last_finished_matches(all_matches, limit=10):
+    """Most recent finished matches first, from a matches/previous events list."""
+    return [
+        match
+        for match in all_matches[::-1]
+        if match.get("status", {}).get("type") == "finished"
+    ][:limit]
+
+
+def last_matches(form, exclude_match_id=None, limit=10):
+    """The form's most recent matches with results, newest first, without exclude_match_id."""
+    if not form:
+        return []
+    return [match for match in form["recent"] if match["id"] != exclude_match_id][:limit]
+
+
+def _cached(team_id):
+    cached = _forms.get(team_id)
+    if cached is None:
+        return None
+    fetched_at, form = cached
+    pending = "pending" in form["results"].values()
+    if time.time() - fetched_at < (PENDING_FORM_TTL if pending else TEAM_FORM_TTL):
+        return form
+    return None
+
+
+def _lacks_result(form, match):
+    """True if finished match is recent enough to be in form but has no result there.
+
+    Matches older than the form's oldest match (outside matches/previous/0)
+    never count, nor do matches an upstream fetch of this form already lacked.
+    """
+    if match is None or form["results"].get(match["id"], "pending") != "pending":
+        return False
+    if match["id"] in form["checked"]:
+        return False
+    oldest = min((event.get("startTimestamp") or 0 for event in form["events"]), default=0)
+    return (match.get("startTimestamp") or 0) >= oldest
+
+
+async def _fetch_form(team_id, refresh=False):
+    """Fetch and build a form; returns (form or None, whether it came from the response cache)."""
+    try:
+        # refresh reads past the response cache, which would hand back the same stale list
+        response = await footapi.fetch(_previous_url(team_id), refresh=refresh)
+    except footapi.FootapiError as e:
+        print(f"Previous matches fetch failed for team {team_id}: {e}")
+        return None, False
+    if response.status_code != 200:
+        print(f"Previous matches fetch for team {team_id} returned {response.status_code}")
+        return None, False
+    try:
+        events = response.json().get("events", [])
+    except ValueError:
+        return None, False
+    return build_team_form(team_id, events), response.from_cache
+
+
+async def fetch_team_form(team_id, finished_match=None):
+    """Return a team's form, fetching matches/previous/0 only if the cached one is stale.
+
+    finished_match is a finished event the caller is looking at: a form
+    without its result is stale, and is re-fetched past the response cache.
+    Returns None if the list could not be fetched.
+    """
+    with _guard:
+        form = _cached(team_id)
+    if form is not None and not _lacks_result(form, finished_match):
+        return form
+    refresh = form is not None
+    form, from_cache = await _fetch_form(team_id, refresh=refresh)
+    if form is not None and from_cache and _lacks_result(form, finished_match):
+        form, from_cache = await _fetch_form(team_id, refresh=True)
+    if form is None:
+        return None
+    if not from_cache and _lacks_result(form, finished_match):
+        # The upstream has not caught up yet; wait for the TTL rather than re-reading every view
+        form["checked"].add(finished_match["id"])
+    with _guard:
+        if team_id not in _forms and len(_forms) >= _FORMS_MAX:
+            _forms.pop(next(iter(_forms)))
+        _forms[team_id] = (time.time(), form)
+    return form
+
+
+async def fetch_team_forms(team_ids, finished_match=None):
+    """fetch_team_form() for several teams concurrently; forms in team_ids order."""
+    return await asyncio.gather(
+        *(fetch_team_form(team_id, finished_match) for team_id in team_ids)
+    )
+
+
+def get_team_form(team_id, finished_match=None):
+    """Blocking wrapper around fetch_team_form() for Flask views."""
+    return footapi.run(fetch_team_form(team_id, finished_match))
+
+
+def get_team_forms(team_ids, finished_match=None):
+    """Blocking wrapper around fetch_team_forms()."""
+    return footapi.run(fetch_team_forms(team_ids, finished_match))
@@ -0,0 +1,241 @@
+"""Player photo thumbnails: small WebP copies of the photos in static/images.
+
+Templates show photos at 50x50 at most, but upstream photos are 150x150
+JPEGs, PNGs or WebPs (whatever the upstream sends, all saved as *_image.png).
+make_thumbnails() writes one copy per THUMBNAIL_SIZES into
+static/images/thumbs, named after the original's content hash
+(``<sha1[:16]>-<size>.webp``), so a replaced photo never serves a stale
+thumbnail. player_images makes them when a photo is downloaded and serves them
+from /player-image/<player_id>/<size>; ``python thumbnails.py`` backfills the
+photos already on disk.
+
+make_sprite() lays a page's thumbnails side by side in one image (a sprite
+sheet in static/images/sprites, see player_images.sprite_for), so a lineup or
+squad costs one request instead of one per player.
+
+Pillow is optional. Without it no thumbnails or sprites are made and the
+original photos are served as before; if it was built without WebP,
+thumbnails and sprites are PNGs.
+"""
+import argparse
+import glob
+import hashlib
+import os
+import threading
+import time
+
+from tqdm import tqdm
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+THUMBNAIL_SIZES = (64, 128)
+THUMBNAIL_DIRNAME = "thumbs"
+SPRITE_DIRNAME = "sprites"
+# --prune deletes sprites older than this; they are rebuilt on their next request
+SPRITE_TTL = 30 * 24 * 3600
+WEBP_QUALITY = 80
+MIMETYPES = {"webp": "image/webp", "png": "image/png"}
+
+_format = None
+
+
+def available():
+    return Image is not None
+
+
+def thumbnail_format():
+    """"webp" if Pillow can write it, else "png"; None without Pillow."""
+    global _format
+    if Image is None:
+        return None
+    if _format is None:
+        _format = "webp" if features.check("webp") else "png"
+    return _format
+
+
+def content_hash(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def thumbnail_path(image_path, digest, size):
+    """Where the size thumbnail of the photo at image_path (content hash digest) lives; None without Pillow."""
+    image_format = thumbnail_format()
+    if image_format is None:
+        return None
+    return os.path.join(
+        os.path.dirname(image_path), THUMBNAIL_DIRNAME, f"{digest[:16]}-{size}.{image_format}"
+    )
+
+
+def sprite_path(image_dir, key, size):
+    """Where the size sprite named key lives; None without Pillow."""
+    image_format = thumbnail_format()
+    if image_format is None:
+        return None
+    return os.path.join(image_dir, SPRITE_DIRNAME, f"{key}-{size}.{image_format}")
+
+
+def _save_image(image, path):
+    # Write to a temporary name first so readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if thumbnail_format() == "webp":
+        image.save(tmp_path, "WEBP", quality=WEBP_QUALITY, method=6)
+    else:
+        image.save(tmp_path, "PNG", optimize=True)
+    os.replace(tmp_path, path)
+
+
+def _write(image, size, path):
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size), Image.LANCZOS)
+    _save_image(thumbnail, path)
+
+
+def make_thumbnails(image_path, digest=None, sizes=THUMBNAIL_SIZES):
+    """Write the missing thumbnails of the photo at image_path; returns how many were written.
+
+    digest is the photo's sha1 (computed from the file if not given).
+    Unreadable photos are reported and skipped.
+    """
+    if Image is None:
+        return 0
+    if digest is None:
+        with open(image_path, "rb") as f:
+            digest = content_hash(f.read())
+    missing = [
+        (size, thumbnail_path(image_path, digest, size))
+        for size in sizes
+        if not os.path.exists(thumbnail_path(image_path, digest, size))
+    ]
+    if not missing:
+        return 0
+    try:
+        with Image.open(image_path) as image:
+            image.load()
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            os.makedirs(os.path.dirname(missing[0][1]), exist_ok=True)
+            for size, path in missing:
+                _write(image, size, path)
+    except OSError as e:
+        print(f"Could not make thumbnails of {image_path}: {e}")
+        return 0
+    return len(missing)
+
+
+def thumbnail(image_path, digest, size):
+    """Return the path of a photo's size thumbnail, making it if needed; None if it cannot be made."""
+    path = thumbnail_path(image_path, digest, size)
+    if path is None:
+        return None
+    if not os.path.exists(path):
+        make_thumbnails(image_path, digest)
+    return path if os.path.exists(path) else None
+
+
+def make_sprite(tiles, size, path):
+    """Write a sprite of size x size tiles in a row, one per thumbnail path in tiles.
+
+    Thumbnails are centred in their tile; a None or unreadable tile is left
+    transparent. Returns False if Pillow is missing.
+    """
+    if Image is None:
+        return False
+    sprite = Image.new("RGBA", (size * len(tiles), size), (0, 0, 0, 0))
+    for index, tile in enumerate(tiles):
+        if tile is None:
+            continue
+        try:
+            with Image.open(tile) as thumbnail:
+                thumbnail = thumbnail.convert("RGBA")
+                sprite.paste(
+                    thumbnail,
+                    (
+                        index * size + (size - thumbnail.width) // 2,
+                        (size - thumbnail.height) // 2,
+                    ),
+                )
+        except OSError as e:
+            print(f"Could not add {tile} to sprite: {e}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _save_image(sprite, path)
+    return True
+
+
+def backfill(image_dir, prune=False):
+    """Make thumbnails for every photo in image_dir.
+
+    With prune, also delete thumbnails of replaced photos and sprites older
+    than SPRITE_TTL.
+    """
+    photos = sorted(glob.glob(os.path.join(image_dir, "*_image.png")))
+    written = 0
+    original_bytes = 0
+    thumbnail_bytes = {size: 0 for size in THUMBNAIL_SIZES}
+    thumbnails = set()
+    skipped = 0
+    for photo in tqdm(photos, desc="Making thumbnails"):
+        with open(photo, "rb") as f:
+            content = f.read()
+        if not content:
+            skipped += 1
+            continue
+        digest = content_hash(content)
+        written += make_thumbnails(photo, digest)
+        paths = {size: thumbnail_path(photo, digest, size) for size in THUMBNAIL_SIZES}
+        if not all(os.path.exists(path) for path in paths.values()):
+            skipped += 1
+            continue
+        original_bytes += len(content)
+        for size, path in paths.items():
+            thumbnail_bytes[size] += os.path.getsize(path)
+            thumbnails.add(path)
+
+    print(f"{len(photos)} photos: {written} thumbnails written, {skipped} empty or unreadable photos skipped")
+    print(f"originals: {original_bytes / 1024:.0f} KiB")
+    for size, size_bytes in thumbnail_bytes.items():
+        print(f"{size}px {thumbnail_format()}: {size_bytes / 1024:.0f} KiB")
+
+    if prune:
+        stale = [
+            path
+            for path in glob.glob(os.path.join(image_dir, THUMBNAIL_DIRNAME, "*"))
+            if path not in thumbnails
+        ]
+        for path in stale:
+            os.remove(path)
+        print(f"Removed {len(stale)} stale thumbnails")
+        expired = [
+            path
+            for path in glob.glob(os.path.join(image_dir, SPRITE_DIRNAME, "*"))
+            if os.path.getmtime(path) < time.time() - SPRITE_TTL
+        ]
+        for path in expired:
+            os.remove(path)
+        print(f"Removed {len(expired)} sprites older than {SPRITE_TTL // 86400} days")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Make thumbnails for the player photos already in static/images."
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="also delete thumbnails whose photo was replaced or removed, and old sprites",
+    )
+    args = parser.parse_args(argv)
+
+    if Image is None:
+        parser.error("thumbnails need Pillow (pip install Pillow)")
+    # Imported here: player_images imports this module
+    from player_images import IMAGE_DIR
+
+    backfill(IMAGE_DIR, prune=args.prune)
+
+
+if __name__ == "__main__":
+    main()
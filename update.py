@@ -1,87 +1,183 @@
-from flask import Flask, render_template, jsonify
-import requests
-from datetime import datetime
-from requests.exceptions import JSONDecodeError
-from flask_caching import Cache
-import time
-import os
-from flask import current_app
-from collections import defaultdict
-import json
-import sqlite3
-from config import HEADERS
-from tqdm import tqdm
-import concurrent.futures  # Add this import
+"""Streaming asyncio ingest engine (``python run.py --engine pipeline``).
+
+run.py's default engine plans every team before it fetches the first match.
+This engine streams instead: teams -> matches -> players fan out as one
+pipeline, so a team's matches start ingesting as soon as its previous matches
+and squad arrive, all on the footapi client's shared ClientSession. At most
+`concurrency` matches are in flight; a match shared by several teams is only
+fetched once, with a follow-up for any players the first team did not need.
+
+Rows go through a queue to a single writer task that commits them
+WRITE_BATCH_ROWS at a time instead of once per match. Runs are not
+checkpointed: a failed fetch writes no row and is planned again next run.
+"""
 import asyncio
-import aiohttp
-from datetime import datetime
-
-
-async def get_player_stats(session, sem, player_id, match_id):
-    print("Getting Stats")
-    async with sem:
-        await asyncio.sleep(0.1)  # Delay to prevent burst requests
-        try:
-            player_url = f"https://footapi7.p.rapidapi.com/api/match/{match_id}/player/{player_id}/statistics"
-            async with session.get(player_url, headers=HEADERS) as response:
-                response.raise_for_status()
-                player_match_stats = await response.json()
-                print(player_id, match_id, player_match_stats["statistics"]["rating"])
-        except aiohttp.ClientResponseError as e:
-            print(f"Request error: {e}")
-        except json.JSONDecodeError as e:
-            print(f"JSON decode error: {e}")
-
-
-async def get_players(team_id, match_id):
-    print("Getting Players")
-    url = f"https://footapi7.p.rapidapi.com/api/team/{team_id}/players"
-    response = requests.get(url, headers=HEADERS)
-    if response.status_code == 200:
-        players = response.json()
-        for player in players["player"]:
-            player_id = player["id"]
-            get_player_stats(player_id)
-    else:
-        print("Error in fetching players")
-
-
-def retrieve_previous_fixtures(team_id, match_ids):
-    for match_id in match_ids:
-        url = f"https://footapi7.p.rapidapi.com/api/team/{team_id}/matches/previous/{match_id}"
-        response = requests.get(url, headers=HEADERS)
-        if response.status_code == 200:
-            all_matches = response.json()
-            print(f"Matches for match_id {match_id}: {len(all_matches)}")
-            for match in all_matches["events"]:
-                get_players(team_id, match["id"])
-        else:
-            print(f"Error in fetching matches for match_id {match_id}")
+import time
+
+import db
+import footapi
+import run
+from config import FOOTAPI_CONCURRENCY
+from db import set_team_high_water, upsert_rows
+from team_form import last_finished_matches
+
+WRITE_BATCH_ROWS = 500
+
+
+def _commit(rows):
+    with db.transaction() as conn:
+        upsert_rows(conn, rows)
+
+
+async def _write_rows(queue, counts):
+    """Writer task: commit queued row lists in batches until a None arrives."""
+    batch = []
+    while True:
+        rows = await queue.get()
+        if rows is None:
+            break
+        batch.extend(rows)
+        if len(batch) >= WRITE_BATCH_ROWS:
+            await asyncio.to_thread(_commit, batch)
+            counts["rows"] += len(batch)
+            batch = []
+    if batch:
+        await asyncio.to_thread(_commit, batch)
+        counts["rows"] += len(batch)
+
 
+async def _team_matches(team_id, incremental):
+    """Return (finished_matches, player_ids) for a team, or None if they could not be fetched."""
+    try:
+        previous_response = await footapi.fetch(
+            f"https://footapi7.p.rapidapi.com/api/team/{team_id}/matches/previous/0"
+        )
+        if previous_response.status_code != 200:
+            raise ValueError(f"previous matches status {previous_response.status_code}")
+        finished_matches = last_finished_matches(previous_response.json().get("events", []))
+        if incremental:
+            high_water = await asyncio.to_thread(db.get_team_high_water, team_id)
+            if high_water is not None:
+                finished_matches = [
+                    match
+                    for match in finished_matches
+                    if (match.get("startTimestamp") or 0) > (high_water[1] or 0)
+                ]
+        if not finished_matches:
+            return [], []
+
+        players_response = await footapi.fetch(
+            f"https://footapi7.p.rapidapi.com/api/team/{team_id}/players"
+        )
+        if players_response.status_code != 200:
+            raise ValueError(f"players status {players_response.status_code}")
+        players = players_response.json().get("players", [])
+    except (ValueError, footapi.FootapiError) as e:
+        print(f"Team {team_id}: could not fetch matches or players ({e}), skipping")
+        return None
+    await asyncio.to_thread(db.record_team, team_id, finished_matches, players)
+    return finished_matches, [player_data["player"]["id"] for player_data in players]
+
+
+async def ingest_teams(team_ids, incremental=False, concurrency=FOOTAPI_CONCURRENCY):
+    """Ingest several teams' last finished matches as one streaming pipeline.
+
+    Once a match fails with a quota status (420/429), or the footapi request
+    budget is spent, no further matches are started. High-water marks only
+    advance for teams whose matches all succeeded, after their rows are written.
 
-def get_fixtures():
-    today = datetime.now().strftime("%d/%m/%Y")
-    day, month, year = today.split("/")
-    url = f"https://footapi7.p.rapidapi.com/api/matches/top/{day}/{month}/{year}"
-    response = requests.get(url, headers=HEADERS)
-    data = response.json()
-    events = data.get("events", [])
+    Returns {"teams", "matches", "rows", "failed_teams"}.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    write_queue = asyncio.Queue()
+    counts = {"rows": 0}
+    writer = asyncio.ensure_future(_write_rows(write_queue, counts))
+    stop = asyncio.Event()
+    # match_id -> ingest tasks, and the players already requested for it
+    match_tasks = {}
+    requested = {}
+    # (match_id, player_id) of every row queued, so "rows" counts distinct rows
+    queued = set()
+    completed_teams = []
+    failed_teams = []
 
-    for event in events:
-        current_date = datetime.now().strftime("%d/%m/%Y")
-        formatted_start_date = datetime.fromtimestamp(event["startTimestamp"]).strftime(
-            "%d/%m/%Y"
+    async def ingest(match_id, player_ids):
+        async with semaphore:
+            if stop.is_set() or footapi.budget_exhausted():
+                return False
+            rows, (failed_player_ids, http_status, error) = await run.fetch_match_rows(
+                match_id, player_ids
+            )
+        # A follow-up for a shared match returns its lineup rows again; queue each row once
+        rows = [row for row in rows if (row[0], row[1]) not in queued]
+        queued.update((row[0], row[1]) for row in rows)
+        await write_queue.put(rows)
+        if http_status in run.QUOTA_STATUSES and not stop.is_set():
+            print(f"Upstream quota exhausted ({http_status}); stopping")
+            stop.set()
+        return not failed_player_ids and http_status is None and error is None
+
+    async def ingest_team(team_id):
+        planned = await _team_matches(team_id, incremental)
+        if planned is None:
+            failed_teams.append(team_id)
+            return
+        finished_matches, player_ids = planned
+        if not finished_matches:
+            print(f"Team {team_id}: no matches finished since last run")
+            return
+
+        match_ids = [match["id"] for match in finished_matches]
+        existing = await asyncio.to_thread(db.fetch_statistics_bulk, match_ids, player_ids)
+        for match_id in match_ids:
+            missing = {
+                player_id
+                for player_id in player_ids
+                if not db.row_is_valid(existing.get((match_id, player_id)))
+            } - requested.setdefault(match_id, set())
+            if missing:
+                requested[match_id] |= missing
+                match_tasks.setdefault(match_id, []).append(
+                    asyncio.ensure_future(ingest(match_id, missing))
+                )
+        results = await asyncio.gather(
+            *(task for match_id in match_ids for task in match_tasks.get(match_id, []))
         )
-        if formatted_start_date == current_date:
-            home_team_name = event["homeTeam"]["name"]
-            away_team_name = event["awayTeam"]["name"]
-            home_team_id = event["homeTeam"]["id"]
-            away_team_id = event["awayTeam"]["id"]
-            print("Event : ", home_team_name, " v ", away_team_name)
+        if all(results):
+            newest = max(finished_matches, key=lambda match: match.get("startTimestamp") or 0)
+            completed_teams.append((team_id, newest["id"], newest.get("startTimestamp") or 0))
+        else:
+            failed_teams.append(team_id)
+
+    await asyncio.gather(*(ingest_team(team_id) for team_id in team_ids))
+    await write_queue.put(None)
+    await writer
+
+    if completed_teams:
+        await asyncio.to_thread(_set_high_water, completed_teams)
+    return {
+        "teams": len(team_ids),
+        "matches": len(match_tasks),
+        "rows": counts["rows"],
+        "failed_teams": failed_teams,
+    }
+
 
-            retrieve_previous_fixtures(home_team_id, match_ids=range(10))
-            retrieve_previous_fixtures(away_team_id, match_ids=range(10))
+def _set_high_water(completed_teams):
+    with db.transaction() as conn:
+        for team_id, match_id, start_timestamp in completed_teams:
+            set_team_high_water(conn, team_id, match_id, start_timestamp)
 
 
-if __name__ == "__main__":
-    get_fixtures()
+def warm_teams(team_ids, incremental=False):
+    """Run ingest_teams to completion; returns "done" or "incomplete" like run.warm_teams."""
+    start_time = time.time()
+    summary = footapi.run(ingest_teams(list(dict.fromkeys(team_ids)), incremental))
+    status = "incomplete" if summary["failed_teams"] else "done"
+    print(
+        f"Pipeline {status}: {summary['teams']} teams, {summary['matches']} matches, "
+        f"{summary['rows']} rows in {time.time() - start_time:.2f}s"
+    )
+    if summary["failed_teams"]:
+        print(f"Teams with failures (retried next run): {summary['failed_teams']}")
+    return status